@@ -0,0 +1,188 @@
+"""Campaign claims per second with concurrent dialer workers, and how many customers get dialed twice
+
+Each worker stands for a dialer job in its own process and claims customers until --claims have
+been handed out in total. Three ways of picking customers are compared:
+
+  scan       the old get_customers_to_call: read the first eligible customers, then mark them
+             called once dialed, with no claim in between
+  claim_one  CampaignQueue.claim_one, one find_one_and_update per customer
+  claim      CampaignQueue.claim, a leased batch of --batch customers per round
+
+Database operations per customer claimed are counted alongside. mongomock is not thread-safe,
+so without --mongo-uri every operation is serialized behind one lock (the server's per-operation
+atomicity) and --rtt of simulated network time is added to each. mongomock has no indexes and
+scans the collection in Python for every query, so an unsorted scan that stops at its limit beats
+a sorted claim there; run against a mongod with indexes for real throughput.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import threading
+import contextlib
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from campaign import RECALL_INTERVAL_SECONDS, CallingWindow, CampaignQueue
+
+TIMEZONES = [None, 'America/New_York', 'America/Chicago', 'America/Los_Angeles', 'Europe/London']
+
+
+class CountingCursor:
+    def __init__(self, collection, args, kwargs):
+        self.collection = collection
+        self.args = args
+        self.kwargs = kwargs
+        self.calls = []
+
+    def sort(self, *args):
+        self.calls.append(('sort', args))
+        return self
+
+    def limit(self, *args):
+        self.calls.append(('limit', args))
+        return self
+
+    def __iter__(self):
+        def fetch():
+            cursor = self.collection.collection.find(*self.args, **self.kwargs)
+            for name, args in self.calls:
+                cursor = getattr(cursor, name)(*args)
+            return list(cursor)
+        return iter(self.collection.run(fetch))
+
+
+class CountingCollection:
+    def __init__(self, collection, rtt=0.0, serialize=False):
+        """Counts the operations run on a collection; for mongomock, runs them one at a time after a simulated round trip"""
+        self.collection = collection
+        self.rtt = rtt
+        self.lock = threading.Lock() if serialize else contextlib.nullcontext()
+        self.operations = 0
+        self._count_lock = threading.Lock()
+
+    def run(self, operation, *args, **kwargs):
+        with self._count_lock:
+            self.operations += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+        with self.lock:
+            return operation(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return CountingCursor(self, args, kwargs)
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+        return lambda *args, **kwargs: self.run(method, *args, **kwargs)
+
+
+def seed(customers, count):
+    customers.delete_many({})
+    now = time.time()
+    batch = []
+    for number in range(count):
+        customer = {'phone_number': f"+1555{number:07d}", 'priority': number % 3}
+        if TIMEZONES[number % len(TIMEZONES)]:
+            customer['timezone'] = TIMEZONES[number % len(TIMEZONES)]
+        if number % 4 == 0:
+            # Called a while ago, already due again
+            customer['last_called'] = now - RECALL_INTERVAL_SECONDS - number
+            customer['next_call_at'] = now - number
+        batch.append(customer)
+        if len(batch) == 10000:
+            customers.insert_many(batch)
+            batch = []
+    if batch:
+        customers.insert_many(batch)
+
+
+def scan_worker(customers, batch_size):
+    """The old path: read eligible customers, 'dial' them, then set last_called"""
+    def claim():
+        now = time.time()
+        eligible = {'$or': [{'last_called': {'$exists': False}},
+                            {'last_called': {'$lt': now - RECALL_INTERVAL_SECONDS}}]}
+        batch = list(customers.find(eligible, {'phone_number': 1}).limit(batch_size))
+        for customer in batch:
+            customers.update_one({'_id': customer['_id']}, {'$set': {'last_called': time.time()}})
+        return batch
+    return claim
+
+
+def run(mode, customers, workers, claims, batch_size):
+    window = CallingWindow('00:00', '24:00')
+    claimed = []
+    lock = threading.Lock()
+    queues = [CampaignQueue(customers, window=window, batch_size=batch_size, owner=f"worker-{number}")
+              for number in range(workers)]
+
+    def work(queue):
+        if mode == 'scan':
+            claim = scan_worker(customers, batch_size)
+        elif mode == 'claim_one':
+            claim = lambda: [customer for customer in [queue.claim_one()] if customer]
+        else:
+            claim = queue.claim
+        while True:
+            with lock:
+                if len(claimed) >= claims:
+                    return
+            batch = claim()
+            if not batch:
+                return
+            with lock:
+                claimed.extend(customer['_id'] for customer in batch)
+
+    customers.operations = 0
+    threads = [threading.Thread(target=work, args=(queue,)) for queue in queues]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    duplicates = sum(count - 1 for count in Counter(claimed).values())
+    conflicts = sum(queue.stats['conflicts'] for queue in queues)
+    return len(claimed) / elapsed, len(claimed), customers.operations / len(claimed), duplicates, conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--claims', type=int, default=200, help="Customers handed out per run, across all workers")
+    parser.add_argument('--workers', default='1,8', help="Comma-separated numbers of concurrent dialer workers")
+    parser.add_argument('--batch', type=int, default=10, help="Customers per claim (and per scan)")
+    parser.add_argument('--rtt', type=float, default=0.0005, help="Simulated round trip per mongomock operation")
+    parser.add_argument('--mongo-uri', help="Benchmark against this MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from database import Database
+        if args.mongo_uri:
+            db = Database(mongo_uri=args.mongo_uri, db_name='bench_campaign_queue')
+            db.ensure_indexes()
+            customers = CountingCollection(db.customers)
+        else:
+            import mongomock
+            db = Database(client=mongomock.MongoClient())
+            customers = CountingCollection(db.customers, args.rtt, serialize=True)
+
+    backend = 'mongod' if args.mongo_uri else f"mongomock, {args.rtt * 1000:.1f}ms simulated round trip"
+    print(f"{args.customers} customers, {args.claims} claims per run, batch {args.batch}, {backend}")
+    print(f"\n{'mode':<11}{'workers':>8}{'claims/s':>10}{'claimed':>9}{'ops/claim':>11}{'dialed twice':>14}"
+          f"{'lost races':>12}")
+    for mode in ('scan', 'claim_one', 'claim'):
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            seed(customers, args.customers)
+            with contextlib.redirect_stdout(io.StringIO()):
+                rate, claimed, operations, duplicates, conflicts = run(mode, customers, workers, args.claims,
+                                                                       args.batch)
+            print(f"{mode:<11}{workers:>8}{rate:>10.0f}{claimed:>9}{operations:>11.2f}{duplicates:>14}{conflicts:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Import time, warm-up time and first-request latency of a fresh Flask app process
+
+Every run is a new Python process that imports app.py and serves /handle-call turns through
+the Flask test client, against the fake LLM and Twilio servers and mongomock (or --mongo-uri).
+"cold" sends the first turn straight after the import, so it pays for creating and connecting
+the clients; "warm" runs the readiness warm-up first, as gunicorn's post_worker_init does.
+The slowest imports under app.py come from python -X importtime.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import contextlib
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+sys.path.insert(0, SRC_DIR)
+
+
+def child(args):
+    """One cold start: import, optional warm-up, then a few turns"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    import_seconds = time.perf_counter() - start
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from database import Database
+        if args.mongo_uri:
+            app.db = Database(mongo_uri=args.mongo_uri, db_name='bench_cold_start')
+        else:
+            import mongomock
+            app.db = Database(client=mongomock.MongoClient())
+        app.twilio_client.api.base_url = os.environ['BENCH_TWILIO_URL']
+
+        warm_seconds = None
+        checks = {}
+        if args.warm:
+            start = time.perf_counter()
+            app.readiness.warm_up()
+            warm_seconds = time.perf_counter() - start
+            checks = {name: check['seconds'] for name, check in app.readiness.snapshot()['checks'].items()}
+
+        client = app.app.test_client()
+        turns = []
+        for number in range(args.turns):
+            call_sid = f"CA{number:032d}"
+            client.post('/handle-call', data={'CallSid': call_sid})
+            start = time.perf_counter()
+            client.post('/handle-call', data={'CallSid': call_sid, 'SpeechResult': "How much does it cost?"})
+            turns.append(time.perf_counter() - start)
+
+    print(json.dumps({'import': import_seconds, 'warm': warm_seconds, 'checks': checks, 'turns': turns}))
+
+
+def slowest_imports(env, count):
+    """Modules imported directly by app.py, by cumulative import time"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=SRC_DIR, env=env,
+                            capture_output=True, text=True)
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == 'app':
+                return sorted(children, reverse=True)[:count]
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative) / 1e6, name.strip()))
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="Fresh processes per mode")
+    parser.add_argument('--turns', type=int, default=3, help="Turns per process; the first is the cold one")
+    parser.add_argument('--llm-latency', type=float, default=0.0)
+    parser.add_argument('--mongo-uri', help="Connect to this MongoDB instead of using mongomock")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    from fake_llm_server import start_fake_llm_server
+    from fake_twilio_server import start_fake_twilio_server
+
+    llm = start_fake_llm_server(first_token_delay=args.llm_latency, token_delay=0)
+    twilio = start_fake_twilio_server(latency=0)
+    env = dict(os.environ, OPENAI_BASE_URL=llm.base_url, OPENAI_API_KEY='fake', TWILIO_ACCOUNT_SID='AC' + '0' * 32,
+               TWILIO_AUTH_TOKEN='fake', MONGO_URI=args.mongo_uri or 'mongodb://127.0.0.1:1',
+               MONGO_ENSURE_INDEXES='false', LLM_STREAMING='false', BENCH_TWILIO_URL=twilio.base_url,
+               PYTHONPATH=SRC_DIR)
+
+    print(f"{args.runs} fresh processes per mode, {'mongod' if args.mongo_uri else 'mongomock'}, "
+          f"LLM latency {args.llm_latency * 1000:.0f}ms")
+    print(f"\n{'mode':<6}{'import ms':>11}{'warm-up ms':>12}{'first turn ms':>15}{'later turns ms':>16}"
+          f"{'to first reply ms':>19}")
+    # Modes are interleaved so drift in machine load hits both alike
+    results = {'cold': [], 'warm': []}
+    for _ in range(args.runs):
+        for mode, runs in results.items():
+            command = [sys.executable, os.path.abspath(__file__), '--child', '--turns', str(args.turns)]
+            if args.mongo_uri:
+                command += ['--mongo-uri', args.mongo_uri]
+            if mode == 'warm':
+                command.append('--warm')
+            output = subprocess.run(command, cwd=SRC_DIR, env=env, capture_output=True, text=True, check=True)
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    for mode, runs in results.items():
+        import_ms = statistics.median(run['import'] for run in runs) * 1000
+        warm_ms = statistics.median(run['warm'] for run in runs) * 1000 if mode == 'warm' else 0.0
+        first_ms = statistics.median(run['turns'][0] for run in runs) * 1000
+        later_ms = statistics.median(turn for run in runs for turn in run['turns'][1:]) * 1000
+        print(f"{mode:<6}{import_ms:>11.0f}{warm_ms:>12.0f}{first_ms:>15.1f}{later_ms:>16.1f}"
+              f"{import_ms + warm_ms + first_ms:>19.0f}")
+        if mode == 'warm':
+            checks = ', '.join(f"{name} {statistics.median(run['checks'][name] for run in runs) * 1000:.0f}ms"
+                               for name in runs[0]['checks'])
+            print(f"{'':<6}warm-up checks (concurrent): {checks}")
+
+    print("\nslowest imports under app.py:")
+    for seconds, name in slowest_imports(env, 8):
+        print(f"  {name:<20}{seconds * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Per-turn prompt tokens for a long call: full history versus the token-budgeted context builder"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from call_flow import SYSTEM_PROMPT
+from context_builder import ContextBuilder, count_message_tokens
+
+
+class InstantSummarizer:
+    """Stands in for the background summarizer with a fixed-size summary"""
+
+    def submit(self, session, overflow):
+        session['summary'] = "The customer asked about pricing and integrations and is comparing tools. " * 2
+        del session['history'][:len(overflow)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--turns', type=int, default=40)
+    parser.add_argument('--budget', type=int, default=800)
+    args = parser.parse_args()
+
+    user = "I'd like to know how this works with the project tracker my team already uses every day."
+    assistant = ("It connects to the tracker directly, reads the tasks you move and the commits you push, "
+                 "and drafts the work log entry for you to review at the end of the day.")
+
+    builder = ContextBuilder(SYSTEM_PROMPT, token_budget=args.budget, max_turns=50, summarizer=InstantSummarizer())
+    full_history = []
+    session = {'history': []}
+    total_full = total_budgeted = 0
+
+    print(f"{'turn':>6}{'full history':>16}{'budgeted':>12}")
+    for turn in range(1, args.turns + 1):
+        user_message = {"role": "user", "content": user}
+        full_tokens = count_message_tokens([{"role": "system", "content": SYSTEM_PROMPT}] + full_history + [user_message])
+        messages, budgeted_tokens = builder.build(session, [user_message])
+
+        reply = {"role": "assistant", "content": assistant}
+        full_history += [user_message, reply]
+        session['history'] += [user_message, reply]
+
+        total_full += full_tokens
+        total_budgeted += budgeted_tokens
+        if turn == 1 or turn % 5 == 0:
+            print(f"{turn:>6}{full_tokens:>16}{budgeted_tokens:>12}")
+
+    print(f"total prompt tokens over {args.turns} turns: {total_full} full, {total_budgeted} budgeted "
+          f"({1 - total_budgeted / total_full:.0%} saved)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Campaign eligibility scan throughput at 1M customers, with embedded vs bucketed call history
+
+Three customer shapes and reads are compared:
+
+  embedded             customers that $push every call into call_history (--history calls each,
+                       with the extracted responses), read whole as get_customers_to_call did
+  embedded+projection  the same documents, read with the campaign claim's CLAIM_FIELDS projection
+  bucketed             customers with only the recent_calls summary and call_count, history kept
+                       in call_history buckets, read with the projection
+
+With --mongo-uri, --customers documents of each shape are inserted and the due filter is scanned
+to the end through a cursor. Without it, no server is involved: a sample of --sample documents
+is encoded as BSON and decoded the way the driver would, and the scan time is scaled to
+--customers. The bytes the server reads and sends are computed from the document sizes. The
+document size after --history calls also shows how far a heavily re-dialed customer is from
+MongoDB's 16MB limit.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import bson
+from bson import ObjectId
+
+from call_history import SUMMARY_FIELDS
+from campaign import CLAIM_FIELDS, CallingWindow, CampaignQueue
+
+MAX_DOCUMENT_BYTES = 16 * 1024 * 1024
+TIMEZONES = ['America/New_York', 'America/Chicago', 'America/Los_Angeles', 'Europe/London']
+
+
+def history_entry(number, call):
+    return {
+        'call_sid': f"CA{number:016d}{call:016d}",
+        'timestamp': time.time() - call * 86400,
+        'outcome': 'follow_up',
+        'responses': {'interest_level': 'medium', 'objections': 'too expensive', 'contact_preference': 'email',
+                      'callback_time': 'tomorrow at 10am', 'questions': 'how long is the free trial'}
+    }
+
+
+def customer(number, shape, history):
+    document = {
+        '_id': ObjectId(),
+        'phone_number': f"+1555{number:07d}",
+        'name': f"Customer {number}",
+        'timezone': TIMEZONES[number % len(TIMEZONES)],
+        'priority': number % 3,
+        'next_call_at': time.time() - number,
+        'last_called': time.time() - 30 * 86400,
+        'last_call_outcome': 'follow_up',
+    }
+    entries = [history_entry(number, call) for call in range(history)]
+    if shape == 'embedded':
+        document['call_history'] = entries
+    else:
+        document['recent_calls'] = [{field: entry[field] for field in SUMMARY_FIELDS} for entry in entries[-5:]]
+        document['call_count'] = history
+    return document
+
+
+def project(document, projection):
+    if projection is None:
+        return document
+    return {key: value for key, value in document.items() if key == '_id' or key in projection}
+
+
+def scan_offline(shape, projection, customers, sample, history):
+    """Time the driver's share of a scan on a sample; the server's share is its bytes read"""
+    stored = [bson.encode(customer(number, shape, history)) for number in range(sample)]
+    sent = [bson.encode(project(bson.decode(document), projection)) for document in stored]
+    start = time.perf_counter()
+    for document in sent:
+        bson.decode(document)
+    per_document = (time.perf_counter() - start) / sample
+    stored_bytes = sum(len(document) for document in stored) / sample
+    sent_bytes = sum(len(document) for document in sent) / sample
+    return customers * per_document, stored_bytes, sent_bytes
+
+
+def scan_mongod(collection, shape, projection, customers, history, batch_size=10000):
+    """Insert customers of one shape, then read every due one through a cursor"""
+    collection.drop()
+    batch = []
+    for number in range(customers):
+        batch.append(customer(number, shape, history))
+        if len(batch) == batch_size:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+    stats = collection.database.command('collStats', collection.name)
+
+    queue = CampaignQueue(collection, window=CallingWindow('00:00', '24:00'))
+    due = queue.due_filter(time.time())
+    start = time.perf_counter()
+    sent = 0
+    for document in collection.find(due, projection, batch_size=batch_size):
+        sent += len(bson.encode(document))
+    return time.perf_counter() - start, stats['avgObjSize'], sent / customers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', type=int, default=1000000)
+    parser.add_argument('--history', type=int, default=24, help="Calls per customer (two years of monthly re-dials)")
+    parser.add_argument('--sample', type=int, default=20000, help="Documents decoded per shape without --mongo-uri")
+    parser.add_argument('--mongo-uri', help="Insert and scan --customers documents per shape in this MongoDB")
+    args = parser.parse_args()
+
+    if args.mongo_uri:
+        with contextlib.redirect_stdout(io.StringIO()):
+            from database import Database
+            db = Database(mongo_uri=args.mongo_uri, db_name='bench_customer_scan')
+        collection = db.db['customers']
+        collection.create_index([('timezone', 1), ('priority', -1), ('next_call_at', 1)])
+        backend = 'mongod'
+    else:
+        backend = f"offline BSON decode of {args.sample} documents, scaled"
+    print(f"{args.customers} customers, {args.history} calls each, {backend}")
+
+    entry_bytes = len(bson.encode(history_entry(0, 0)))
+    print(f"embedded call_history: {entry_bytes} bytes per call, 16MB reached after "
+          f"{MAX_DOCUMENT_BYTES // entry_bytes} calls")
+
+    print(f"\n{'mode':<21}{'doc bytes':>10}{'sent bytes':>11}{'scan s':>9}{'customers/s':>13}{'MB read':>9}"
+          f"{'MB sent':>9}")
+    for mode, shape, projection in (('embedded', 'embedded', None),
+                                    ('embedded+projection', 'embedded', CLAIM_FIELDS),
+                                    ('bucketed', 'bucketed', CLAIM_FIELDS)):
+        if args.mongo_uri:
+            seconds, stored, sent = scan_mongod(collection, shape, projection, args.customers, args.history)
+        else:
+            seconds, stored, sent = scan_offline(shape, projection, args.customers, args.sample, args.history)
+        print(f"{mode:<21}{stored:>10.0f}{sent:>11.0f}{seconds:>9.2f}{args.customers / seconds:>13.0f}"
+              f"{args.customers * stored / 2 ** 20:>9.0f}{args.customers * sent / 2 ** 20:>9.0f}")
+    if args.mongo_uri:
+        collection.drop()
+
+
+if __name__ == "__main__":
+    main()
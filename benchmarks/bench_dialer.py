@@ -0,0 +1,63 @@
+"""Measure dialer throughput against a local Twilio API stand-in"""
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from twilio.rest import Client
+
+from fake_twilio_server import start_fake_twilio_server
+from dialer import Dialer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=500)
+    parser.add_argument('--calls-per-second', type=float, default=50)
+    parser.add_argument('--max-concurrent-calls', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help="Twilio API latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.05, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server = start_fake_twilio_server(latency=args.latency, failure_rate=args.failure_rate)
+    client = Client('AC' + '0' * 32, 'fake-token')
+    client.api.base_url = server.base_url
+
+    def create_call(phone_number):
+        return client.calls.create(url='http://localhost/handle-call', to=phone_number, from_='+15550000000').sid
+
+    customers = [{'_id': i, 'phone_number': f"+1555{i:07d}"} for i in range(args.customers)]
+
+    # Sequential baseline: the loop /initiate-calls used to run inside the request
+    sequential = customers[:min(50, len(customers))]
+    start = time.perf_counter()
+    for customer in sequential:
+        try:
+            create_call(customer['phone_number'])
+        except Exception:
+            pass
+    sequential_rate = len(sequential) / (time.perf_counter() - start)
+
+    dialer = Dialer(create_call, record_call=lambda call_sid, customer: None,
+                    calls_per_second=args.calls_per_second, max_concurrent_calls=args.max_concurrent_calls,
+                    workers=args.workers, retry_backoff=0.1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        job = dialer.start(customers)
+        while job.status != 'completed':
+            time.sleep(0.05)
+    result = job.to_dict()
+
+    print(f"Twilio latency {args.latency * 1000:.0f}ms, 429 rate {args.failure_rate:.0%}")
+    print(f"sequential loop:  {sequential_rate:8.1f} calls/s")
+    print(f"dialer:           {result['calls_per_second']:8.1f} calls/s "
+          f"(limit {args.calls_per_second}/s, {args.workers} workers, peak {server.max_in_flight} in flight)")
+    print(f"dialed {result['dialed']}, failed {result['failed']}, retries {result['retries']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Turn latency of AIAgent for each extraction mode: serial, concurrent, background and single-call"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fake_llm_server import start_fake_llm_server
+
+UTTERANCES = [
+    "Hi, who is this?",
+    "We already track our hours in a spreadsheet.",
+    "How much does the pro plan cost?",
+    "Can you send the details to jane@example.com?",
+    "Call me back tomorrow at 10am.",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=4)
+    parser.add_argument('--reply-delay', type=float, default=0.6, help="gpt-4 time to first token")
+    parser.add_argument('--extraction-delay', type=float, default=0.3, help="gpt-3.5-turbo time to first token")
+    parser.add_argument('--token-delay', type=float, default=0.005)
+    args = parser.parse_args()
+
+    server = start_fake_llm_server(
+        token_delay=args.token_delay,
+        model_delays={'gpt-4': args.reply_delay, 'gpt-3.5-turbo': args.extraction_delay}
+    )
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    os.environ.setdefault('TWILIO_ACCOUNT_SID', 'ACfake')
+    os.environ.setdefault('TWILIO_AUTH_TOKEN', 'fake')
+    # Replies from gpt-4, so they stay distinguishable from gpt-3.5-turbo extractions
+    os.environ.setdefault('LLM_PRIMARY_MODEL', 'gpt-4')
+
+    from agent import AIAgent, EXTRACTION_MODES
+
+    print(f"{'mode':<12}{'p50 ms':>10}{'p95 ms':>10}{'llm calls/turn':>16}{'fields':>8}")
+    for mode in EXTRACTION_MODES:
+        agent = AIAgent(extraction_mode=mode)
+        requests_before = server.request_count
+        latencies = []
+        captured = 0
+
+        for call in range(args.calls):
+            call_sid = f"CA_{mode}_{call}"
+            for utterance in UTTERANCES:
+                start = time.perf_counter()
+                agent.process_customer_input(call_sid, utterance)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        # Background extraction lands after the turn; wait for it before counting fields
+        agent.extraction_executor.shutdown(wait=True)
+        for call in range(args.calls):
+            captured += len(agent.conversations[f"CA_{mode}_{call}"]["customer_responses"])
+
+        turns = len(latencies)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if turns > 1 else latencies[0]
+        print(f"{mode:<12}{statistics.median(latencies):>10.0f}{p95:>10.0f}"
+              f"{(server.request_count - requests_before) / turns:>16.1f}{captured / args.calls:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Overhead of the per-stage turn instrumentation, on its own and as a share of a /handle-call turn
+
+The first part times the instrumentation for a typical turn (six stages plus the turn record) in
+a tight loop. The second drives the Flask /handle-call webhook with mongomock and the fake LLM
+server, with metrics off and on, and reports that cost as a share of the median turn.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import statistics
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fake_llm_server import start_fake_llm_server
+
+STAGES = ('mongo_read', 'prompt_build', 'llm_total', 'mongo_write', 'tts', 'twiml_render')
+
+
+def instrumentation_cost(turns, turn_log):
+    """Seconds of instrumentation per turn"""
+    from metrics import Metrics
+
+    metrics = Metrics(enabled=True, turn_log=turn_log)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for turn in range(turns):
+            timer = metrics.turn('CA00000000000000000000000000000000', turn)
+            for name in STAGES:
+                with timer.stage(name):
+                    pass
+            timer.finish(prompt_tokens=120)
+        elapsed = time.perf_counter() - start
+    render_start = time.perf_counter()
+    metrics.render()
+    return elapsed / turns, time.perf_counter() - render_start
+
+
+def webhook_turns(app, calls, turns):
+    client = app.app.test_client()
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for call in range(calls):
+            call_sid = f"CA{time.monotonic_ns() % 10 ** 32:032d}"
+            client.post('/handle-call', data={'CallSid': call_sid})
+            for turn in range(turns):
+                start = time.perf_counter()
+                client.post('/handle-call', data={'CallSid': call_sid, 'SpeechResult': f"Question {turn}?"})
+                latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=20000, help="Turns for the instrumentation loop")
+    parser.add_argument('--calls', type=int, default=40)
+    parser.add_argument('--llm-latency', type=float, nargs='+', default=[0.0, 0.3])
+    args = parser.parse_args()
+
+    per_turn, render = instrumentation_cost(args.turns, turn_log=False)
+    per_turn_logged, _ = instrumentation_cost(args.turns, turn_log=True)
+    print(f"instrumentation per turn: {per_turn * 1e6:.1f}us, {per_turn_logged * 1e6:.1f}us with the JSON turn log; "
+          f"/metrics render {render * 1000:.2f}ms")
+
+    server = start_fake_llm_server(first_token_delay=0, token_delay=0)
+    os.environ.update(OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY='fake', TWILIO_ACCOUNT_SID='ACfake',
+                      TWILIO_AUTH_TOKEN='fake', MONGO_URI='mongodb://127.0.0.1:1', MONGO_ENSURE_INDEXES='false',
+                      LLM_STREAMING='false', RESPONSE_CACHE='false', TTS_AUDIO_CACHE='false')
+    import mongomock
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    from database import Database
+    app.db = Database(client=mongomock.MongoClient(), db_name='bench')
+
+    print(f"\n{'llm ms':>8}{'p50 off ms':>12}{'p50 on ms':>11}{'instrumentation':>17}")
+    for latency in args.llm_latency:
+        server.first_token_delay = latency
+        results = {}
+        for enabled in (False, True):
+            app.metrics.enabled = enabled
+            results[enabled] = statistics.median(webhook_turns(app, args.calls, 3))
+        print(f"{latency * 1000:>8.0f}{results[False] * 1000:>12.2f}{results[True] * 1000:>11.2f}"
+              f"{per_turn / results[True]:>17.3%}")
+
+
+if __name__ == "__main__":
+    main()
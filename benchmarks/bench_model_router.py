@@ -0,0 +1,133 @@
+"""Turn latency with a slow-tailed primary model: no hedging, hedging to a fallback, and filler phrases
+
+The fake LLM answers the primary model in --primary-latency seconds, except for --slow-rate of
+requests that take --slow-latency, and the fallback model in --fallback-latency. Calls are
+played through the app's webhooks with complete (non-streaming) replies:
+
+  primary        LLM_FALLBACK_MODEL='': every turn waits for the primary, however slow
+  hedged         the fallback is asked once the primary runs past its p95 (at most LLM_HEDGE_DELAY),
+                 for up to LLM_HEDGE_BUDGET of turns
+  hedged+filler  as hedged, and a filler phrase is spoken after --filler-after seconds
+
+silence is the time from the caller finishing to the first TwiML that speaks anything (the
+reply, or a filler phrase), answer the time until the whole reply has been spoken and the app
+is listening again. A reply of FALLBACK_REPLY means no model answered within the turn deadline.
+"""
+import io
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fake_llm_server import start_fake_llm_server
+from fake_twilio_server import start_fake_twilio_server
+from run_suite import new_session, start_app
+from webhook_driver import WebhookDriver, next_action
+from load_test import percentile
+
+from call_flow import FALLBACK_REPLY, FILLER_PHRASES
+from model_router import ModelRouter
+
+
+async def play(driver, call_sid, args, samples):
+    """One call, timing each turn's silence and full answer"""
+    data = {'CallSid': call_sid, 'CallStatus': 'in-progress'}
+    twiml = await driver.post('/handle-call', data)
+    for number in range(args.turns):
+        verb, target = next_action(twiml)
+        if verb != 'gather':
+            return
+        start = time.perf_counter()
+        twiml = await driver.post(target, {**data, 'SpeechResult': f"Tell me more about point {number}"})
+        samples['silence'].append(time.perf_counter() - start)
+        samples['filler'] += any(phrase in twiml for phrase in FILLER_PHRASES)
+        verb, target = next_action(twiml)
+        while verb == 'redirect':
+            twiml = await driver.post(target, data)
+            verb, target = next_action(twiml)
+        samples['answer'].append(time.perf_counter() - start)
+        samples['fallback'] += FALLBACK_REPLY in twiml
+
+
+async def run_calls(base_url, args, offset):
+    samples = {'silence': [], 'answer': [], 'filler': 0, 'fallback': 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with new_session(args.concurrency) as session:
+        driver = WebhookDriver(session, base_url)
+
+        async def one(number):
+            async with semaphore:
+                await play(driver, f"CA{offset + number:032d}", args, samples)
+
+        await asyncio.gather(*[one(number) for number in range(args.calls)])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=40)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=10, help="Calls in progress at once")
+    parser.add_argument('--primary-latency', type=float, default=0.4, help="Primary's usual first-token delay")
+    parser.add_argument('--slow-rate', type=float, default=0.05, help="Share of primary requests that are slow")
+    parser.add_argument('--slow-latency', type=float, default=5.0, help="First-token delay of a slow request")
+    parser.add_argument('--fallback-latency', type=float, default=0.6, help="Fallback's first-token delay")
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    parser.add_argument('--deadline', type=float, default=6.0, help="LLM_TURN_DEADLINE")
+    parser.add_argument('--filler-after', type=float, default=1.0, help="LLM_FILLER_AFTER for hedged+filler")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--mongo-uri', help="Store calls in this MongoDB instead of mongomock")
+    parser.add_argument('--mongo-db', default='bench_model_router')
+    args = parser.parse_args()
+
+    primary, fallback = 'gpt-3.5-turbo', 'gpt-4o-mini'
+    os.environ.update(LLM_STREAMING='false', LLM_PRIMARY_MODEL=primary, LLM_FALLBACK_MODEL=fallback,
+                      LLM_TURN_DEADLINE=str(args.deadline))
+    os.environ.setdefault('RESPONSE_CACHE', 'false')
+    rng = random.Random(args.seed)
+
+    def primary_delay():
+        return args.slow_latency if rng.random() < args.slow_rate else args.primary_latency
+
+    llm = start_fake_llm_server(token_delay=args.token_delay,
+                                model_delays={primary: primary_delay, fallback: args.fallback_latency})
+    twilio = start_fake_twilio_server(latency=0)
+    app, server, base_url = start_app(args, llm, twilio)
+
+    turns = args.calls * args.turns
+    print(f"{args.calls} calls x {args.turns} turns, {args.concurrency} at once; primary {args.primary_latency}s "
+          f"({args.slow_rate:.0%} at {args.slow_latency}s), fallback {args.fallback_latency}s, "
+          f"deadline {args.deadline}s")
+    print(f"\n{'mode':<15}{'silence p50':>12}{'p95':>7}{'p99':>7}{'answer p50':>12}{'p95':>7}{'p99':>7}"
+          f"{'LLM calls':>11}{'hedged':>8}{'cancelled':>11}{'fillers':>9}{'fallbacks':>11}")
+    modes = (('primary', '', args.deadline * 2),
+             ('hedged', fallback, args.deadline * 2),
+             ('hedged+filler', fallback, args.filler_after))
+    for offset, (mode, mode_fallback, filler_after) in enumerate(modes):
+        app.engine.llm = ModelRouter(app.llm, fallback=mode_fallback, deadline=args.deadline)
+        app.engine.filler_after = filler_after
+        requests_before = llm.request_count
+        with contextlib.redirect_stdout(io.StringIO()):
+            samples = asyncio.run(run_calls(base_url, args, offset * 1000000))
+            # Losing requests finish in the background; let them land before counting
+            time.sleep(args.slow_latency)
+        stats = app.engine.llm.stats.snapshot()
+        hedged = sum(model.get('hedged', 0) for model in stats.values())
+        cancelled = sum(model.get('cancelled', 0) for model in stats.values())
+        silence = [seconds * 1000 for seconds in samples['silence']]
+        answer = [seconds * 1000 for seconds in samples['answer']]
+        print(f"{mode:<15}{percentile(silence, 50):>12.0f}{percentile(silence, 95):>7.0f}"
+              f"{percentile(silence, 99):>7.0f}{percentile(answer, 50):>12.0f}{percentile(answer, 95):>7.0f}"
+              f"{percentile(answer, 99):>7.0f}{llm.request_count - requests_before:>11}{hedged:>8}{cancelled:>11}"
+              f"{samples['filler']:>9}{samples['fallback']:>11}")
+    print(f"\n{turns} turns per mode; times in ms. Last mode's router: {app.engine.llm.snapshot()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
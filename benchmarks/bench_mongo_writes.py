@@ -0,0 +1,68 @@
+"""Compare per-callback upserts with the write-behind buffer against a local mongod"""
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from pymongo import MongoClient
+
+from database import Database
+
+STATUSES = ['initiated', 'ringing', 'answered', 'completed']
+
+
+def simulate_campaign(db, calls, threads):
+    """One call record plus four status callbacks per call, issued from webhook-like threads"""
+    def play(i):
+        call_sid = f"CA{i:032d}"
+        db.record_call_initiated(call_sid, i, f"+1555{i:07d}")
+        for status in STATUSES:
+            db.update_call_status(call_sid, status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(play, range(calls)))
+    if db.call_writes:
+        db.call_writes.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mongo-uri', default=os.environ.get('MONGO_URI', 'mongodb://localhost:27017/'))
+    parser.add_argument('--mongomock', action='store_true', help="Use mongomock instead of a real mongod")
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(args.mongo_uri)
+
+    ops = args.calls * (1 + len(STATUSES))
+    print(f"{args.calls} calls, {ops} writes, {args.threads} threads")
+    for label, write_behind in [('update_one per callback', False), ('write-behind bulk_write', True)]:
+        client.drop_database('calling_agent_bench')
+        with contextlib.redirect_stdout(io.StringIO()):
+            db = Database(client=client, db_name='calling_agent_bench', write_behind=write_behind)
+        elapsed = simulate_campaign(db, args.calls, args.threads)
+        line = f"{label:<26}{ops / elapsed:>10.0f} ops/s"
+        if db.call_writes:
+            stats = db.call_writes.stats
+            line += f"  ({stats['written']} documents in {stats['flushes']} bulk writes)"
+            db.call_writes.close()
+        print(line)
+        assert db.calls.count_documents({'status': 'completed'}) == args.calls
+
+    client.drop_database('calling_agent_bench')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Completed-callback latency, post-call throughput and analytics reads, inline vs the pipeline
+
+For --calls finished calls, each with extracted customer responses:
+
+  inline    the old update_customer_details, run in the /call-status webhook: a customer lookup,
+            the customer update and the calls document, one round trip after another
+  pipeline  the webhook only queues the call (SQLite); PostCallPipeline workers then read and
+            write the calls in batches of --batch
+
+Analytics are then read both ways: "rescan" aggregates interest levels and objections over
+every call, "counters" reads the document the pipeline keeps up to date with $inc.
+
+mongomock is not thread-safe, so without --mongo-uri every operation is serialized behind one
+lock and --rtt of simulated network time is added to each.
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from bench_campaign_queue import CountingCollection
+from post_call import JobQueue, PostCallPipeline, call_outcome
+
+INTEREST = ['high', 'medium', 'low', None]
+OBJECTIONS = ['too expensive', 'already have a provider', 'none', 'need to think about it']
+
+
+def seed(db, count):
+    db.customers.delete_many({})
+    db.calls.delete_many({})
+    db.analytics.delete_many({})
+    customers = [{'phone_number': f"+1555{number:07d}"} for number in range(count)]
+    db.customers.insert_many(customers)
+    db.calls.insert_many([{
+        'call_sid': f"CA{number:032d}",
+        'customer_id': customer['_id'],
+        'phone_number': customer['phone_number'],
+        'status': 'completed',
+        'created_at': time.time(),
+        'customer_responses': {'interest_level': INTEREST[number % len(INTEREST)],
+                               'objections': OBJECTIONS[number % len(OBJECTIONS)],
+                               'callback_time': 'tomorrow at 10am' if number % 5 == 0 else None}
+    } for number, customer in enumerate(customers)])
+    return [f"CA{number:032d}" for number in range(count)]
+
+
+def inline_callback(db, call_sid):
+    """The old path: compute the outcome and write customer and call in the webhook"""
+    call_data = db.calls.find_one({'call_sid': call_sid})
+    outcome = call_outcome(call_data.get('customer_responses'))
+    customer = db.customers.find_one({'phone_number': call_data['phone_number']})
+    db.customers.update_one({'_id': customer['_id']}, {
+        '$set': {'last_call_outcome': outcome, 'updated_at': datetime.now().timestamp()},
+        '$push': {'call_history': {'call_sid': call_sid, 'timestamp': datetime.now().timestamp(), 'outcome': outcome,
+                                   'responses': call_data.get('customer_responses', {})}}
+    })
+    db.calls.update_one({'call_sid': call_sid}, {'$set': {'outcome': outcome,
+                                                          'completed_at': datetime.now().timestamp()}})
+
+
+def run_inline(db, call_sids):
+    latencies = []
+    start = time.perf_counter()
+    for call_sid in call_sids:
+        began = time.perf_counter()
+        inline_callback(db, call_sid)
+        latencies.append(time.perf_counter() - began)
+    return latencies, time.perf_counter() - start, {}
+
+
+def run_pipeline(db, call_sids, workers, batch_size, queue_path):
+    pipeline = PostCallPipeline(
+        load_calls=db.get_calls_for_post_call,
+        save=db.save_post_call,
+        queue=JobQueue(queue_path),
+        workers=workers,
+        batch_size=batch_size,
+        batch_wait=0.05
+    )
+    pipeline.start()
+    latencies = []
+    start = time.perf_counter()
+    for call_sid in call_sids:
+        began = time.perf_counter()
+        pipeline.enqueue(call_sid)
+        latencies.append(time.perf_counter() - began)
+    while pipeline.queue.depth()[0]:
+        time.sleep(0.01)
+    return latencies, time.perf_counter() - start, pipeline.snapshot()
+
+
+def rescan_analytics(db):
+    """Interest and objection counts by reading every call"""
+    counts = {}
+    for call in db.calls.find({'outcome': {'$exists': True}}, {'customer_responses': 1}):
+        responses = call.get('customer_responses') or {}
+        for field in ('interest_level', 'objections'):
+            key = f"{field}.{responses.get(field)}"
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def timed(read, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        read()
+    return (time.perf_counter() - start) / repeat
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=50, help="Calls per post-call batch")
+    parser.add_argument('--workers', type=int, default=2, help="Post-call worker threads")
+    parser.add_argument('--rtt', type=float, default=0.0005, help="Simulated round trip per mongomock operation")
+    parser.add_argument('--mongo-uri', help="Benchmark against this MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from database import Database
+        if args.mongo_uri:
+            db = Database(mongo_uri=args.mongo_uri, db_name='bench_post_call', write_behind=False)
+            db.ensure_indexes()
+            wrap = lambda collection: CountingCollection(collection)
+        else:
+            import mongomock
+            db = Database(client=mongomock.MongoClient(), write_behind=False)
+            lock = threading.Lock()
+            def wrap(collection):
+                counting = CountingCollection(collection, args.rtt, serialize=True)
+                # One lock across collections, as mongomock shares its state between them
+                counting.lock = lock
+                return counting
+        db.customers, db.calls, db.analytics = wrap(db.customers), wrap(db.calls), wrap(db.analytics)
+
+    backend = 'mongod' if args.mongo_uri else f"mongomock, {args.rtt * 1000:.1f}ms simulated round trip"
+    print(f"{args.calls} completed calls, batch {args.batch}, {args.workers} workers, {backend}")
+    print(f"\n{'mode':<10}{'callback p50 ms':>17}{'callback p95 ms':>17}{'calls/s':>9}{'ops/call':>10}"
+          f"{'avg batch':>11}{'lag p95 s':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('inline', 'pipeline'):
+            call_sids = seed(db, args.calls)
+            for collection in (db.customers, db.calls, db.analytics):
+                collection.operations = 0
+            with contextlib.redirect_stdout(io.StringIO()):
+                if mode == 'inline':
+                    latencies, elapsed, stats = run_inline(db, call_sids)
+                else:
+                    latencies, elapsed, stats = run_pipeline(db, call_sids, args.workers, args.batch,
+                                                             os.path.join(directory, 'post_call_queue.db'))
+            operations = db.customers.operations + db.calls.operations + db.analytics.operations
+            assert db.calls.count_documents({'outcome': {'$exists': True}}) == args.calls
+            lag = f"{stats['lag_p95_seconds']:.2f}" if stats else '-'
+            print(f"{mode:<10}{percentile(latencies, 0.5) * 1000:>17.3f}{percentile(latencies, 0.95) * 1000:>17.3f}"
+                  f"{args.calls / elapsed:>9.0f}{operations / args.calls:>10.2f}{stats.get('avg_batch_size', 1):>11}"
+                  f"{lag:>11}")
+
+    rescan = timed(lambda: rescan_analytics(db), 5)
+    counters = timed(lambda: db.get_analytics('all'), 50)
+    print(f"\nanalytics read: rescan {rescan * 1000:.1f}ms, counters {counters * 1000:.2f}ms "
+          f"({db.get_analytics('all').get('calls', 0)} calls counted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Response cache: hit rate and wrong answers per similarity threshold, then AIAgent turn latency with and without it
+
+The labelled utterances below are paraphrases of the answer bank's intents (which should hit the
+right answer) and ordinary sales-call replies (which should fall through to the LLM).
+"""
+import io
+import os
+import sys
+import time
+import argparse
+import statistics
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fake_llm_server import start_fake_llm_server
+
+# (utterance, expected answer id or None for an LLM turn)
+LABELLED = [
+    ("How much is the pro plan?", 'pricing'),
+    ("What would this cost us?", 'pricing'),
+    ("What's the monthly price?", 'pricing'),
+    ("Is it expensive?", 'pricing'),
+    ("No thanks, I'm not interested.", 'not_interested'),
+    ("Not interested, sorry.", 'not_interested'),
+    ("We really don't need this.", 'not_interested'),
+    ("Take me off your list please.", 'not_interested'),
+    ("Just send me an email.", 'send_email'),
+    ("Could you email me the information?", 'send_email'),
+    ("Can you send me the details by email?", 'send_email'),
+    ("Who's calling?", 'who_is_calling'),
+    ("Sorry, who is this?", 'who_is_calling'),
+    ("What company are you calling from?", 'who_is_calling'),
+    ("I'm busy right now, call me later.", 'call_later'),
+    ("This isn't a good time.", 'call_later'),
+    ("Is there a free trial?", 'free_trial'),
+    ("Can I try it for free first?", 'free_trial'),
+    ("What does your product do?", 'what_is_it'),
+    ("Tell me more about it.", 'what_is_it'),
+    ("We track our hours in Jira already.", None),
+    ("My manager makes those decisions.", None),
+    ("Yes, that sounds great.", None),
+    ("I'm interested, go on.", None),
+    ("Does it integrate with Slack?", None),
+    ("How long have you been in business?", None),
+    ("We have about forty people on the team.", None),
+    ("Sure, my email is jane@example.com.", None),
+    ("Tomorrow at ten works for me.", None),
+    ("What happens to our data?", None),
+]
+
+# A call: mostly common questions, plus one reply the bank can't answer
+CALL_SCRIPT = [
+    "Sorry, who is this?",
+    "What does your product do?",
+    "We track our hours in Jira already.",
+    "How much is the pro plan?",
+    "Just send me an email.",
+]
+
+
+def evaluate(thresholds, margin):
+    from response_cache import ResponseCache
+
+    expected_hits = sum(1 for _, label in LABELLED if label)
+    print(f"{len(LABELLED)} labelled utterances ({expected_hits} answerable), margin {margin}")
+    print(f"{'threshold':>10}{'hit rate':>10}{'recall':>9}{'wrong':>7}{'false hits':>12}")
+    for threshold in thresholds:
+        cache = ResponseCache(threshold=threshold, margin=margin)
+        hits = correct = wrong = false_hits = 0
+        for utterance, label in LABELLED:
+            answer, _ = cache.lookup(utterance, 'conversation')
+            if answer is None:
+                continue
+            hits += 1
+            if label is None:
+                false_hits += 1
+            elif answer['id'] == label:
+                correct += 1
+            else:
+                wrong += 1
+        print(f"{threshold:>10.2f}{hits / len(LABELLED):>10.0%}{correct / expected_hits:>9.0%}{wrong:>7}{false_hits:>12}")
+
+    start = time.perf_counter()
+    rounds = 200
+    for _ in range(rounds):
+        for utterance, _ in LABELLED:
+            cache.lookup(utterance, 'conversation')
+    print(f"lookup: {(time.perf_counter() - start) / (rounds * len(LABELLED)) * 1e6:.0f}us "
+          f"over {len(cache.answers)} answers")
+
+
+def turn_latency(server, args):
+    from agent import AIAgent
+
+    print(f"\nAIAgent turns, gpt-4 first token {args.reply_delay * 1000:.0f}ms, {args.extraction_mode} extraction")
+    print(f"{'response cache':<16}{'p50 ms':>10}{'p95 ms':>10}{'llm calls/turn':>16}{'hit rate':>10}{'saved s':>9}")
+    for enabled in (False, True):
+        os.environ['RESPONSE_CACHE'] = 'true' if enabled else 'false'
+        requests_before = server.request_count
+        latencies = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            agent = AIAgent(extraction_mode=args.extraction_mode)
+            for call in range(args.calls):
+                for utterance in CALL_SCRIPT:
+                    start = time.perf_counter()
+                    agent.process_customer_input(f"CA_{enabled}_{call}", utterance)
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        stats = agent.response_cache.snapshot() if enabled else {'hit_rate': 0.0, 'seconds_saved': 0.0}
+        print(f"{'on' if enabled else 'off':<16}{statistics.median(latencies):>10.0f}{p95:>10.0f}"
+              f"{(server.request_count - requests_before) / len(latencies):>16.1f}"
+              f"{stats['hit_rate']:>10.0%}{stats['seconds_saved']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.5, 0.6, 0.65, 0.7, 0.8])
+    parser.add_argument('--margin', type=float, default=0.05)
+    parser.add_argument('--calls', type=int, default=4)
+    parser.add_argument('--reply-delay', type=float, default=0.6, help="gpt-4 time to first token")
+    parser.add_argument('--extraction-mode', default='concurrent')
+    args = parser.parse_args()
+
+    evaluate(args.thresholds, args.margin)
+
+    server = start_fake_llm_server(token_delay=0.005, model_delays={'gpt-4': args.reply_delay, 'gpt-3.5-turbo': 0.3})
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'fake')
+    os.environ.setdefault('TWILIO_ACCOUNT_SID', 'ACfake')
+    os.environ.setdefault('TWILIO_AUTH_TOKEN', 'fake')
+    # Replies from gpt-4, so they stay distinguishable from gpt-3.5-turbo extractions
+    os.environ.setdefault('LLM_PRIMARY_MODEL', 'gpt-4')
+    turn_latency(server, args)
+
+
+if __name__ == "__main__":
+    main()
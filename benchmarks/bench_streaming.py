@@ -0,0 +1,48 @@
+"""Compare time-to-first-sentence of a streamed reply with full-completion latency"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fake_llm_server import start_fake_llm_server
+from llm_client import LLMClient
+from streaming import split_sentences
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--token-delay', type=float, default=0.03)
+    args = parser.parse_args()
+
+    server = start_fake_llm_server(first_token_delay=args.first_token_delay, token_delay=args.token_delay)
+    llm = LLMClient(api_key='fake', base_url=server.base_url)
+    messages = [{"role": "user", "content": "How much does it cost?"}]
+
+    full, first_sentence, stream_total = [], [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        llm.chat(messages, model="gpt-3.5-turbo", max_tokens=150)
+        full.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        sentences = split_sentences(llm.stream_chat(messages, model="gpt-3.5-turbo", max_tokens=150))
+        next(sentences)
+        first_sentence.append((time.perf_counter() - start) * 1000)
+        for _ in sentences:
+            pass
+        stream_total.append((time.perf_counter() - start) * 1000)
+
+    print(f"{'mode':<28}{'p50 ms':>10}{'max ms':>10}")
+    for name, samples in [('full completion', full),
+                          ('stream: first sentence', first_sentence),
+                          ('stream: last sentence', stream_total)]:
+        print(f"{name:<28}{statistics.median(samples):>10.0f}{max(samples):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Synthesis time with and without the TTS audio cache over simulated calls, using a fake synthesizer"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from audio_cache import AudioCache
+from call_flow import CANNED_PHRASES
+from tts_service import TextToSpeech
+
+CLOSING_LINES = [
+    "Thank you for your time. Goodbye!",
+    "I'll have a product specialist reach out to you. Thank you for your time, goodbye!",
+    "Great, I've set up your free trial. Thank you for your time. Goodbye!",
+]
+
+
+class FakeTextToSpeech(TextToSpeech):
+    """Renders placeholder audio after a fixed delay instead of calling Edge TTS"""
+
+    def __init__(self, synth_seconds, cache=None):
+        super().__init__(cache=cache)
+        self.synth_seconds = synth_seconds
+
+    def _render(self, text):
+        time.sleep(self.synth_seconds)
+        # Roughly 6 KB of 48 kbps mp3 per second of speech, about 15 characters per second
+        return os.urandom(len(text) * 400)
+
+
+def simulate(tts, calls, turns, canned_share, rng):
+    """Synthesize every line of `calls` calls and return the total seconds spent"""
+    phrases = CANNED_PHRASES + CLOSING_LINES
+    start = time.perf_counter()
+    for call in range(calls):
+        tts.synthesize(CANNED_PHRASES[0])
+        for turn in range(turns):
+            if rng.random() < canned_share:
+                tts.synthesize(rng.choice(phrases))
+            else:
+                tts.synthesize(f"Dynamic reply {call}-{turn}: happy to walk you through the pro plan.")
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=4)
+    parser.add_argument('--canned-share', type=float, default=0.3, help="Share of turns that speak a canned phrase")
+    parser.add_argument('--synth-ms', type=float, default=5, help="Fake synthesis time per phrase")
+    args = parser.parse_args()
+
+    synth_seconds = args.synth_ms / 1000
+    uncached = simulate(FakeTextToSpeech(synth_seconds), args.calls, args.turns, args.canned_share, random.Random(1))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = AudioCache(cache_dir=cache_dir, max_memory_bytes=4 * 1024 * 1024, max_disk_bytes=64 * 1024 * 1024)
+        tts = FakeTextToSpeech(synth_seconds, cache=cache)
+        warm_start = time.perf_counter()
+        tts.warm(CANNED_PHRASES + CLOSING_LINES)
+        warm_seconds = time.perf_counter() - warm_start
+        cached = simulate(tts, args.calls, args.turns, args.canned_share, random.Random(1))
+        stats = cache.snapshot()
+
+    lines = args.calls * (args.turns + 1)
+    print(f"{lines} lines over {args.calls} calls, {args.synth_ms:.0f} ms per synthesis")
+    print(f"uncached: {uncached:.2f}s")
+    print(f"cached:   {cached:.2f}s (+{warm_seconds:.2f}s warm-up)")
+    print(f"hit ratio {stats['hit_ratio']:.1%}: {stats['memory_hits']} memory, {stats['disk_hits']} disk, "
+          f"{stats['misses']} misses; {stats['seconds_saved']:.2f}s of synthesis saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Time to first audio byte and peak RSS: temp-file TTS versus chunk streaming, with a fake synthesizer"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from tts_service import TextToSpeech
+
+TEXT = "Call Worklog AI writes your work logs for you by watching the tools you already use."
+
+
+class FakeCommunicate:
+    """Stands in for edge_tts.Communicate, producing audio chunks at a steady pace"""
+
+    def __init__(self, first_chunk_delay, chunk_delay, chunk_bytes, total_bytes):
+        self.first_chunk_delay = first_chunk_delay
+        self.chunk_delay = chunk_delay
+        self.chunk_bytes = chunk_bytes
+        self.total_bytes = total_bytes
+
+    async def stream(self):
+        await asyncio.sleep(self.first_chunk_delay)
+        sent = 0
+        while sent < self.total_bytes:
+            if sent:
+                await asyncio.sleep(self.chunk_delay)
+            yield {'type': 'audio', 'data': bytes(self.chunk_bytes)}
+            sent += self.chunk_bytes
+
+
+class FakeTextToSpeech(TextToSpeech):
+    def __init__(self, args):
+        super().__init__()
+        self.args = args
+
+    def _communicate(self, text):
+        return FakeCommunicate(self.args.first_chunk_ms / 1000, self.args.chunk_ms / 1000,
+                               self.args.chunk_kb * 1024, self.args.audio_kb * 1024)
+
+
+def temp_file_ttfb(tts, text):
+    """The previous text_to_speech_stream: fresh event loop, temp file, read back whole, delete"""
+    start = time.perf_counter()
+    output_file = os.path.join(tts.output_dir, f"bench-{os.getpid()}-{time.perf_counter_ns()}.mp3")
+    asyncio.run(tts._async_tts(text, output_file))
+    with open(output_file, 'rb') as f:
+        audio_data = f.read()
+    os.unlink(output_file)
+    # The caller can only start sending once the whole clip is in memory
+    return time.perf_counter() - start if audio_data else None
+
+
+def streaming_ttfb(tts, text):
+    start = time.perf_counter()
+    ttfb = None
+    for chunk in tts.iter_audio(text):
+        if ttfb is None:
+            ttfb = time.perf_counter() - start
+    return ttfb
+
+
+def run_mode(args):
+    """Child process: synthesize concurrently in one mode and print TTFB and peak RSS"""
+    os.environ['TTS_OUTPUT_DIR'] = args.output_dir
+    tts = FakeTextToSpeech(args)
+    measure = temp_file_ttfb if args.mode == 'temp-file' else streaming_ttfb
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        ttfbs = list(pool.map(lambda _: measure(tts, TEXT), range(args.requests)))
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{statistics.median(ttfbs) * 1000:.0f} {max(ttfbs) * 1000:.0f} {peak_rss_mb:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--audio-kb', type=int, default=2048, help="Size of each synthesized clip")
+    parser.add_argument('--chunk-kb', type=int, default=16)
+    parser.add_argument('--first-chunk-ms', type=float, default=150)
+    parser.add_argument('--chunk-ms', type=float, default=2)
+    parser.add_argument('--mode', choices=['temp-file', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    print(f"{args.requests} utterances of {args.audio_kb} KB, {args.concurrency} at a time")
+    print(f"{'mode':<12}{'p50 TTFB ms':>14}{'max TTFB ms':>14}{'peak RSS MB':>14}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for mode in ('temp-file', 'streaming'):
+            # Each mode runs in its own process so peak RSS isn't shared
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--output-dir', output_dir] + sys.argv[1:],
+                capture_output=True, text=True, check=True
+            ).stdout.split('\n')[-2].split()
+            print(f"{mode:<12}{output[0]:>14}{output[1]:>14}{output[2]:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""CPU time the conversation engine spends on a turn, with an LLM that answers instantly
+
+Everything the network normally hides is left: session load and write-through, the response
+cache, prompt building, the model router's worker threads, the streamed reply's sentence
+splitting and the TwiML render. Each scenario plays --calls calls of --turns turns in process:
+
+  greeting           the first webhook of a call
+  complete           a turn answered with the whole reply (LLM_STREAMING=false)
+  streaming          a turn spoken sentence by sentence, its /handle-call-continue webhooks included
+  agent              AIAgent.process_customer_input, with serial extraction
+  prompt_build       ContextBuilder.build alone
+  twiml_render       reply_twiml alone
+
+cpu is process CPU time (all threads) per turn, wall the elapsed time per turn, both in µs.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+os.environ.setdefault('OPENAI_API_KEY', 'fake')
+os.environ.setdefault('TWILIO_ACCOUNT_SID', 'ACfake')
+os.environ.setdefault('TWILIO_AUTH_TOKEN', 'fake')
+os.environ.setdefault('RESPONSE_CACHE', 'false')
+
+from call_flow import SYSTEM_PROMPT, reply_twiml
+from context_builder import ContextBuilder
+from conversation_engine import ConversationEngine, SessionStore
+from model_router import ModelRouter
+from session_cache import SessionCache
+from settings import Settings
+
+REPLY = ("Call Worklog AI writes your work logs for you by watching the tools you already use. "
+         "Most people save around three hours a week on reporting. "
+         "Would you like me to set up a free trial for you?")
+FIELDS = {"interest_level": "medium", "questions": ["pricing"]}
+
+
+class InstantLLM:
+    """Stands in for LLMClient: every completion and stream is ready at once"""
+
+    def chat(self, messages, model, call_sid=None, **kwargs):
+        if 'response_format' in kwargs:
+            content = json.dumps(FIELDS)
+        elif '"reply"' in messages[0]['content']:
+            content = json.dumps({"reply": REPLY, "fields": FIELDS})
+        else:
+            content = REPLY
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    def stream_chat(self, messages, model, call_sid=None, **kwargs):
+        for word in REPLY.split(' '):
+            yield word + ' '
+
+
+def new_engine(streaming):
+    settings = Settings()
+    settings.llm_streaming = streaming
+    return ConversationEngine(store=SessionStore(SessionCache()), llm=ModelRouter(InstantLLM(), fallback=''),
+                              context=ContextBuilder(SYSTEM_PROMPT), settings=settings)
+
+
+def measure(name, args, play):
+    """Run play(call_sid) for every call and print CPU and wall time per turn"""
+    turns = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        # One untimed call warms imports and caches up
+        play('CAwarmup')
+        cpu, wall = time.process_time(), time.perf_counter()
+        for number in range(args.calls):
+            turns += play(f"CA{name}{number:06d}")
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    print(f"{name:<15}{turns:>8}{cpu / turns * 1e6:>10.0f}{wall / turns * 1e6:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=5)
+    args = parser.parse_args()
+    utterances = [f"Tell me more about point {number}" for number in range(args.turns)]
+
+    complete, streaming = new_engine(False), new_engine(True)
+
+    def greeting(call_sid):
+        complete.handle_turn(call_sid, '')
+        return 1
+
+    def complete_call(call_sid):
+        for turn, utterance in enumerate(utterances, 1):
+            complete.handle_turn(call_sid, utterance, turn)
+        complete.end_call(call_sid)
+        return len(utterances)
+
+    def streaming_call(call_sid):
+        for turn, utterance in enumerate(utterances, 1):
+            twiml = streaming.handle_turn(call_sid, utterance, turn)
+            while '<Redirect' in twiml:
+                twiml = streaming.handle_continue(call_sid, turn)
+        streaming.end_call(call_sid)
+        return len(utterances)
+
+    from agent import AIAgent
+    agent = AIAgent(extraction_mode='serial')
+    agent.llm = InstantLLM()
+    agent.engine.llm = ModelRouter(agent.llm, fallback='')
+
+    def agent_call(call_sid):
+        for utterance in utterances:
+            agent.process_customer_input(call_sid, utterance)
+        agent.end_call(call_sid)
+        return len(utterances)
+
+    # A session partway into the call, as the prompt sees it on the last turn
+    context = ContextBuilder(SYSTEM_PROMPT)
+    history = []
+    for utterance in utterances[:-1]:
+        history += [{"role": "user", "content": utterance}, {"role": "assistant", "content": REPLY}]
+
+    def prompt_build(call_sid):
+        session = {'call_sid': call_sid, 'history': list(history), 'summary': None}
+        for _ in range(args.turns):
+            context.build(session, [{"role": "user", "content": utterances[-1]}])
+        return args.turns
+
+    def twiml_render(call_sid):
+        for turn in range(1, args.turns + 1):
+            reply_twiml(REPLY, None, call_sid, turn)
+        return args.turns
+
+    print(f"{args.calls} calls x {args.turns} turns\n")
+    print(f"{'scenario':<15}{'turns':>8}{'cpu µs':>10}{'wall µs':>10}")
+    for name, play in (('greeting', greeting), ('complete', complete_call), ('streaming', streaming_call),
+                       ('agent', agent_call), ('prompt_build', prompt_build), ('twiml_render', twiml_render)):
+        measure(name, args, play)
+
+
+if __name__ == "__main__":
+    main()
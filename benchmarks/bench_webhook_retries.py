@@ -0,0 +1,126 @@
+"""LLM calls and duplicate turns under a storm of Twilio webhook retries, with and without numbered turns
+
+Twilio retries a webhook that hasn't answered in time, so a slow LLM turn is often posted again
+while the first request is still running. Every turn here is posted once, then --retries more
+times --retry-after seconds later, concurrently; the TwiML of the first request is followed.
+
+  unnumbered  Gather actions without ?turn=N, as before: every retry is answered as a new turn
+  numbered    the app's ?turn=N actions: retries get the first request's TwiML
+
+Status callbacks are then sent in a shuffled order, each one twice, and calls whose stored
+status isn't "completed" afterwards are counted as downgraded.
+"""
+import io
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import contextlib
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from fake_llm_server import start_fake_llm_server
+from fake_twilio_server import start_fake_twilio_server
+from run_suite import new_session, start_app
+from webhook_driver import WebhookDriver, next_action
+from load_test import percentile
+
+STATUSES = ['initiated', 'ringing', 'in-progress', 'completed']
+
+
+async def play(driver, call_sid, args, numbered):
+    """One call: each turn posted, then retried while it is still being answered"""
+    data = {'CallSid': call_sid, 'CallStatus': 'in-progress'}
+    twiml = await driver.post('/handle-call', data)
+    mismatched = 0
+    retry_latencies = []
+    for number in range(args.turns):
+        verb, target = next_action(twiml)
+        while verb == 'redirect':
+            twiml = await driver.post(target, data)
+            verb, target = next_action(twiml)
+        if verb != 'gather':
+            break
+        if not numbered:
+            target = urlsplit(target).path
+        speech = {**data, 'SpeechResult': f"Tell me more about point {number} of call {call_sid}"}
+
+        async def retry():
+            await asyncio.sleep(args.retry_after)
+            start = time.perf_counter()
+            body = await driver.post(target, speech)
+            retry_latencies.append(time.perf_counter() - start)
+            return body
+
+        twiml, *retried = await asyncio.gather(driver.post(target, speech), *[retry() for _ in range(args.retries)])
+        mismatched += sum(1 for body in retried if body != twiml)
+    return mismatched, retry_latencies
+
+
+async def storm(base_url, args, numbered, offset):
+    call_sids = [f"CA{offset + number:032d}" for number in range(args.calls)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    async with new_session(args.concurrency * (args.retries + 1)) as session:
+        driver = WebhookDriver(session, base_url)
+
+        async def one(call_sid):
+            async with semaphore:
+                return await play(driver, call_sid, args, numbered)
+
+        results = await asyncio.gather(*[one(call_sid) for call_sid in call_sids])
+
+        # Every status twice, in a random order per call
+        callbacks = [(call_sid, status) for call_sid in call_sids for status in STATUSES * 2]
+        random.Random(offset).shuffle(callbacks)
+        for call_sid, status in callbacks:
+            await driver.status('/call-status', call_sid, status)
+    return call_sids, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--retries', type=int, default=2, help="Retries of every turn")
+    parser.add_argument('--retry-after', type=float, default=0.1, help="Seconds after the first request")
+    parser.add_argument('--concurrency', type=int, default=10, help="Calls in progress at once")
+    parser.add_argument('--llm-latency', type=float, default=0.5, help="Seconds before the fake LLM answers")
+    parser.add_argument('--streaming', action='store_true', help="Stream replies sentence by sentence")
+    parser.add_argument('--mongo-uri', help="Store calls in this MongoDB instead of mongomock")
+    parser.add_argument('--mongo-db', default='bench_webhook_retries')
+    args = parser.parse_args()
+
+    os.environ['LLM_STREAMING'] = 'true' if args.streaming else 'false'
+    os.environ.setdefault('RESPONSE_CACHE', 'false')
+    llm = start_fake_llm_server(first_token_delay=args.llm_latency, token_delay=0)
+    twilio = start_fake_twilio_server(latency=0)
+    app, server, base_url = start_app(args, llm, twilio)
+
+    turns = args.calls * args.turns
+    print(f"{args.calls} calls x {args.turns} turns, {args.retries} retries per turn after {args.retry_after}s, "
+          f"LLM latency {args.llm_latency}s, {'streaming' if args.streaming else 'complete'} replies")
+    print(f"\n{'mode':<12}{'LLM calls':>10}{'per turn':>10}{'saved':>7}{'turns stored':>14}{'TwiML differs':>15}"
+          f"{'retry p50 ms':>14}{'downgraded':>12}")
+    for offset, (mode, numbered) in enumerate((('unnumbered', False), ('numbered', True))):
+        requests_before = llm.request_count
+        with contextlib.redirect_stdout(io.StringIO()):
+            call_sids, results = asyncio.run(storm(base_url, args, numbered, offset * 1000000))
+            # Streamed replies are recorded once they finish
+            time.sleep(args.llm_latency + 0.5)
+        llm_calls = llm.request_count - requests_before
+        stored = sum(app.db.get_call_data(call_sid).get('message_count', 0) // 2 for call_sid in call_sids)
+        downgraded = sum(1 for call_sid in call_sids if app.db.get_call_data(call_sid).get('status') != 'completed')
+        mismatched = sum(result[0] for result in results)
+        latencies = [latency for result in results for latency in result[1]]
+        sent = turns * (args.retries + 1)
+        print(f"{mode:<12}{llm_calls:>10}{llm_calls / turns:>10.2f}{sent - llm_calls:>7}{stored:>14}"
+              f"{mismatched:>15}{percentile(latencies, 50) * 1000:>14.0f}{downgraded:>12}")
+    print(f"\n{turns} turns were spoken; {app.webhooks.snapshot()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Throughput per core of the Flask app under gunicorn, for several worker/thread layouts and session stores
+
+Each layout runs as a real gunicorn server. The load generator from load_test.py plays Twilio
+webhooks against it, the LLM is the fake LLM server, and MongoDB is replaced by a call store in a
+separate process that every worker reaches over a socket. A turn whose prompt missed turns that
+another worker had already stored counts as stale. Throughput per core is LLM turns per second of
+server CPU (master plus workers), so it doesn't depend on how many cores the machine has.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+from multiprocessing.managers import BaseManager
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from fake_llm_server import start_fake_llm_server
+from load_test import percentile, run_level
+
+STORE_AUTHKEY = b'bench-workers'
+
+
+class CallStore:
+    def __init__(self):
+        """Conversation histories shared by every worker, standing in for the calls collection"""
+        self.histories = {}
+        self.stale = 0
+
+    def reset(self):
+        self.histories = {}
+        self.stale = 0
+
+    def get_turn_context(self, call_sid, max_turns):
+        history = self.histories.get(call_sid, [])
+        return {'call_sid': call_sid, 'history': history[-2 * max_turns:], 'summary': None, 'turns': len(history) // 2}
+
+    def append_turns(self, call_sid, messages, seen):
+        history = self.histories.setdefault(call_sid, [])
+        if seen < len(history):
+            self.stale += 1
+        history.extend(messages)
+
+    def summary(self, turns):
+        complete = sum(1 for history in self.histories.values() if len(history) == 2 * turns)
+        return {'calls': len(self.histories), 'complete': complete, 'stale': self.stale}
+
+
+class StoreManager(BaseManager):
+    pass
+
+
+class SharedStubDatabase:
+    def __init__(self, store):
+        """The Database methods the webhooks use, backed by the shared call store"""
+        self.store = store
+
+    def ping(self):
+        pass
+
+    def get_turn_context(self, call_sid, max_turns):
+        return self.store.get_turn_context(call_sid, max_turns)
+
+    def append_turns(self, call_sid, messages, seen=0):
+        self.store.append_turns(call_sid, messages, seen)
+
+    def update_call_status(self, call_sid, status):
+        pass
+
+    def save_conversation_summary(self, call_sid, summary, summarized):
+        pass
+
+
+def create_app():
+    """gunicorn app factory: the real Flask app with the stub database swapped in"""
+    import app
+
+    host, port = os.environ['BENCH_STORE_ADDRESS'].split(':')
+    StoreManager.register('store')
+    manager = StoreManager(address=(host, int(port)), authkey=STORE_AUTHKEY)
+    manager.connect()
+    app.db = SharedStubDatabase(manager.store())
+
+    def record(session, messages):
+        # Same as SessionStore.record, but tells the store how much history the prompt saw
+        app.db.append_turns(session['call_sid'], messages, seen=len(session['history']))
+        session['history'].extend(messages)
+        session['turns'] += 1
+
+    app.engine.store.record = record
+    return app.app
+
+
+def server_cpu_seconds(pid):
+    """CPU time of a process and its direct children (gunicorn master and workers)"""
+    total = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf('SC_CLK_TCK')
+
+
+def start_gunicorn(workers, threads, store, port, env):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(SRC_DIR, 'gunicorn.conf.py'),
+         '--chdir', SRC_DIR, '--pythonpath', BENCHMARKS_DIR, '--bind', f"127.0.0.1:{port}",
+         '--workers', str(workers), '--threads', str(threads), 'bench_workers:create_app()'],
+        env=dict(env, SESSION_STORE=store),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layouts', nargs='+', default=['1x32', '2x16', '4x8'], help="WORKERSxTHREADS")
+    parser.add_argument('--stores', nargs='+', default=['local', 'shared'], choices=['local', 'shared'])
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--port', type=int, default=8012)
+    args = parser.parse_args()
+
+    llm = start_fake_llm_server(first_token_delay=args.llm_latency, token_delay=0)
+    store = CallStore()
+    StoreManager.register('store', callable=lambda: store)
+    manager = StoreManager(address=('127.0.0.1', 0), authkey=STORE_AUTHKEY)
+    manager.start()
+    host, port = manager.address
+
+    env = dict(os.environ, BENCH_STORE_ADDRESS=f"{host}:{port}", OPENAI_BASE_URL=llm.base_url, OPENAI_API_KEY='fake',
+               TWILIO_ACCOUNT_SID='ACfake', TWILIO_AUTH_TOKEN='fake', MONGO_URI='mongodb://127.0.0.1:1',
+               MONGO_ENSURE_INDEXES='false', CONVERSATION_SUMMARIES='false', TTS_AUDIO_CACHE='false',
+               RESPONSE_CACHE='false', LLM_STREAMING='false')
+
+    print(f"{os.cpu_count()} CPU(s), {args.concurrency} concurrent calls x {args.turns} turns, "
+          f"LLM latency {args.llm_latency * 1000:.0f}ms")
+    print(f"{'layout':>8}{'store':>8}{'turns/s':>9}{'p50 ms':>8}{'p99 ms':>8}{'server CPU':>12}"
+          f"{'turns/s per core':>18}{'stale':>7}{'complete':>10}")
+    for layout in args.layouts:
+        workers, threads = (int(n) for n in layout.split('x'))
+        for session_store in args.stores:
+            if session_store == 'local' and workers > 1:
+                # gunicorn.conf.py refuses to start it: each worker would answer from its own stale sessions
+                print(f"{layout:>8}{session_store:>8}  skipped, gunicorn refuses SESSION_STORE=local with {workers} workers")
+                continue
+            manager.store().reset()
+            server = start_gunicorn(workers, threads, session_store, args.port, env)
+            try:
+                cpu_start = server_cpu_seconds(server.pid)
+                level = run_level(f"http://127.0.0.1:{args.port}", args.concurrency, args.turns, force_close=True)
+                latencies, elapsed = asyncio.run(level)
+                cpu = server_cpu_seconds(server.pid) - cpu_start
+            finally:
+                server.terminate()
+                server.wait()
+            result = manager.store().summary(args.turns)
+            print(f"{layout:>8}{session_store:>8}{len(latencies) / elapsed:>9.1f}{percentile(latencies, 50):>8.0f}"
+                  f"{percentile(latencies, 99):>8.0f}{cpu / elapsed:>11.0%} {len(latencies) / cpu:>17.1f}"
+                  f"{result['stale']:>7}{result['complete']:>6}/{args.concurrency}")
+
+    manager.shutdown()
+
+
+if __name__ == "__main__":
+    main()
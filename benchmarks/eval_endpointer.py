@@ -0,0 +1,124 @@
+"""Evaluate the VAD endpointer over WAV fixtures: endpoint latency and false cut-off rate
+
+Each fixture is a mono 16-bit WAV of one caller turn with a JSON label next to it
+(turn.wav + turn.json) giving the true end of the turn: {"speech_end": 3.42}. An END before
+speech_end is a false cut-off. Use --generate to write synthetic fixtures with mid-turn pauses.
+"""
+import os
+import sys
+import json
+import wave
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import numpy as np
+
+from vad import EARLY_END, END, FRAME_MS, RESUME, Endpointer
+
+SAMPLE_RATE = 8000
+
+
+def read_wav(path):
+    """Mono int16 samples at 8kHz"""
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit samples")
+        rate = f.getframerate()
+        pcm = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        if f.getnchannels() > 1:
+            pcm = pcm.reshape(-1, f.getnchannels())[:, 0]
+    if rate != SAMPLE_RATE:
+        positions = np.arange(0, len(pcm), rate / SAMPLE_RATE)
+        pcm = np.interp(positions, np.arange(len(pcm)), pcm).astype(np.int16)
+    return pcm
+
+
+def generate_fixtures(directory, count, seed=0):
+    """Synthetic turns: voiced bursts with short pauses inside the turn and line noise around it"""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for index in range(count):
+        noise_level = rng.uniform(20, 120)
+        parts = [rng.normal(0, noise_level, int(rng.uniform(0.3, 0.8) * SAMPLE_RATE))]
+        for word in range(rng.integers(3, 9)):
+            length = int(rng.uniform(0.15, 0.6) * SAMPLE_RATE)
+            t = np.arange(length) / SAMPLE_RATE
+            pitch = rng.uniform(100, 250)
+            envelope = np.sin(np.pi * np.arange(length) / length) ** 0.5 * rng.uniform(1500, 8000)
+            parts.append(np.sin(2 * np.pi * pitch * t) * envelope + rng.normal(0, noise_level, length))
+            # Gaps between words, occasionally a longer hesitation the endpointer must not cut at
+            gap = rng.uniform(0.4, 0.55) if rng.random() < 0.2 else rng.uniform(0.03, 0.2)
+            parts.append(rng.normal(0, noise_level, int(gap * SAMPLE_RATE)))
+        speech_end = (sum(len(p) for p in parts) - len(parts[-1])) / SAMPLE_RATE
+        parts.append(rng.normal(0, noise_level, int(2.0 * SAMPLE_RATE)))
+        pcm = np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+
+        name = os.path.join(directory, f"synthetic_{index:03d}")
+        with wave.open(f"{name}.wav", 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm.tobytes())
+        with open(f"{name}.json", 'w') as f:
+            json.dump({'speech_end': round(speech_end, 3)}, f)
+
+
+def evaluate(fixtures, hangover_ms, early_ms):
+    latencies, early_latencies = [], []
+    cutoffs = missed = speculations = discarded = 0
+    for pcm, speech_end in fixtures:
+        events = Endpointer(hangover_ms=hangover_ms, early_ms=early_ms).run(pcm)
+        # Time of an event is the end of the frame it fired on
+        times = [((index + 1) * FRAME_MS / 1000, event) for index, event in events]
+        speculations += sum(1 for _, event in times if event == EARLY_END)
+        discarded += sum(1 for _, event in times if event == RESUME)
+
+        ends = [t for t, event in times if event == END]
+        if any(t < speech_end for t in ends):
+            cutoffs += 1
+            continue
+        if not ends:
+            missed += 1
+            continue
+        latencies.append((ends[0] - speech_end) * 1000)
+        # The speculative reply that survived is the last early endpoint before the final one
+        early = [t for t, event in times if event == EARLY_END and t <= ends[0]]
+        early_latencies.append((early[-1] - speech_end) * 1000)
+    return latencies, early_latencies, cutoffs, missed, speculations, discarded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('fixtures', help="Directory of .wav fixtures with .json labels")
+    parser.add_argument('--generate', type=int, metavar='N', help="Write N synthetic fixtures into the directory first")
+    parser.add_argument('--hangover-ms', type=int, nargs='+', default=[400, 600, 800])
+    parser.add_argument('--early-ms', type=int, default=250)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_fixtures(args.fixtures, args.generate)
+
+    fixtures = []
+    for name in sorted(os.listdir(args.fixtures)):
+        if name.endswith('.wav'):
+            path = os.path.join(args.fixtures, name)
+            with open(path[:-4] + '.json') as f:
+                fixtures.append((read_wav(path), json.load(f)['speech_end']))
+    if not fixtures:
+        parser.error(f"no .wav fixtures in {args.fixtures}")
+
+    print(f"{len(fixtures)} fixtures, early endpoint at {args.early_ms}ms")
+    print(f"{'hangover ms':>12}{'p50 end ms':>12}{'p95 end ms':>12}{'p50 early ms':>14}"
+          f"{'cut-offs':>10}{'missed':>8}{'discarded':>11}")
+    for hangover_ms in args.hangover_ms:
+        latencies, early_latencies, cutoffs, missed, speculations, discarded = evaluate(fixtures, hangover_ms, args.early_ms)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else (latencies or [0])[0]
+        print(f"{hangover_ms:>12}{statistics.median(latencies or [0]):>12.0f}{p95:>12.0f}"
+              f"{statistics.median(early_latencies or [0]):>14.0f}{cutoffs / len(fixtures):>10.1%}"
+              f"{missed:>8}{discarded / max(1, speculations):>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
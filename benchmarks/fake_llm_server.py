@@ -0,0 +1,147 @@
+"""Local stand-in for the OpenAI chat completions API with configurable latency"""
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_REPLY = (
+    "Call Worklog AI writes your work logs for you by watching the tools you already use. "
+    "Most people save around three hours a week on reporting. "
+    "Plans start at nine ninety-nine a month and there is a free trial. "
+    "Would you like me to set one up for you?"
+)
+
+# Returned for extraction requests, alone or inside a {"reply", "fields"} envelope
+DEFAULT_FIELDS = {
+    'interest_level': 'medium',
+    'objections': 'already uses a spreadsheet',
+    'email': 'jane@example.com',
+    'callback_time': 'tomorrow at 10am'
+}
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open hundreds of connections at once; the stdlib default backlog of 5 drops SYNs
+    request_queue_size = 1024
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle on, keep-alive requests stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        server.request_count += 1
+
+        model = body.get('model', 'fake-model')
+        tokens = re.findall(r'\S+\s*', server.reply)
+        delay = server.model_delays.get(model, server.first_token_delay)
+        if callable(delay):
+            # A distribution rather than a constant, e.g. a model with a slow tail
+            delay = delay()
+
+        time.sleep(delay)
+        if body.get('stream'):
+            try:
+                self._stream(model, tokens)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client stopped reading, e.g. the caller interrupted the reply
+                pass
+        else:
+            messages = body.get('messages', [])
+            content = ''.join(tokens)
+            if (body.get('response_format') or {}).get('type') == 'json_object':
+                content = json.dumps(DEFAULT_FIELDS)
+                tokens = re.findall(r'\S+\s*', content)
+            elif messages and '{"reply"' in (messages[0].get('content') or ''):
+                # Single-call mode asks for the reply and the fields in one JSON object
+                content = json.dumps({'reply': content, 'fields': DEFAULT_FIELDS})
+                tokens = re.findall(r'\S+\s*', content)
+            time.sleep(server.token_delay * len(tokens))
+            prompt_chars = sum(len(m.get('content') or '') for m in messages)
+            self._complete(model, content, prompt_chars // 4)
+
+    def _complete(self, model, content, prompt_tokens=0):
+        payload = json.dumps({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': content}
+            }],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 0, 'total_tokens': prompt_tokens}
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, model, tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.server.token_delay)
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b'')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_fake_llm_server(port=0, first_token_delay=0.3, token_delay=0.03, reply=DEFAULT_REPLY,
+                          model_delays=None):
+    """Start the fake server in a background thread and return it; base URL is server.base_url
+
+    model_delays maps a model name to its first-token delay in seconds, or to a function returning one.
+    """
+    server = FakeServer(('127.0.0.1', port), FakeLLMHandler)
+    server.first_token_delay = first_token_delay
+    server.token_delay = token_delay
+    server.reply = reply
+    server.model_delays = model_delays or {}
+    server.request_count = 0
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--token-delay', type=float, default=0.03)
+    args = parser.parse_args()
+
+    server = start_fake_llm_server(args.port, args.first_token_delay, args.token_delay)
+    print(f"Fake LLM server listening at {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,89 @@
+"""Local stand-in for the Twilio Calls API with configurable latency and transient failures"""
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler
+
+from fake_llm_server import FakeServer
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle on, keep-alive requests stall on delayed ACKs
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = {key: values[-1] for key, values in parse_qs(self.rfile.read(length).decode()).items()}
+        server = self.server
+
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.request_times.append(time.time())
+        try:
+            time.sleep(server.latency)
+            if random.random() < server.failure_rate:
+                self._send(429, {'code': 20429, 'message': 'Too Many Requests', 'status': 429})
+                return
+            call_sid = 'CA' + uuid.uuid4().hex
+            with server.lock:
+                server.calls_created += 1
+            if server.on_call_created:
+                # Hand the call to a webhook driver, which starts requesting Url as Twilio would
+                server.on_call_created(call_sid, params)
+            self._send(201, {'sid': call_sid, 'status': 'queued'})
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_twilio_server(port=0, latency=0.2, failure_rate=0.0, on_call_created=None):
+    """Start the fake server in a background thread; point a Twilio client at server.base_url
+
+    on_call_created(call_sid, params) is called for every call created, with the request's
+    form fields (Url, To, From, StatusCallback, ...).
+    """
+    server = FakeServer(('127.0.0.1', port), FakeTwilioHandler)
+    server.latency = latency
+    server.failure_rate = failure_rate
+    server.on_call_created = on_call_created
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.calls_created = 0
+    server.request_times = []
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8002)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_fake_twilio_server(args.port, args.latency, args.failure_rate)
+    print(f"Fake Twilio server listening at {server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        sys.exit(0)
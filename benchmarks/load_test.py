@@ -0,0 +1,120 @@
+"""Drive simulated Twilio webhooks against the async server with stubbed LLM and Mongo backends"""
+import io
+import os
+import sys
+import time
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import aiohttp
+import uvicorn
+
+from fake_llm_server import start_fake_llm_server
+
+
+class StubAsyncDatabase:
+    def __init__(self, latency=0.005):
+        """In-memory stand-in for AsyncDatabase with a fixed round-trip latency"""
+        self.latency = latency
+        self.calls = {}
+
+    async def ping(self):
+        await asyncio.sleep(self.latency)
+
+    async def record_call_initiated(self, call_sid, customer_id, phone_number):
+        await asyncio.sleep(self.latency)
+        self.calls.setdefault(call_sid, {})['status'] = 'initiated'
+
+    async def update_call_status(self, call_sid, status):
+        await asyncio.sleep(self.latency)
+        self.calls.setdefault(call_sid, {})['status'] = status
+
+    async def get_turn_context(self, call_sid, max_turns):
+        await asyncio.sleep(self.latency)
+        history = self.calls.get(call_sid, {}).get('conversation_history', [])
+        return {'call_sid': call_sid, 'history': history[-2 * max_turns:], 'summary': None,
+                'turns': len(history) // 2}
+
+    async def append_turns(self, call_sid, messages):
+        await asyncio.sleep(self.latency)
+        self.calls.setdefault(call_sid, {}).setdefault('conversation_history', []).extend(messages)
+
+    def close(self):
+        pass
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(pct / 100 * len(samples)))]
+
+
+async def post(session, url, data):
+    async with session.post(url, data=data) as response:
+        response.raise_for_status()
+        return await response.read()
+
+
+async def simulate_call(session, base_url, call_number, turns, latencies):
+    """Play one call: greeting, N speech turns and the completed callback"""
+    call_sid = f"CA{call_number:032d}"
+    await post(session, f"{base_url}/handle-call", {'CallSid': call_sid})
+    for turn in range(turns):
+        start = time.perf_counter()
+        await post(session, f"{base_url}/handle-call", {'CallSid': call_sid, 'SpeechResult': f"Question {turn}?"})
+        latencies.append((time.perf_counter() - start) * 1000)
+    await post(session, f"{base_url}/call-status", {'CallSid': call_sid, 'CallStatus': 'completed'})
+
+
+async def run_level(base_url, concurrency, turns, force_close=False):
+    latencies = []
+    # force_close gives every webhook a new connection, as Twilio's are not pinned to one server
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=force_close)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(simulate_call(session, base_url, i, turns, latencies) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+async def main(args):
+    if args.llm_url:
+        llm_url = args.llm_url
+    else:
+        llm_url = start_fake_llm_server(first_token_delay=args.llm_latency, token_delay=0).base_url
+
+    import asgi_app
+    from llm_client import AsyncLLMClient
+    asgi_app.db = StubAsyncDatabase(args.mongo_latency)
+    asgi_app.llm = AsyncLLMClient(api_key='fake', base_url=llm_url, max_connections=max(args.concurrency))
+    asgi_app.twilio_client = object()
+
+    server = uvicorn.Server(uvicorn.Config(asgi_app.app, host='127.0.0.1', port=args.port, log_level='warning'))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    print(f"LLM {args.llm_url or f'latency {args.llm_latency * 1000:.0f}ms'}, Mongo latency {args.mongo_latency * 1000:.0f}ms, "
+          f"{args.turns} turns per call")
+    print(f"{'concurrency':>12}{'turns':>8}{'p50 ms':>10}{'p99 ms':>10}{'turns/s':>10}")
+    for concurrency in args.concurrency:
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies, elapsed = await run_level(f"http://127.0.0.1:{args.port}", concurrency, args.turns)
+        print(f"{concurrency:>12}{len(latencies):>8}{percentile(latencies, 50):>10.0f}"
+              f"{percentile(latencies, 99):>10.0f}{len(latencies) / elapsed:>10.1f}")
+
+    server.should_exit = True
+    await task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100, 200])
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--llm-latency', type=float, default=1.0)
+    parser.add_argument('--mongo-latency', type=float, default=0.005)
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--llm-url', help="Use an already running fake LLM server instead of an in-process one")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,336 @@
+"""End-to-end benchmark of the Flask app against local stand-ins for Twilio, OpenAI and MongoDB
+
+The real app is served in-process by a threaded werkzeug server. OpenAI is the fake LLM server
+with configurable token latency, the Twilio REST API is the fake Twilio server, and MongoDB is
+mongomock or, with --mongo-uri, a local mongod. Two scenarios run:
+
+  conversations  scripted multi-turn calls from conversations.json, replayed through the
+                 webhooks (status callbacks, <Gather>, <Redirect>) at each concurrency level
+  campaign       seeded customers dialed through /initiate-calls; every call the fake Twilio
+                 API creates is then played through the webhooks like a real one
+
+Each reports turn-latency percentiles, throughput and resident memory. --save-baseline writes
+the results for later runs to --compare against; a metric that is worse than its baseline by
+more than --tolerance exits with status 1, so CI can flag the regression.
+
+App settings come from the environment as usual (e.g. LLM_STREAMING=true, RESPONSE_CACHE=true),
+so the suite measures whichever configuration is deployed; they are saved with the results.
+"""
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import contextlib
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src'))
+
+import aiohttp
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from fake_llm_server import start_fake_llm_server
+from fake_twilio_server import start_fake_twilio_server
+from load_test import percentile
+from webhook_driver import WebhookDriver
+
+DEFAULT_CONVERSATIONS = os.path.join(BENCHMARKS_DIR, 'conversations.json')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+# Applied unless already set: the audio cache needs edge-tts and the network, the dialer's
+# production rate limit of one call per second would make the campaign scenario time the limiter,
+# and the calling window is opened all day so the campaign doesn't depend on the time of the run
+SUITE_DEFAULTS = {
+    'MONGO_ENSURE_INDEXES': 'false',
+    'TTS_AUDIO_CACHE': 'false',
+    'DIALER_CALLS_PER_SECOND': '50',
+    'DIALER_MAX_CONCURRENT_CALLS': '50',
+    'DIALER_RETRY_BACKOFF': '0.1',
+    'CAMPAIGN_WINDOW_START': '00:00',
+    'CAMPAIGN_WINDOW_END': '24:00',
+}
+# Settings that change what a turn does, saved with the results so baselines stay comparable
+CONFIG_KEYS = ('LLM_STREAMING', 'RESPONSE_CACHE', 'CONVERSATION_SUMMARIES', 'SESSION_STORE', 'SESSION_AFFINITY',
+               'METRICS_ENABLED', 'MONGO_WRITE_BEHIND', 'PROMPT_HISTORY_TURNS') + tuple(SUITE_DEFAULTS)
+
+# Differences below these are noise on a shared runner, whatever the tolerance
+ABSOLUTE_SLACK = {'_ms': 2.0, '_mb': 10.0, '_per_s': 0.0}
+# Reported but never failed on: tails of a saturated server swing by a third from run to run
+UNGATED = ('p99_ms', 'campaign.p95_ms')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def memory_mb():
+    """Current and peak resident set size of this process (app, fakes and driver together)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        current = peak
+    return round(current, 1), round(peak, 1)
+
+
+def latency_summary(latencies, elapsed):
+    latencies = [seconds * 1000 for seconds in latencies]
+    if not latencies:
+        return {'turns': 0}
+    current, peak = memory_mb()
+    return {
+        'turns': len(latencies),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'turns_per_s': round(len(latencies) / elapsed, 2),
+        'rss_mb': current,
+        'peak_rss_mb': peak,
+    }
+
+
+def start_app(args, llm, twilio):
+    """Import the app against the stand-ins and serve it on a free local port"""
+    os.environ.update(OPENAI_BASE_URL=llm.base_url, OPENAI_API_KEY='fake', TWILIO_ACCOUNT_SID='AC' + '0' * 32,
+                      TWILIO_AUTH_TOKEN='fake', TWILIO_PHONE_NUMBER='+15550000000',
+                      MONGO_URI=args.mongo_uri or 'mongodb://127.0.0.1:1')
+    for key, value in SUITE_DEFAULTS.items():
+        os.environ.setdefault(key, value)
+    # Completed calls are queued for post-call processing; each run starts with an empty queue of its own
+    os.environ.setdefault('POST_CALL_QUEUE_PATH', os.path.join(tempfile.mkdtemp(prefix='suite-'), 'post_call_queue.db'))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+        from database import Database
+        if args.mongo_uri:
+            app.db = Database(mongo_uri=args.mongo_uri, db_name=args.mongo_db)
+            app.db.calls.drop()
+            app.db.customers.drop()
+            app.db.ensure_indexes()
+        else:
+            import mongomock
+            app.db = Database(client=mongomock.MongoClient(), db_name=args.mongo_db)
+    app.twilio_client.api.base_url = twilio.base_url
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    # The webhook and status callback URLs handed to Twilio
+    app.settings.base_url = base_url
+    return app, server, base_url
+
+
+def new_session(concurrency):
+    # Twilio opens a new connection for each webhook rather than reusing one per call
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=True)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=60))
+
+
+async def replay_conversations(base_url, scripts, concurrency, calls):
+    """Play `calls` scripted calls, `concurrency` at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+    async with new_session(concurrency) as session:
+        driver = WebhookDriver(session, base_url)
+
+        async def play(number):
+            async with semaphore:
+                script = scripts[number % len(scripts)]['turns']
+                return await driver.play(f"CA{uuid.uuid4().hex}", script, status_callback='/call-status')
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(play(number) for number in range(calls)))
+        elapsed = time.perf_counter() - start
+
+    latencies = [latency for result in results for latency in result.turn_latencies]
+    summary = latency_summary(latencies, elapsed)
+    summary.update(calls=calls, errors=sum(1 for result in results if result.error))
+    return summary
+
+
+async def run_campaign(app, twilio, base_url, scripts, customers, timeout=300):
+    """Dial seeded customers through /initiate-calls and play every call Twilio is asked to place"""
+    app.db.customers.delete_many({})
+    app.db.customers.insert_many([{'name': f"Customer {number}", 'phone_number': f"+1555{number:07d}"}
+                                  for number in range(customers)])
+    loop = asyncio.get_running_loop()
+    calls = []
+
+    async with new_session(customers) as session:
+        driver = WebhookDriver(session, base_url)
+
+        def on_call_created(call_sid, params):
+            # Called on the fake Twilio server's thread
+            script = scripts[len(calls) % len(scripts)]['turns']
+            coroutine = driver.play(call_sid, script, url=params['Url'], status_callback=params.get('StatusCallback'))
+            calls.append(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+        twilio.on_call_created = on_call_created
+        start = time.perf_counter()
+        async with session.post(f"{base_url}/initiate-calls", data={'limit': customers}) as response:
+            job_id = (await response.json())['job_id']
+        while True:
+            async with session.get(f"{base_url}/dialer-jobs/{job_id}") as response:
+                job = await response.json()
+            if job['status'] == 'completed' or time.perf_counter() - start > timeout:
+                break
+            await asyncio.sleep(0.05)
+        results = await asyncio.gather(*(asyncio.wrap_future(call) for call in calls))
+        elapsed = time.perf_counter() - start
+        twilio.on_call_created = None
+
+    latencies = [latency for result in results for latency in result.turn_latencies]
+    summary = latency_summary(latencies, elapsed)
+    summary.update(
+        calls=job['dialed'],
+        failed_dials=job['failed'],
+        errors=sum(1 for result in results if result.error),
+        completed=app.db.calls.count_documents({'call_sid': {'$in': [result.call_sid for result in results]},
+                                                 'status': 'completed'}),
+        dial_calls_per_s=round(job['calls_per_second'], 2),
+        calls_per_s=round(len(results) / elapsed, 2),
+    )
+    return summary
+
+
+def flatten(results, prefix=''):
+    """Comparable metrics as {'scenario.level.metric': value}"""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and any(key.endswith(suffix) for suffix in ABSOLUTE_SLACK):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(report, baseline, tolerance):
+    """Print every metric against the baseline; returns the regressed ones"""
+    if baseline.get('config') != report['config']:
+        print("warning: the baseline was recorded with different settings:")
+        for key in CONFIG_KEYS:
+            if baseline.get('config', {}).get(key) != report['config'].get(key):
+                print(f"  {key}: {baseline.get('config', {}).get(key)} -> {report['config'].get(key)}")
+
+    current = flatten(report['results'])
+    regressions = []
+    print(f"\n{'metric':<38}{'baseline':>11}{'current':>11}{'change':>9}")
+    for key, base in flatten(baseline['results']).items():
+        value = current.get(key)
+        if value is None:
+            continue
+        suffix = next(suffix for suffix in ABSOLUTE_SLACK if key.endswith(suffix))
+        if suffix == '_per_s':
+            regressed = value < base * (1 - tolerance)
+        else:
+            regressed = value > base * (1 + tolerance) + ABSOLUTE_SLACK[suffix]
+        if key.endswith(UNGATED):
+            regressed = False
+        change = (value - base) / base if base else 0.0
+        print(f"{key:<38}{base:>11.2f}{value:>11.2f}{change:>+9.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(key)
+    return regressions
+
+
+def print_level(name, summary):
+    if not summary['turns']:
+        print(f"{name:<16}no turns completed, {summary.get('errors', 0)} errors")
+        return
+    print(f"{name:<16}{summary['calls']:>6}{summary['turns']:>7}{summary['p50_ms']:>9.1f}{summary['p95_ms']:>9.1f}"
+          f"{summary['p99_ms']:>9.1f}{summary['turns_per_s']:>10.1f}{summary['rss_mb']:>9.1f}{summary['errors']:>8}")
+
+
+async def run(args):
+    with open(args.conversations) as f:
+        scripts = json.load(f)
+
+    llm = start_fake_llm_server(first_token_delay=args.llm_first_token, token_delay=args.llm_token_delay)
+    twilio = start_fake_twilio_server(latency=args.twilio_latency)
+    app, server, base_url = start_app(args, llm, twilio)
+
+    report = {
+        'config': {key: os.environ.get(key) for key in CONFIG_KEYS},
+        'environment': {'python': platform.python_version(), 'cpus': os.cpu_count(),
+                        'mongo': 'mongod' if args.mongo_uri else 'mongomock',
+                        'llm_first_token_s': args.llm_first_token, 'llm_token_s': args.llm_token_delay},
+        'results': {},
+    }
+    print(f"LLM first token {args.llm_first_token * 1000:.0f}ms + {args.llm_token_delay * 1000:.0f}ms/token, "
+          f"Twilio API {args.twilio_latency * 1000:.0f}ms, {report['environment']['mongo']}, "
+          f"{len(scripts)} scripts, {os.cpu_count()} CPU(s)")
+    print(f"\n{'scenario':<16}{'calls':>6}{'turns':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'turns/s':>10}"
+          f"{'RSS MB':>9}{'errors':>8}")
+
+    try:
+        if 'conversations' in args.scenarios:
+            levels = report['results']['conversations'] = {}
+            for concurrency in args.concurrency:
+                calls = args.calls or max(8, 2 * concurrency)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    summary = await replay_conversations(base_url, scripts, concurrency, calls)
+                levels[f"c{concurrency}"] = summary
+                print_level(f"replay c={concurrency}", summary)
+
+        if 'campaign' in args.scenarios:
+            with contextlib.redirect_stdout(io.StringIO()):
+                summary = await run_campaign(app, twilio, base_url, scripts, args.customers)
+            report['results']['campaign'] = summary
+            print_level('campaign', summary)
+            print(f"{'':<16}dialed {summary['calls']} at {summary['dial_calls_per_s']:.1f} calls/s, "
+                  f"{summary['completed']} completed, {summary['calls_per_s']:.1f} calls/s end to end")
+    finally:
+        server.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=['conversations', 'campaign'],
+                        choices=['conversations', 'campaign'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--calls', type=int, help="Calls per concurrency level (default: 2x concurrency, at least 8)")
+    parser.add_argument('--customers', type=int, default=100, help="Customers dialed by the campaign scenario")
+    parser.add_argument('--conversations', default=DEFAULT_CONVERSATIONS, help="JSON list of {name, turns} scripts")
+    parser.add_argument('--llm-first-token', type=float, default=0.1, help="Seconds to the first LLM token")
+    parser.add_argument('--llm-token-delay', type=float, default=0.005, help="Seconds between LLM tokens")
+    parser.add_argument('--twilio-latency', type=float, default=0.05, help="Twilio REST API latency in seconds")
+    parser.add_argument('--mongo-uri', help="Use this MongoDB (e.g. a local mongod) instead of mongomock")
+    parser.add_argument('--mongo-db', default='bench_suite', help="Database to use; it is dropped first")
+    parser.add_argument('--output', help="Write the results as JSON")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, help="Save the results as the baseline")
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE,
+                        help="Compare against a baseline and exit 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+        print(f"\nSaved baseline to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Drive the /media-stream websocket like Twilio would, fully offline: reply latency and barge-in
+
+Callers stream synthetic mu-law speech and silence in real time. Transcription and synthesis are
+local stand-ins, and the LLM stage streams from the fake LLM server.
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import asyncio
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import aiohttp
+import numpy as np
+import uvicorn
+
+from fake_llm_server import start_fake_llm_server
+from load_test import StubAsyncDatabase, percentile
+from media_stream import FRAME_SAMPLES, SAMPLE_RATE, ulaw_decode, ulaw_encode
+
+FRAME_SECONDS = FRAME_SAMPLES / SAMPLE_RATE
+
+
+class ScriptedASR:
+    def __init__(self, delay):
+        """Stands in for a transcription service with a fixed latency"""
+        self.delay = delay
+
+    def start(self, call_sid):
+        return ScriptedUtterance(self.delay)
+
+
+class ScriptedUtterance:
+    def __init__(self, delay):
+        self.delay = delay
+        self.samples = 0
+
+    def feed(self, pcm):
+        self.samples += len(pcm)
+
+    async def finish(self):
+        await asyncio.sleep(self.delay)
+        return f"I said something for {self.samples / SAMPLE_RATE:.1f} seconds."
+
+
+class ToneTTS:
+    def __init__(self, first_chunk_delay, ms_per_char=60):
+        """Stands in for streaming synthesis: a quiet tone as long as the text would take to speak"""
+        self.first_chunk_delay = first_chunk_delay
+        self.ms_per_char = ms_per_char
+
+    async def synthesize(self, text):
+        await asyncio.sleep(self.first_chunk_delay)
+        total = int(len(text) * self.ms_per_char / 1000 * SAMPLE_RATE)
+        tone = (np.sin(np.arange(1600) * 2 * np.pi * 440 / SAMPLE_RATE) * 2000).astype(np.int16)
+        for start in range(0, total, len(tone)):
+            yield tone[:total - start]
+            await asyncio.sleep(0.005)
+
+
+def caller_frames():
+    """One second of speech-like frames and one silent frame, already mu-law encoded"""
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    speech = (np.sin(2 * np.pi * 220 * t) * (4000 + 3000 * np.sin(2 * np.pi * 3 * t))).astype(np.int16)
+    speech_frames = [base64.b64encode(ulaw_encode(speech[i:i + FRAME_SAMPLES])).decode()
+                     for i in range(0, SAMPLE_RATE, FRAME_SAMPLES)]
+    silence = (np.random.default_rng(0).normal(0, 30, FRAME_SAMPLES)).astype(np.int16)
+    return speech_frames, base64.b64encode(ulaw_encode(silence)).decode()
+
+
+class FakeTwilioCaller:
+    def __init__(self, ws, call_number, frames):
+        """One call's Media Streams client: streams caller audio and plays back (and acks) the bot's"""
+        self.ws = ws
+        self.stream_sid = f"MZ{call_number:032d}"
+        self.call_sid = f"CA{call_number:032d}"
+        self.speech_frames, self.silence_frame = frames
+        self.next_frame_at = time.perf_counter()
+        self.first_media_at = None
+        self.last_media_at = 0.0
+        self.clear_at = None
+        self.playback_until = 0.0
+        self.generation = 0
+
+    async def send(self, event, **fields):
+        await self.ws.send_str(json.dumps({'event': event, 'streamSid': self.stream_sid, **fields}))
+
+    async def stream(self, seconds, speech=False, until=None):
+        """Send frames in real time for `seconds`, or until until() is true"""
+        deadline = time.perf_counter() + seconds
+        index = 0
+        while time.perf_counter() < deadline and not (until and until()):
+            payload = self.speech_frames[index % len(self.speech_frames)] if speech else self.silence_frame
+            index += 1
+            await self.send('media', media={'payload': payload})
+            self.next_frame_at += FRAME_SECONDS
+            await asyncio.sleep(max(0, self.next_frame_at - time.perf_counter()))
+
+    async def receive(self):
+        async for message in self.ws:
+            data = json.loads(message.data)
+            now = time.perf_counter()
+            if data['event'] == 'media':
+                if self.first_media_at is None:
+                    self.first_media_at = now
+                self.last_media_at = now
+                # Twilio queues outbound audio and plays it in real time
+                samples = len(ulaw_decode(base64.b64decode(data['media']['payload'])))
+                self.playback_until = max(self.playback_until, now) + samples / SAMPLE_RATE
+            elif data['event'] == 'mark':
+                asyncio.ensure_future(self.ack_mark(data['mark']['name'], self.generation))
+            elif data['event'] == 'clear':
+                self.clear_at = now
+                self.playback_until = now
+                self.generation += 1
+
+    async def ack_mark(self, name, generation):
+        await asyncio.sleep(max(0, self.playback_until - time.perf_counter()))
+        if generation == self.generation:
+            await self.send('mark', mark={'name': name})
+
+
+async def simulate_call(session, url, call_number, frames, results):
+    """Ask a question, wait for the reply, then interrupt the second reply mid-playback"""
+    async with session.ws_connect(url) as ws:
+        caller = FakeTwilioCaller(ws, call_number, frames)
+        receiver = asyncio.create_task(caller.receive())
+        await caller.send('connected')
+        await caller.send('start', start={'streamSid': caller.stream_sid, 'callSid': caller.call_sid})
+
+        for turn in range(2):
+            caller.first_media_at = None
+            await caller.stream(1.0, speech=True)
+            speech_ended_at = time.perf_counter()
+            await caller.stream(10, until=lambda: caller.first_media_at is not None)
+            if caller.first_media_at is not None:
+                results['reply_ms'].append((caller.first_media_at - speech_ended_at) * 1000)
+
+            if turn == 1:
+                # Talk over the bot shortly after it starts speaking
+                await caller.stream(0.3)
+                barge_started_at = time.perf_counter()
+                await caller.stream(0.8, speech=True)
+                if caller.clear_at is not None:
+                    results['barge_in_ms'].append((caller.clear_at - barge_started_at) * 1000)
+            # Let the rest of the reply arrive and play out before the next question
+            await caller.stream(30, until=lambda: time.perf_counter() > max(caller.playback_until, caller.last_media_at + 1.0))
+
+        await caller.send('stop')
+        await ws.close()
+        receiver.cancel()
+
+
+async def main(args):
+    llm_url = start_fake_llm_server(first_token_delay=args.llm_latency, token_delay=0.02).base_url
+
+    import asgi_app
+    from llm_client import AsyncLLMClient
+    from media_stream import LLMReplyStage, MediaPipeline
+
+    db = StubAsyncDatabase()
+    llm = AsyncLLMClient(api_key='fake', base_url=llm_url)
+    asgi_app.db = db
+    asgi_app.llm = llm
+    asgi_app.twilio_client = object()
+    asgi_app.media_pipeline = MediaPipeline(
+        asr=ScriptedASR(args.asr_latency),
+        llm=LLMReplyStage(llm, asgi_app.context),
+        tts=ToneTTS(args.tts_latency),
+        on_turn=db.append_turns,
+        hangover_ms=args.hangover_ms,
+        early_ms=args.early_ms
+    )
+
+    server = uvicorn.Server(uvicorn.Config(asgi_app.app, host='127.0.0.1', port=args.port, log_level='warning'))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    # mu-law round trip of a full-scale sweep, as a codec sanity check
+    pcm = np.linspace(-32768, 32767, SAMPLE_RATE).astype(np.int16)
+    decoded = ulaw_decode(ulaw_encode(pcm)).astype(np.float64)
+    snr = 10 * np.log10(np.sum(pcm.astype(np.float64) ** 2) / np.sum((pcm - decoded) ** 2))
+    print(f"mu-law round trip SNR: {snr:.1f} dB")
+
+    frames = caller_frames()
+    results = {'reply_ms': [], 'barge_in_ms': []}
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(*(simulate_call(session, f"ws://127.0.0.1:{args.port}/media-stream", i, frames, results)
+                                   for i in range(args.calls)))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    stats = asgi_app.media_pipeline.snapshot()
+    print(f"{args.calls} concurrent calls, endpoint {args.early_ms}ms early / {args.hangover_ms}ms final, ASR {args.asr_latency * 1000:.0f}ms, "
+          f"LLM first token {args.llm_latency * 1000:.0f}ms, TTS first chunk {args.tts_latency * 1000:.0f}ms")
+    if results['reply_ms']:
+        print(f"end of speech -> first bot audio: p50 {percentile(results['reply_ms'], 50):.0f}ms, "
+              f"max {max(results['reply_ms']):.0f}ms over {len(results['reply_ms'])} replies")
+    if results['barge_in_ms']:
+        print(f"caller speech -> clear (barge-in): p50 {percentile(results['barge_in_ms'], 50):.0f}ms, "
+              f"max {max(results['barge_in_ms']):.0f}ms")
+    print(f"turns {stats['turns']}, barge-ins {stats['barge_ins']}/{args.calls}, "
+          f"speculative replies {stats['speculations']} ({stats['speculations_discarded']} discarded), "
+          f"turns stored {sum(len(c.get('conversation_history', [])) for c in db.calls.values()) // 2}")
+    print(f"server + callers CPU: {cpu / elapsed:.0%} of one core over {elapsed:.1f}s")
+
+    server.should_exit = True
+    await task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=5)
+    parser.add_argument('--hangover-ms', type=int, default=600)
+    parser.add_argument('--early-ms', type=int, default=250)
+    parser.add_argument('--asr-latency', type=float, default=0.15)
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--tts-latency', type=float, default=0.1)
+    parser.add_argument('--port', type=int, default=8011)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,63 @@
+"""Soak the session cache with simulated calls and check that memory stays flat"""
+import os
+import sys
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from session_cache import SessionCache
+
+
+def play_call(conversations, call_sid, turns, complete):
+    """One call as AIAgent/handle_call drive it: create, N turns, then the completed callback"""
+    session = conversations.get(call_sid)
+    if session is None:
+        session = {'history': [], 'customer_responses': {}}
+        conversations[call_sid] = session
+    for turn in range(turns):
+        session['history'].append({'role': 'user', 'content': f"Customer utterance number {turn} " * 4})
+        session['history'].append({'role': 'assistant', 'content': f"Agent reply number {turn} " * 8})
+    # The old AIAgent dict never dropped finished calls; the cache evicts on the completed callback
+    if complete and isinstance(conversations, SessionCache):
+        conversations.evict(call_sid)
+
+
+def soak(conversations, calls, turns, abandon_every, checkpoint):
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    samples = []
+    for i in range(calls):
+        # Every Nth call never sends a completed callback, so only LRU/TTL can reclaim it
+        play_call(conversations, f"CA{i:032d}", turns, complete=(i % abandon_every) != 0)
+        if (i + 1) % checkpoint == 0:
+            samples.append((i + 1, len(conversations), (tracemalloc.get_traced_memory()[0] - baseline) / 1024))
+    tracemalloc.stop()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--calls', type=int, default=10000)
+    parser.add_argument('--turns', type=int, default=5)
+    parser.add_argument('--max-sessions', type=int, default=500)
+    parser.add_argument('--abandon-every', type=int, default=10)
+    args = parser.parse_args()
+
+    checkpoint = max(1, args.calls // 10)
+    results = {
+        'plain dict': soak({}, args.calls, args.turns, args.abandon_every, checkpoint),
+        'SessionCache': soak(SessionCache(max_sessions=args.max_sessions), args.calls, args.turns,
+                             args.abandon_every, checkpoint),
+    }
+
+    print(f"{'calls':>8}" + ''.join(f"{name + ' entries':>22}{name + ' KiB':>20}" for name in results))
+    for row in zip(*results.values()):
+        print(f"{row[0][0]:>8}" + ''.join(f"{entries:>22}{kib:>20.0f}" for _, entries, kib in row))
+
+    growth = results['SessionCache'][-1][2] - results['SessionCache'][len(results['SessionCache']) // 2][2]
+    print(f"SessionCache growth over the second half of the soak: {growth:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
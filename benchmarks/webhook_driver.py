@@ -0,0 +1,84 @@
+"""Plays Twilio's side of a call against the webhooks: status callbacks, <Gather> speech and <Redirect>s"""
+import time
+import asyncio
+from urllib.parse import urljoin
+from email.utils import formatdate
+from xml.etree import ElementTree
+
+import aiohttp
+
+
+class CallResult:
+    def __init__(self, call_sid):
+        """What one scripted call saw"""
+        self.call_sid = call_sid
+        self.turn_latencies = []
+        self.redirects = 0
+        self.hung_up = False
+        self.error = None
+
+
+class WebhookDriver:
+    def __init__(self, session, base_url):
+        """Follows the TwiML each webhook returns, the way Twilio would for a real call
+
+        A turn is timed from posting the SpeechResult to receiving the TwiML that starts
+        speaking the reply; with streaming replies the following <Redirect>s are not counted.
+        """
+        self.session = session
+        self.base_url = base_url
+
+    async def post(self, url, data):
+        async with self.session.post(urljoin(self.base_url, url), data=data) as response:
+            response.raise_for_status()
+            return await response.text()
+
+    async def status(self, status_callback, call_sid, status):
+        await self.post(status_callback, {'CallSid': call_sid, 'CallStatus': status,
+                                          'Timestamp': formatdate(usegmt=True)})
+
+    async def play(self, call_sid, script, url='/handle-call', status_callback=None):
+        """Answer the call, say each line of the script when asked to, then hang up"""
+        result = CallResult(call_sid)
+        try:
+            if status_callback:
+                for status in ('initiated', 'ringing', 'in-progress'):
+                    await self.status(status_callback, call_sid, status)
+            twiml = await self.post(url, {'CallSid': call_sid, 'CallStatus': 'in-progress'})
+            utterances = iter(script)
+            while True:
+                verb, target = next_action(twiml)
+                if verb == 'redirect':
+                    result.redirects += 1
+                    twiml = await self.post(target, {'CallSid': call_sid, 'CallStatus': 'in-progress'})
+                    continue
+                if verb == 'hangup':
+                    result.hung_up = True
+                    break
+                speech = next(utterances, None)
+                if verb is None or speech is None:
+                    break
+                start = time.perf_counter()
+                twiml = await self.post(target, {'CallSid': call_sid, 'CallStatus': 'in-progress',
+                                                 'SpeechResult': speech, 'Confidence': '0.92'})
+                result.turn_latencies.append(time.perf_counter() - start)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ElementTree.ParseError) as e:
+            result.error = f"{type(e).__name__}: {e}"
+        if status_callback:
+            try:
+                await self.status(status_callback, call_sid, 'completed')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+        return result
+
+
+def next_action(twiml):
+    """The verb that decides what Twilio does after speaking: ('gather'|'redirect'|'hangup'|None, url)"""
+    for element in ElementTree.fromstring(twiml):
+        if element.tag == 'Gather':
+            return 'gather', element.get('action') or '/handle-call'
+        if element.tag == 'Redirect':
+            return 'redirect', element.text.strip()
+        if element.tag == 'Hangup':
+            return 'hangup', None
+    return None, None
@@ -7,6 +7,10 @@ from pathlib import Path
 env_path = Path(__file__).parent / "src" / ".env"
 load_dotenv(dotenv_path=env_path)
 
+# Dial the same way the webhook servers do
+sys.path.insert(0, str(Path(__file__).parent / "src"))
+from conversation_engine import dial_params
+
 def make_outbound_call():
     """Make an outbound call using Twilio directly"""
     # Check if required environment variables are set
@@ -32,13 +36,7 @@ def make_outbound_call():
     
     try:
         # Make the call
-        call = client.calls.create(
-            url=f"{base_url}/handle-call",
-            to=personal_phone,
-            from_=twilio_phone_number,
-            status_callback=f"{base_url}/call-status",
-            status_callback_event=['initiated', 'ringing', 'answered', 'completed']
-        )
+        call = client.calls.create(**dial_params(personal_phone))
         
         print(f"Call initiated with SID: {call.sid}")
         print(f"Call status: {call.status}")
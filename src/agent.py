@@ -1,148 +1,224 @@
 import os
-from twilio.rest import Client
-import openai
-from tts_service import TextToSpeech
+import time
+from concurrent.futures import ThreadPoolExecutor
+from llm_client import get_llm_client
+from model_router import ModelRouter
+from session_cache import SessionCache
+from context_builder import ContextBuilder, ConversationSummarizer
+from conversation_engine import ConversationEngine, SessionStore, place_call
+from call_flow import PRODUCT_INFO, SYSTEM_PROMPT, should_end_call
+from response_cache import ResponseCache
+from metrics import get_metrics
+from post_call import call_outcome
+from startup import Lazy
 import json
-from dotenv import load_dotenv
+from settings import load_env, get_settings
 
 # Load environment variables
-load_dotenv()
+load_env()
+
+# Structured fields pulled out of each customer utterance
+EXTRACTION_PROMPT = "Extract key information from the customer response. Return a JSON with these fields if present: interest_level (high/medium/low), objections, questions, contact_preference (email/phone/none), email, callback_time."
+
+# Appended to the system prompt in single-call mode so one completion carries both the reply and the fields
+SINGLE_CALL_PROMPT = """
+            Respond only with a JSON object of the form {"reply": "<what you say to the customer next>", "fields": {...}}.
+            In "fields", include key information from the customer's latest message if present: interest_level (high/medium/low), objections, questions, contact_preference (email/phone/none), email, callback_time.
+            """
+
+# serial: extract, then reply (two round-trips); concurrent: both at once, turn waits for both;
+# background: reply only, extraction finishes after the response is returned; single: one call for both
+EXTRACTION_MODES = ('serial', 'concurrent', 'background', 'single')
 
 class AIAgent:
-    def __init__(self):
-        # Initialize Twilio client
-        twilio_account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
-        twilio_auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
+    def __init__(self, db=None, extraction_mode=None):
+        self.settings = get_settings()
         
-        if not twilio_account_sid or not twilio_auth_token:
+        # Initialize Twilio client, on first use
+        if not self.settings.twilio_account_sid or not self.settings.twilio_auth_token:
             print("Warning: Twilio credentials not found in environment variables")
             
-        self.twilio_client = Client(twilio_account_sid, twilio_auth_token)
-        
-        # Initialize OpenAI client
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
-        if not openai_api_key:
-            print("Warning: OpenAI API key not found in environment variables")
-        
-        openai.api_key = openai_api_key
-        
-        # Initialize TTS service
-        self.tts = TextToSpeech()
-        
-        # Store conversation history for each call
-        self.conversations = {}
-        
-        # Product information for the AI to use
-        self.product_info = {
-            "name": "Call Worklog AI",
-            "description": "An AI tool that automatically generates work logs based on your activities",
-            "benefits": [
-                "Save time by automating work log creation",
-                "Ensure accurate documentation of work activities",
-                "Improve productivity by focusing on work instead of reporting",
-                "Easy integration with existing workflow systems"
-            ],
-            "pricing": {
-                "basic": "$9.99/month",
-                "pro": "$19.99/month",
-                "enterprise": "Custom pricing"
-            }
-        }
+        self.twilio_client = Lazy(self._create_twilio_client)
+        
+        # Shared OpenAI client with a pooled keep-alive connection
+        self.llm = Lazy(get_llm_client)
+        
+        # Initialize TTS service, on first use
+        self.tts = Lazy(self._create_tts)
+        
+        # Per-stage turn latency, shared with the webhooks' /metrics
+        self.metrics = get_metrics()
+        
+        # Bounded cache of conversation state for each live call; with a database it is
+        # written through on every turn and reloaded from MongoDB on a miss (or on every
+        # turn with SESSION_STORE=shared, so any worker process can serve the call)
+        self.db = db
+        self.conversations = SessionCache(loader=self._load_conversation if db else None)
+        
+        # Product information for the AI to use, the same the webhooks' prompt carries
+        self.product_info = PRODUCT_INFO
+        
+        summarizer = ConversationSummarizer(self.llm, on_summary=db.save_conversation_summary if db else None)
+        self.context = ContextBuilder(SYSTEM_PROMPT, summarizer=summarizer)
+        self.single_call_context = ContextBuilder(SYSTEM_PROMPT + SINGLE_CALL_PROMPT, summarizer=summarizer)
+        
+        # How the per-utterance extraction call is scheduled relative to the reply
+        self.extraction_mode = extraction_mode or os.environ.get('EXTRACTION_MODE', 'serial')
+        if self.extraction_mode not in EXTRACTION_MODES:
+            raise ValueError(f"Unknown extraction mode: {self.extraction_mode}")
+        self.extraction_executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get('EXTRACTION_WORKERS', 4)),
+            thread_name_prefix='extraction'
+        )
+        
+        # Approved answers for common questions and objections, served without an LLM call
+        self.response_cache = None
+        if self.settings.response_cache:
+            self.response_cache = ResponseCache()
+        
+        # The same turn steps as the webhooks: replies hedged across models, prompt and cache lookups.
+        # Conversations are written through to MongoDB on every turn when there is a database
+        self.engine = ConversationEngine(
+            store=SessionStore(self.conversations, append=db.append_turns if db else None,
+                               create=self._new_conversation),
+            llm=ModelRouter(self.llm),
+            context=self.context,
+            response_cache=self.response_cache,
+            metrics=self.metrics
+        )
+    
+    def _create_twilio_client(self):
+        from twilio.rest import Client
+        return Client(self.settings.twilio_account_sid, self.settings.twilio_auth_token)
+    
+    def _create_tts(self):
+        from tts_service import TextToSpeech
+        return TextToSpeech()
     
     def start_outbound_call(self, phone_number, customer_id=None):
         """Start an outbound call to a customer"""
-        call = self.twilio_client.calls.create(
-            url=f"{os.environ.get('BASE_URL')}/handle-call",
-            to=phone_number,
-            from_=os.environ.get('TWILIO_PHONE_NUMBER'),
-            status_callback=f"{os.environ.get('BASE_URL')}/call-status",
-            status_callback_event=['initiated', 'ringing', 'answered', 'completed']
-        )
+        call_sid = place_call(self.twilio_client, phone_number, self.settings)
         
         # Initialize conversation history for this call
-        self.conversations[call.sid] = {
-            "customer_id": customer_id,
-            "phone_number": phone_number,
+        conversation = self._new_conversation(call_sid)
+        conversation.update(customer_id=customer_id, phone_number=phone_number)
+        self.conversations[call_sid] = conversation
+        if self.db:
+            self.db.record_call_initiated(call_sid, customer_id, phone_number)
+        
+        return call_sid
+    
+    def _new_conversation(self, call_sid):
+        return {
+            "call_sid": call_sid,
             "history": [],
+            "summary": None,
+            "turns": 0,
             "customer_responses": {},
             "call_outcome": None,
             "should_end": False
         }
-        
-        return call.sid
+    
+    def _load_conversation(self, call_sid):
+        """Rebuild a conversation from MongoDB after a cache miss"""
+        call_data = self.db.get_call_data(call_sid)
+        if not (call_data.get('conversation_history') or call_data.get('customer_responses') or call_data.get('phone_number')):
+            return None
+        conversation = {
+            "call_sid": call_sid,
+            "customer_id": call_data.get('customer_id'),
+            "phone_number": call_data.get('phone_number'),
+            # Turns the summary already covers aren't replayed into the prompt
+            "history": call_data.get('conversation_history', [])[call_data.get('summarized_count', 0):],
+            "summary": call_data.get('summary'),
+            "summarized": call_data.get('summarized_count', 0),
+            "customer_responses": call_data.get('customer_responses', {}),
+            "call_outcome": None,
+            "should_end": False
+        }
+        # should_end isn't stored, so work it out again from the last reply
+        history = conversation["history"]
+        conversation["turns"] = sum(1 for m in call_data.get('conversation_history', []) if m["role"] == "user")
+        if history and history[-1]["role"] == "assistant":
+            conversation["should_end"] = should_end_call(history[-1]["content"])
+        return conversation
     
     def process_customer_input(self, call_sid, customer_input):
         """Process customer input and generate AI response"""
-        if call_sid not in self.conversations:
-            # Initialize if this is a new call
-            self.conversations[call_sid] = {
-                "history": [],
-                "customer_responses": {},
-                "call_outcome": None,
-                "should_end": False
-            }
+        engine = self.engine
+        timer = self.metrics.turn(call_sid)
+        conversation = engine.load(call_sid, timer)
+        turn_number = conversation["turns"] + 1
         
-        conversation = self.conversations[call_sid]
+        # Look the utterance up before it is added, since the stage depends on the turns before it
+        cached = engine.lookup(conversation, customer_input, timer)
+        user_messages = [{"role": "user", "content": customer_input}] if customer_input else []
         
-        # Add customer input to history
-        if customer_input:
-            conversation["history"].append({"role": "user", "content": customer_input})
+        generation_start = time.perf_counter()
+        if cached is not None:
+            # The answer's fields stand in for extraction, so a hit makes no LLM call at all
+            ai_response = cached["answer"]
+            conversation["customer_responses"].update(cached.get("fields", {}))
+        elif customer_input and self.extraction_mode == 'single':
+            # One completion returns the reply and the extracted fields together
+            ai_response = self._generate_reply_and_fields(conversation, user_messages, timer)
+        else:
+            extraction = None
+            if customer_input:
+                # Extract key information from customer input
+                if self.extraction_mode == 'serial':
+                    with timer.stage('extraction'):
+                        self._update_customer_responses(conversation, customer_input)
+                elif self.extraction_mode == 'concurrent':
+                    extraction = self.extraction_executor.submit(self._update_customer_responses, conversation, customer_input)
+                else:
+                    self.extraction_executor.submit(self._extract_in_background, conversation, customer_input)
             
-            # Extract key information from customer input
-            self._update_customer_responses(call_sid, customer_input)
+            # Generate AI response, falling back to a faster model if the primary is slow to answer
+            ai_response = engine.generate(conversation, user_messages, timer)
+            
+            if extraction is not None:
+                with timer.stage('extraction_wait'):
+                    extraction.result()
         
-        # Generate AI response
-        ai_response = self._generate_ai_response(call_sid)
+        if customer_input and cached is None:
+            engine.record_llm_call(time.perf_counter() - generation_start)
+        conversation["should_end"] = should_end_call(ai_response)
         
-        # Add AI response to history
-        conversation["history"].append({"role": "assistant", "content": ai_response})
+        # Add the turn to history, written through to MongoDB so another process can pick the call up
+        engine.record(conversation, user_messages + [{"role": "assistant", "content": ai_response}], timer)
+        if self.db and (self.extraction_mode != 'background' or cached is not None):
+            with timer.stage('mongo_write'):
+                self.db.save_customer_responses(call_sid, conversation["customer_responses"])
         
+        timer.finish(turn=turn_number, extraction_mode=self.extraction_mode, response_cache=cached["id"] if cached else None)
         return ai_response
     
-    def _generate_ai_response(self, call_sid):
-        """Generate AI response using OpenAI"""
-        conversation = self.conversations[call_sid]
-        
-        # Create system message with instructions
-        system_message = {
-            "role": "system", 
-            "content": f"""You are an AI sales agent for Call Worklog AI, a tool that automatically generates work logs based on user activities.
-            Your goal is to introduce the product, explain its benefits, answer any questions, and try to make a sale.
-            Be friendly, professional, and concise. Don't be pushy but guide the conversation towards a sale.
-            Product information: {json.dumps(self.product_info)}
-            
-            If the customer shows interest, ask if they'd like to sign up for a free trial.
-            If the customer declines or wants to end the call, be polite and end the conversation.
-            If the customer asks a question you can't answer, offer to have a product specialist contact them.
-            """
-        }
+    def _generate_reply_and_fields(self, conversation, user_messages, timer):
+        """Generate the AI response and extract customer information in a single OpenAI call"""
+        # The JSON envelope needs more room than a bare 150-token reply
+        content = self.engine.generate(conversation, user_messages, timer,
+                                       context=self.single_call_context, max_tokens=300)
         
-        # Prepare messages for the API call
-        messages = [system_message] + conversation["history"]
-        
-        # Call OpenAI API
-        response = openai.chat.completions.create(
-            model="gpt-4",
-            messages=messages,
-            max_tokens=150
-        )
-        
-        # Check if we should end the call based on the conversation
-        if "thank you for your time" in response.choices[0].message.content.lower() or \
-           "goodbye" in response.choices[0].message.content.lower():
-            conversation["should_end"] = True
+        try:
+            result = json.loads(content)
+            ai_response = result["reply"]
+            if isinstance(result.get("fields"), dict):
+                conversation["customer_responses"].update(result["fields"])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            # The model answered in plain text; speak it and skip extraction for this turn
+            ai_response = content
         
-        return response.choices[0].message.content
+        return ai_response
     
-    def _update_customer_responses(self, call_sid, customer_input):
+    def _update_customer_responses(self, conversation, customer_input):
         """Extract key information from customer input"""
-        conversation = self.conversations[call_sid]
-        
         # Use OpenAI to extract structured information
-        response = openai.chat.completions.create(
+        response = self.llm.chat(
             model="gpt-3.5-turbo",
+            call_sid=conversation.get("call_sid"),
             messages=[
-                {"role": "system", "content": "Extract key information from the customer response. Return a JSON with these fields if present: interest_level (high/medium/low), objections, questions, contact_preference (email/phone/none), email, callback_time."},
+                {"role": "system", "content": EXTRACTION_PROMPT},
                 {"role": "user", "content": customer_input}
             ],
             response_format={"type": "json_object"}
@@ -156,6 +232,21 @@ class AIAgent:
             # If JSON parsing fails, continue without updating
             pass
     
+    def _extract_in_background(self, conversation, customer_input):
+        """Run extraction after the reply has gone out and store the result"""
+        try:
+            self._update_customer_responses(conversation, customer_input)
+            if self.db:
+                self.db.save_customer_responses(conversation["call_sid"], conversation["customer_responses"])
+        except Exception as e:
+            print(f"Error extracting customer responses for {conversation.get('call_sid')}: {e}")
+    
+    def end_call(self, call_sid):
+        """Collect the call data and release the cached conversation"""
+        call_data = self.get_call_data(call_sid)
+        self.conversations.evict(call_sid)
+        return call_data
+    
     def should_end_call(self, call_sid):
         """Check if the call should be ended"""
         if call_sid not in self.conversations:
@@ -170,18 +261,7 @@ class AIAgent:
         
         conversation = self.conversations[call_sid]
         
-        # Determine call outcome
-        if "interest_level" in conversation["customer_responses"]:
-            interest = conversation["customer_responses"]["interest_level"]
-            if interest == "high":
-                outcome = "potential_sale"
-            elif interest == "medium":
-                outcome = "follow_up"
-            else:
-                outcome = "not_interested"
-        else:
-            outcome = "unknown"
-        
-        conversation["call_outcome"] = outcome
+        # Same rule the post-call pipeline stores
+        conversation["call_outcome"] = call_outcome(conversation["customer_responses"])
         
         return conversation
@@ -1,31 +1,164 @@
 from flask import Flask, request, Response
-from twilio.twiml.voice_response import VoiceResponse
-from twilio.rest import Client
-from dotenv import load_dotenv
-import os
-from datetime import datetime
+from settings import load_env, get_settings
+from startup import Lazy, get_readiness
+import re
+import time
+import functools
 
 # Load environment variables
-load_dotenv()
+load_env()
 
-# Verify environment variables are loaded
-print("Environment variables loaded:")
-print(f"TWILIO_ACCOUNT_SID: {'*' * 5 + os.environ.get('TWILIO_ACCOUNT_SID', '')[-5:] if os.environ.get('TWILIO_ACCOUNT_SID') else 'Not found'}")
-print(f"OPENAI_API_KEY: {'*' * 5 + os.environ.get('OPENAI_API_KEY', '')[-5:] if os.environ.get('OPENAI_API_KEY') else 'Not found'}")
-print(f"MONGO_URI: {'*' * 5 + os.environ.get('MONGO_URI', '')[-5:] if os.environ.get('MONGO_URI') else 'Not found'}")
-print(f"BASE_URL: {os.environ.get('BASE_URL', 'Not found')}")
+# Configuration is read once; clients are created on first use and connected by the warm-up below
+settings = get_settings()
 
 app = Flask(__name__)
 
 # Import database after app initialization to avoid circular imports
 from database import Database
-db = Database()
+db = Lazy(Database)
+
+# Shared LLM client with a pooled keep-alive connection
+from llm_client import get_llm_client
+llm = Lazy(get_llm_client)
+
+# Replies come from the primary model, hedged with a faster fallback when it runs past its p95
+from model_router import ModelRouter
+router = ModelRouter(llm)
+
+from call_flow import PROMPT_HISTORY_TURNS, SYSTEM_PROMPT, canned_phrases
+
+# Per-stage turn latency histograms, exported at /metrics
+from metrics import get_metrics
+metrics = get_metrics()
+
+# Approved answers for common questions and objections, served without an LLM call
+response_cache = None
+if settings.response_cache:
+    from response_cache import ResponseCache
+    response_cache = ResponseCache()
+
+# Pre-rendered audio for fixed phrases, served from /audio/<key> so TwiML can <Play> it
+tts = None
+if settings.tts_audio_cache:
+    from audio_cache import AudioCache
+    from tts_service import TextToSpeech
+    tts = TextToSpeech(cache=AudioCache())
+
+def warm_audio_cache():
+    try:
+        phrases = canned_phrases() + (response_cache.phrases() if response_cache else [])
+        rendered = tts.warm(phrases)
+        print(f"TTS audio cache warmed: {rendered} phrases rendered")
+    except Exception as e:
+        print(f"Error warming TTS audio cache: {e}")
+
+# Token-budgeted prompts: cached system prompt, running summary of older turns, recent window
+from context_builder import ContextBuilder, ConversationSummarizer
+summarizer = None
+if settings.conversation_summaries:
+    summarizer = ConversationSummarizer(
+        llm, on_summary=lambda call_sid, summary, summarized: db.save_conversation_summary(call_sid, summary, summarized))
+context = ContextBuilder(SYSTEM_PROMPT, summarizer=summarizer)
+
+# Hot sessions for in-progress calls, so a turn only reads MongoDB on a cache miss
+from session_cache import SessionCache
+sessions = SessionCache(loader=lambda call_sid: db.get_turn_context(call_sid, PROMPT_HISTORY_TURNS))
+
+# Every turn is answered by the shared conversation engine: sessions written through to MongoDB,
+# replies from the model router, and audio from the TTS cache
+from conversation_engine import ConversationEngine, SessionStore, place_call
+engine = ConversationEngine(
+    store=SessionStore(sessions, append=lambda call_sid, messages: db.append_turns(call_sid, messages)),
+    llm=router,
+    context=context,
+    tts=tts,
+    response_cache=response_cache,
+    settings=settings,
+    metrics=metrics
+)
+
+# TwiML already rendered for each call and turn, so a webhook Twilio retries isn't answered twice
+from webhook_dedup import WebhookDeduplicator
+webhooks = WebhookDeduplicator()
+
+def deduplicated(view):
+    """Answer a repeated conversation webhook with the TwiML rendered for the first one"""
+    @functools.wraps(view)
+    def wrapper():
+        call_sid = request.values.get('CallSid')
+        turn = request.args.get('turn')
+        if not call_sid or (turn is None and (request.path != '/handle-call' or request.form.get('SpeechResult'))):
+            # Only the greeting and numbered turns can be told apart from the request that follows them
+            return view()
+        key = (request.path, call_sid, turn, request.args.get('step'))
+        return Response(webhooks.run(key, lambda: view().get_data(as_text=True)), mimetype='text/xml')
+    return wrapper
+
+def create_twilio_client():
+    from twilio.rest import Client
+    return Client(settings.twilio_account_sid, settings.twilio_auth_token)
 
 # Initialize Twilio client
-twilio_client = Client(
-    os.environ.get('TWILIO_ACCOUNT_SID'),
-    os.environ.get('TWILIO_AUTH_TOKEN')
+twilio_client = Lazy(create_twilio_client)
+
+def create_call(phone_number):
+    """Place an outbound call that runs the /handle-call conversation"""
+    return place_call(twilio_client, phone_number, settings)
+
+# Customers due a call, claimed atomically so concurrent jobs and workers never dial the same one
+from campaign import CampaignQueue
+campaign = Lazy(lambda: CampaignQueue(db.customers))
+
+def record_campaign_call(call_sid, customer):
+    # Finish the lease first: a customer whose lease ran out would be dialed again
+    campaign.complete(customer, call_sid)
+    db.record_call_initiated(call_sid, customer['_id'], customer['phone_number'])
+
+# Concurrent, rate-limited dialer for campaign batches
+from dialer import Dialer, TERMINAL_STATUSES
+dialer = Dialer(
+    create_call=create_call,
+    record_call=record_campaign_call,
+    on_failed=lambda customer: campaign.release(customer)
+)
+
+# Outcomes, customer updates and analytics for finished calls, written in batches off the callback path
+from post_call import PostCallPipeline
+post_call = PostCallPipeline(
+    load_calls=lambda call_sids: db.get_calls_for_post_call(call_sids),
+    save=lambda results, increments: db.save_post_call(results, increments),
+    # Customers who asked to be called back are queued for the time they gave
+    on_processed=lambda call: campaign.call_ended(call)
 )
+metrics.gauge('post_call_queue_depth', 'Finished calls waiting for post-call processing',
+              lambda: post_call.queue.depth()[0])
+
+def warm_mongo():
+    db.ping()
+    if settings.mongo_ensure_indexes:
+        db.ensure_indexes()
+
+def warm_twilio():
+    from twilio.base.exceptions import TwilioRestException
+    try:
+        twilio_client.api.v2010.accounts(settings.twilio_account_sid).fetch()
+    except TwilioRestException:
+        # Any API response means the connection is up
+        pass
+
+# Connect Mongo, OpenAI and Twilio before traffic arrives: gunicorn runs this in post_worker_init,
+# `python app.py` at startup, and otherwise the first /ready probe starts it
+readiness = get_readiness()
+readiness.add_check('mongo', warm_mongo)
+readiness.add_check('openai', lambda: llm.warm_up())
+# Only the dialer needs Twilio's REST API, so it doesn't hold readiness back
+readiness.add_check('twilio', warm_twilio, required=False)
+readiness.on_start(lambda: print(f"Settings loaded: {settings.summary()}"))
+# Pick up calls left in the post-call queue by a previous run
+readiness.on_start(post_call.start)
+if tts is not None:
+    # Calls use <Say> until a phrase is rendered, so this runs alongside rather than gating readiness
+    readiness.on_start(warm_audio_cache)
 
 @app.route("/outbound-call", methods=['POST'])
 def outbound_call():
@@ -37,7 +170,7 @@ def outbound_call():
         return {"status": "error", "message": "Phone number is required"}, 400
     
     # Get the base URL from environment variables
-    base_url = os.environ.get('BASE_URL')
+    base_url = settings.base_url
     if not base_url:
         return {"status": "error", "message": "BASE_URL environment variable not set"}, 500
     
@@ -45,29 +178,12 @@ def outbound_call():
     
     # Start the outbound call using Twilio
     try:
-        call = twilio_client.calls.create(
-            url=f"{base_url}/handle-call",
-            to=phone_number,
-            from_=os.environ.get('TWILIO_PHONE_NUMBER'),
-            status_callback=f"{base_url}/call-status",
-            status_callback_event=['initiated', 'ringing', 'answered', 'completed']
-        )
+        call_sid = create_call(phone_number)
         
         # Store call information in database
-        db.calls.update_one(
-            {'call_sid': call.sid},
-            {
-                '$set': {
-                    'customer_id': customer_id,
-                    'phone_number': phone_number,
-                    'status': 'initiated',
-                    'created_at': datetime.now().timestamp()
-                }
-            },
-            upsert=True
-        )
+        db.record_call_initiated(call_sid, customer_id, phone_number)
         
-        return {"status": "success", "call_sid": call.sid}
+        return {"status": "success", "call_sid": call_sid}
     
     except Exception as e:
         print(f"Error making outbound call: {e}")
@@ -81,12 +197,25 @@ def call_status():
     
     print(f"Call status update: {call_sid} - {call_status}")
     
+    # How long Twilio's callback took to reach us
+    metrics.record_callback(call_status, request.form.get('Timestamp'))
+    
     # Update call status in database
     db.update_call_status(call_sid, call_status)
     
+    # Give the dialer its line back and drop the cached session once the call is over
+    dialer.call_finished(call_sid, call_status)
+    if call_status in TERMINAL_STATUSES:
+        engine.end_call(call_sid)
+    
+    # Outcome, customer and analytics writes happen in the background
+    if call_status == 'completed':
+        post_call.enqueue(call_sid)
+    
     return Response(status=200)
 
 @app.route("/handle-call", methods=['POST'])
+@deduplicated
 def handle_call():
     """Handle the actual call conversation"""
     call_sid = request.form.get('CallSid')
@@ -95,110 +224,126 @@ def handle_call():
     print(f"Handling call: {call_sid}")
     print(f"Customer input: {customer_input}")
     
-    # Create TwiML response
-    response = VoiceResponse()
-    
-    # If this is the first interaction (no customer input yet)
-    if not customer_input:
-        # Initial greeting
-        greeting = "Hello! This is Call Worklog AI. I'm calling to introduce you to our product that automatically generates work logs based on your activities. Would you be interested in learning more about how it can save you time?"
-        response.say(greeting)
-        
-        # Listen for customer response
-        gather = response.gather(
-            input='speech',
-            action='/handle-call',
-            method='POST',
-            speechTimeout='auto',
-            timeout=5
-        )
-    else:
-        # Process customer input using OpenAI
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-        
-        # Get conversation context
-        call_data = db.get_call_data(call_sid)
-        conversation_history = call_data.get('conversation_history', [])
-        
-        # Add customer input to history
-        conversation_history.append({"role": "user", "content": customer_input})
-        
-        # Generate AI response
-        chat_completion = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are an AI sales agent for Call Worklog AI, a tool that automatically generates work logs based on user activities. Your goal is to introduce the product, explain its benefits, answer any questions, and try to make a sale. Be friendly, professional, and concise. Don't be pushy but guide the conversation towards a sale."},
-                *conversation_history
-            ],
-            max_tokens=150
-        )
-        
-        ai_response = chat_completion.choices[0].message.content
-        
-        # Add AI response to history
-        conversation_history.append({"role": "assistant", "content": ai_response})
-        
-        # Update conversation history in database
-        db.update_conversation_history(call_sid, conversation_history)
-        
-        # Check if we should end the call
-        should_end = "goodbye" in ai_response.lower() or "thank you for your time" in ai_response.lower()
-        
-        # Speak the AI response
-        response.say(ai_response)
-        
-        if should_end:
-            # End the call
-            response.hangup()
-        else:
-            # Continue listening for customer input
-            gather = response.gather(
-                input='speech',
-                action='/handle-call',
-                method='POST',
-                speechTimeout='auto',
-                timeout=5
-            )
-    
-    return Response(str(response), mimetype='text/xml')
+    # Without customer input this is the greeting, otherwise a reply to what they said
+    twiml = engine.handle_turn(call_sid, customer_input, request.args.get('turn', type=int))
+    return Response(twiml, mimetype='text/xml')
+
+@app.route("/handle-call-continue", methods=['POST'])
+@deduplicated
+def handle_call_continue():
+    """Speak the next sentences of a streaming reply, or a reply that came after a filler phrase"""
+    twiml = engine.handle_continue(request.form.get('CallSid'), request.args.get('turn', type=int),
+                                   request.args.get('step', type=int))
+    return Response(twiml, mimetype='text/xml')
 
 @app.route("/initiate-calls", methods=['POST'])
 def initiate_calls():
-    """Initiate calls to a batch of customers"""
-    customers = db.get_customers_to_call()
-    
-    calls_initiated = 0
-    for customer in customers:
-        try:
-            # Make outbound call
-            call = twilio_client.calls.create(
-                url=f"{os.environ.get('BASE_URL')}/handle-call",
-                to=customer['phone_number'],
-                from_=os.environ.get('TWILIO_PHONE_NUMBER'),
-                status_callback=f"{os.environ.get('BASE_URL')}/call-status",
-                status_callback_event=['initiated', 'ringing', 'answered', 'completed']
-            )
-            
-            calls_initiated += 1
-            
-            # Store call information in database
-            db.calls.update_one(
-                {'call_sid': call.sid},
-                {
-                    '$set': {
-                        'customer_id': customer['_id'],
-                        'phone_number': customer['phone_number'],
-                        'status': 'initiated',
-                        'created_at': datetime.now().timestamp()
-                    }
-                },
-                upsert=True
-            )
-        except Exception as e:
-            print(f"Error initiating call to {customer['phone_number']}: {e}")
-    
-    return {"status": "success", "calls_initiated": calls_initiated}
+    """Start a background dialer job for up to `limit` due customers"""
+    limit = int(request.form.get('limit', 10))
+    
+    # Customers are claimed a batch at a time as the dialer frees up lines, so limit can span a whole campaign
+    job = dialer.start(campaign.stream(limit), total=limit)
+    
+    return {"status": "accepted", "job_id": job.id, "calls_queued": job.total}, 202
+
+@app.route("/dialer-jobs/<job_id>", methods=['GET'])
+def dialer_job_status(job_id):
+    """Progress of a dialer job started by /initiate-calls"""
+    job = dialer.get_job(job_id)
+    if job is None:
+        return {"status": "error", "message": "Unknown job id"}, 404
+    
+    return job.to_dict()
+
+@app.route("/campaign", methods=['GET'])
+def campaign_stats():
+    """Campaign queue claims, lease conflicts and the timezones inside their calling window"""
+    return campaign.snapshot()
+
+@app.route("/post-call", methods=['GET'])
+def post_call_stats():
+    """Post-call queue depth, processing lag and batch sizes"""
+    return post_call.snapshot()
+
+@app.route("/analytics", methods=['GET'])
+def analytics():
+    """Call outcomes, interest levels and objections, all time and for one UTC day (?day=YYYY-MM-DD)"""
+    day = request.args.get('day') or time.strftime('%Y-%m-%d', time.gmtime())
+    return {"all": db.get_analytics('all'), "day": day, "day_counts": db.get_analytics(f"day:{day}")}
+
+@app.route("/call-history/<phone_number>", methods=['GET'])
+def call_history(phone_number):
+    """A customer's most recent processed calls, newest first (?limit=N, default 20)"""
+    limit = int(request.args.get('limit', 20))
+    return {"phone_number": phone_number, "calls": db.history.for_customer(phone_number, limit)}
+
+@app.route("/webhook-dedup", methods=['GET'])
+def webhook_dedup_stats():
+    """Conversation webhooks answered from the TwiML of an earlier, identical request"""
+    return webhooks.snapshot()
+
+@app.route("/model-router", methods=['GET'])
+def model_router_stats():
+    """Per-model time to first token, hedged requests, wins and cancellations"""
+    return engine.llm.snapshot()
+
+@app.route("/llm-metrics", methods=['GET'])
+def llm_metrics():
+    """Per-turn LLM latency metrics"""
+    return llm.metrics.snapshot()
+
+@app.route("/session-cache", methods=['GET'])
+def session_cache_stats():
+    """Session cache size and hit ratio"""
+    return sessions.snapshot()
+
+@app.route("/audio/<key>", methods=['GET'])
+def cached_audio(key):
+    """Serve pre-rendered audio for <Play>"""
+    if tts is None or not re.fullmatch(r'[0-9a-f]{32}', key):
+        return Response(status=404)
+    
+    # The lookup was already counted when the TwiML was built
+    audio_data = tts.cache.get(key, record=False)
+    if audio_data is None:
+        return Response(status=404)
+    
+    # Content-addressed, so the clip for a key never changes
+    return Response(audio_data, mimetype='audio/mpeg', headers={'Cache-Control': 'public, max-age=86400'})
+
+@app.route("/tts-cache", methods=['GET'])
+def tts_cache_stats():
+    """TTS audio cache hit ratio and synthesis time saved"""
+    if tts is None:
+        return {"enabled": False}
+    
+    return {"enabled": True, **tts.cache.snapshot()}
+
+@app.route("/metrics", methods=['GET'])
+def prometheus_metrics():
+    """Per-stage turn latency and Twilio callback lag in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/turn-metrics", methods=['GET'])
+def turn_metrics():
+    """Per-stage p50/p95 and the most recent turns, tagged by call_sid and turn index"""
+    return metrics.snapshot()
+
+@app.route("/response-cache", methods=['GET'])
+def response_cache_stats():
+    """Response cache hit rate, thresholds and LLM time saved"""
+    if response_cache is None:
+        return {"enabled": False}
+    
+    return {"enabled": True, **response_cache.snapshot()}
+
+@app.route("/ready", methods=['GET'])
+def ready():
+    """Readiness probe: 200 once MongoDB and OpenAI are connected, 503 until then"""
+    readiness.start()
+    status = readiness.snapshot()
+    
+    return status, 200 if status['ready'] else 503
 
 @app.route("/", methods=['GET'])
 def index():
@@ -206,6 +351,8 @@ def index():
     return "AI Calling Agent is running!"
 
 if __name__ == "__main__":
+    # Warm up in the background while the server starts
+    readiness.start()
+    
     # Run the Flask app
-    port = int(os.environ.get("PORT", 5000))
-    app.run(debug=True, host='0.0.0.0', port=port)
+    app.run(debug=True, host='0.0.0.0', port=settings.port)
@@ -0,0 +1,315 @@
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route, WebSocketRoute
+from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from settings import load_env, get_settings
+import re
+import asyncio
+
+from async_database import AsyncDatabase
+from llm_client import AsyncLLMClient, get_llm_client
+from call_flow import PROMPT_HISTORY_TURNS, SYSTEM_PROMPT, canned_phrases, stream_twiml
+from campaign import CampaignQueue
+from context_builder import ContextBuilder, ConversationSummarizer
+from conversation_engine import AsyncConversationEngine, AsyncTurnStore, dial_params
+from dialer import TERMINAL_STATUSES
+from metrics import get_metrics
+from model_router import AsyncModelRouter
+from webhook_dedup import AsyncWebhookDeduplicator
+from startup import Lazy, get_readiness
+from database import Database
+from post_call import PostCallPipeline
+from media_stream import EdgeTTSStage, LLMReplyStage, MediaPipeline, WhisperASR
+from tts_service import TextToSpeech
+
+# Load environment variables
+load_env()
+settings = get_settings()
+
+# Async serving mode: every handler awaits Mongo, OpenAI and Twilio instead of blocking a worker,
+# so a single process can keep hundreds of calls mid-turn. Run with:
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+# Clients are created on startup so they bind to the server's event loop
+db = None
+llm = None
+twilio_client = None
+engine = None
+media_pipeline = None
+server_loop = None
+
+# Post-call workers and the summarizer are threads, so they use the blocking clients rather than the server's loop
+blocking_db = Lazy(lambda: Database(write_behind=False))
+
+# Token-budgeted prompts with a byte-identical system prefix, and a running summary of the turns
+# that fall out of the window, stored with how far it reaches as in the Flask app
+summarizer = None
+if settings.conversation_summaries:
+    summarizer = ConversationSummarizer(
+        Lazy(get_llm_client),
+        on_summary=lambda call_sid, summary, summarized: blocking_db.save_conversation_summary(call_sid, summary, summarized))
+context = ContextBuilder(SYSTEM_PROMPT, summarizer=summarizer)
+
+# Per-stage turn latency histograms, exported at /metrics
+metrics = get_metrics()
+
+# The same turn optimizations as the Flask app: approved answers served without an LLM call,
+# pre-rendered audio served from /audio/<key>, and retried webhooks answered from their first TwiML
+response_cache = None
+if settings.response_cache:
+    from response_cache import ResponseCache
+    response_cache = ResponseCache()
+
+tts = None
+if settings.tts_audio_cache:
+    from audio_cache import AudioCache
+    tts = TextToSpeech(cache=AudioCache())
+
+webhooks = AsyncWebhookDeduplicator()
+
+# Outcomes, customer updates and analytics for finished calls, written in batches off the callback path
+campaign = Lazy(lambda: CampaignQueue(blocking_db.customers))
+post_call = PostCallPipeline(
+    load_calls=lambda call_sids: blocking_db.get_calls_for_post_call(call_sids),
+    save=lambda results, increments: blocking_db.save_post_call(results, increments),
+    # Customers who asked to be called back are queued for the time they gave
+    on_processed=lambda call: campaign.call_ended(call)
+)
+
+# With media streams, calls are answered over a websocket instead of <Gather>/<Say> webhooks
+MEDIA_STREAMS_ENABLED = settings.media_streams
+
+async def warm_mongo():
+    await db.ping()
+    if settings.mongo_ensure_indexes:
+        await db.ensure_indexes()
+
+def on_server_loop(warm):
+    """A warm-up check that runs an async step on the server's event loop, where the clients live"""
+    return lambda: asyncio.run_coroutine_threadsafe(warm(), server_loop).result()
+
+# Mongo and OpenAI are connected in the background after startup; /ready reports 503 until they are
+readiness = get_readiness()
+readiness.add_check('mongo', on_server_loop(warm_mongo))
+readiness.add_check('openai', on_server_loop(lambda: llm.warm_up()))
+
+def warm_audio_cache():
+    try:
+        phrases = canned_phrases() + (response_cache.phrases() if response_cache else [])
+        rendered = tts.warm(phrases)
+        print(f"TTS audio cache warmed: {rendered} phrases rendered")
+    except Exception as e:
+        print(f"Error warming TTS audio cache: {e}")
+
+if tts is not None:
+    # Calls use <Say> until a phrase is rendered, so this runs alongside rather than gating readiness
+    readiness.on_start(warm_audio_cache)
+
+async def startup():
+    """Create the async Mongo, OpenAI and Twilio clients and start warming them up"""
+    global db, llm, twilio_client, engine, media_pipeline, server_loop
+    if db is None:
+        db = AsyncDatabase()
+    if llm is None:
+        llm = AsyncLLMClient()
+    if twilio_client is None:
+        twilio_client = Client(
+            settings.twilio_account_sid,
+            settings.twilio_auth_token,
+            http_client=AsyncTwilioHttpClient()
+        )
+    if engine is None:
+        # Replies from the primary model, hedged with a faster fallback and cut off at the turn deadline
+        engine = AsyncConversationEngine(AsyncTurnStore(db, PROMPT_HISTORY_TURNS), AsyncModelRouter(llm), context,
+                                         tts=tts, response_cache=response_cache, settings=settings, metrics=metrics)
+    if media_pipeline is None:
+        media_pipeline = MediaPipeline(
+            asr=WhisperASR(llm),
+            llm=LLMReplyStage(llm, context),
+            tts=EdgeTTSStage(TextToSpeech()),
+            on_turn=db.append_turns
+        )
+    server_loop = asyncio.get_running_loop()
+    readiness.start()
+    # Pick up calls left in the post-call queue by a previous run
+    post_call.start()
+
+async def shutdown():
+    """Close connection pools"""
+    if llm is not None:
+        await llm.close()
+    if db is not None:
+        db.close()
+
+async def outbound_call(request):
+    """Handle outbound call initiation"""
+    form = await request.form()
+    phone_number = form.get('phone_number')
+    customer_id = form.get('customer_id', None)
+    
+    if not phone_number:
+        return JSONResponse({"status": "error", "message": "Phone number is required"}, status_code=400)
+    
+    base_url = settings.base_url
+    if not base_url:
+        return JSONResponse({"status": "error", "message": "BASE_URL environment variable not set"}, status_code=500)
+    
+    try:
+        call = await twilio_client.calls.create_async(**dial_params(phone_number, settings))
+        
+        # Store call information in database
+        await db.record_call_initiated(call.sid, customer_id, phone_number)
+        
+        return JSONResponse({"status": "success", "call_sid": call.sid})
+    
+    except Exception as e:
+        print(f"Error making outbound call: {e}")
+        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
+
+async def call_status(request):
+    """Handle call status callbacks from Twilio"""
+    form = await request.form()
+    call_sid = form.get('CallSid')
+    call_status = form.get('CallStatus')
+    
+    print(f"Call status update: {call_sid} - {call_status}")
+    
+    # How long Twilio's callback took to reach us
+    metrics.record_callback(call_status, form.get('Timestamp'))
+    
+    await db.update_call_status(call_sid, call_status)
+    if call_status in TERMINAL_STATUSES:
+        engine.end_call(call_sid)
+    
+    # Outcome, customer and analytics writes happen in the background
+    if call_status == 'completed':
+        await asyncio.to_thread(post_call.enqueue, call_sid)
+    
+    return Response(status_code=200)
+
+async def deduplicated(request, form, render):
+    """Answer a repeated conversation webhook with the TwiML rendered for the first one"""
+    call_sid = form.get('CallSid')
+    turn = request.query_params.get('turn')
+    if not call_sid or (turn is None and (request.url.path != '/handle-call' or form.get('SpeechResult'))):
+        # Only the greeting and numbered turns can be told apart from the request that follows them
+        twiml = await render()
+    else:
+        key = (request.url.path, call_sid, turn, request.query_params.get('step'))
+        twiml = await webhooks.run(key, render)
+    return Response(twiml, media_type='text/xml')
+
+def query_int(request, name):
+    value = request.query_params.get(name)
+    return int(value) if value else None
+
+async def handle_call(request):
+    """Handle the actual call conversation"""
+    form = await request.form()
+    call_sid = form.get('CallSid')
+    customer_input = form.get('SpeechResult', '')
+    
+    print(f"Handling call: {call_sid}")
+    print(f"Customer input: {customer_input}")
+    
+    if not customer_input and MEDIA_STREAMS_ENABLED:
+        # Hand the rest of the call to the /media-stream websocket
+        stream_url = (settings.base_url or '').replace('https://', 'wss://').replace('http://', 'ws://')
+        return Response(stream_twiml(f"{stream_url}/media-stream"), media_type='text/xml')
+    
+    # Without customer input this is the greeting, otherwise a reply to what they said
+    return await deduplicated(request, form,
+                              lambda: engine.handle_turn(call_sid, customer_input, query_int(request, 'turn')))
+
+async def handle_call_continue(request):
+    """Speak a reply that came after a filler phrase"""
+    form = await request.form()
+    return await deduplicated(request, form, lambda: engine.handle_continue(
+        form.get('CallSid'), query_int(request, 'turn'), query_int(request, 'step')))
+
+async def media_stream(websocket):
+    """Bidirectional Twilio Media Streams audio for one call"""
+    await media_pipeline.handle(websocket)
+
+async def media_stream_stats(request):
+    """Media stream turns, barge-ins and response latency"""
+    return JSONResponse(media_pipeline.snapshot())
+
+async def post_call_stats(request):
+    """Post-call queue depth, processing lag and batch sizes"""
+    return JSONResponse(await asyncio.to_thread(post_call.snapshot))
+
+async def webhook_dedup_stats(request):
+    """Conversation webhooks answered from the TwiML of an earlier, identical request"""
+    return JSONResponse(webhooks.snapshot())
+
+async def model_router_stats(request):
+    """Per-model time to first token, hedged requests, wins and cancellations"""
+    return JSONResponse(engine.llm.snapshot())
+
+async def cached_audio(request):
+    """Serve pre-rendered audio for <Play>"""
+    key = request.path_params['key']
+    if tts is None or not re.fullmatch(r'[0-9a-f]{32}', key):
+        return Response(status_code=404)
+    audio_data = await asyncio.to_thread(tts.cache.get, key, record=False)
+    if audio_data is None:
+        return Response(status_code=404)
+    return Response(audio_data, media_type='audio/mpeg', headers={'Cache-Control': 'public, max-age=86400'})
+
+async def tts_cache_stats(request):
+    """TTS audio cache hit ratio and synthesis time saved"""
+    if tts is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **tts.cache.snapshot()})
+
+async def response_cache_stats(request):
+    """Response cache hit rate and LLM time saved"""
+    if response_cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **response_cache.snapshot()})
+
+async def llm_metrics(request):
+    """Per-turn LLM latency metrics"""
+    return JSONResponse(llm.metrics.snapshot())
+
+async def prometheus_metrics(request):
+    """Per-stage turn latency and Twilio callback lag in Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+async def ready(request):
+    """Readiness probe: 200 once MongoDB and OpenAI are connected, 503 until then"""
+    status = readiness.snapshot()
+    return JSONResponse(status, status_code=200 if status['ready'] else 503)
+
+async def index(request):
+    """Simple index route to verify the server is running"""
+    return PlainTextResponse("AI Calling Agent is running (async)!")
+
+app = Starlette(
+    routes=[
+        Route("/outbound-call", outbound_call, methods=['POST']),
+        Route("/call-status", call_status, methods=['POST']),
+        Route("/handle-call", handle_call, methods=['POST']),
+        Route("/handle-call-continue", handle_call_continue, methods=['POST']),
+        Route("/audio/{key}", cached_audio, methods=['GET']),
+        WebSocketRoute("/media-stream", media_stream),
+        Route("/media-stream-stats", media_stream_stats, methods=['GET']),
+        Route("/post-call", post_call_stats, methods=['GET']),
+        Route("/webhook-dedup", webhook_dedup_stats, methods=['GET']),
+        Route("/model-router", model_router_stats, methods=['GET']),
+        Route("/tts-cache", tts_cache_stats, methods=['GET']),
+        Route("/response-cache", response_cache_stats, methods=['GET']),
+        Route("/llm-metrics", llm_metrics, methods=['GET']),
+        Route("/metrics", prometheus_metrics, methods=['GET']),
+        Route("/ready", ready, methods=['GET']),
+        Route("/", index, methods=['GET']),
+    ],
+    on_startup=[startup],
+    on_shutdown=[shutdown]
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=settings.port)
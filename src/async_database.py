@@ -0,0 +1,100 @@
+import os
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+from settings import load_env
+
+from database import Database, call_update, turn_context, turn_context_projection
+
+# Load environment variables
+load_env()
+
+class AsyncDatabase:
+    def __init__(self):
+        """Initialize an asyncio database connection"""
+        mongo_uri = os.environ.get('MONGO_URI')
+        if not mongo_uri:
+            raise ValueError("MongoDB URI not found in environment variables")
+            
+        print(f"Connecting to MongoDB (async) at: {mongo_uri[:10]}...")
+        self.client = AsyncIOMotorClient(
+            mongo_uri,
+            maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+            minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+        )
+        self.db = self.client[os.environ.get('MONGO_DB_NAME', 'calling_agent_db')]
+        self.customers = self.db['customers']
+        self.calls = self.db['calls']
+    
+    async def ping(self):
+        """Select a server and open a pooled connection, e.g. while warming up"""
+        await self.client.admin.command('ping')
+    
+    async def ensure_indexes(self):
+        """Create any index declared in Database.INDEXES that is missing"""
+        for collection_name, indexes in Database.INDEXES.items():
+            collection = self.db[collection_name]
+            existing = await collection.index_information()
+            for name, keys, options in indexes:
+                if name in existing:
+                    continue
+                try:
+                    await collection.create_index(keys, name=name, **options)
+                    print(f"Created index {collection_name}.{name}")
+                except OperationFailure as e:
+                    print(f"Error creating index {collection_name}.{name}: {e}")
+    
+    async def record_call_initiated(self, call_sid, customer_id, phone_number):
+        """Store a newly dialed call"""
+        await self.calls.update_one(
+            {'call_sid': call_sid},
+            call_update({
+                'customer_id': customer_id,
+                'phone_number': phone_number,
+                'status': 'initiated',
+                'created_at': datetime.now().timestamp()
+            }),
+            upsert=True
+        )
+    
+    async def update_call_status(self, call_sid, status):
+        """Update call status in the database; a status never replaces a later one"""
+        await self.calls.update_one(
+            {'call_sid': call_sid},
+            call_update({
+                'status': status,
+                'updated_at': datetime.now().timestamp()
+            }),
+            upsert=True
+        )
+    
+    async def get_call_data(self, call_sid):
+        """Get call data from the database"""
+        call_data = await self.calls.find_one({'call_sid': call_sid})
+        if not call_data:
+            return {
+                'call_sid': call_sid,
+                'conversation_history': []
+            }
+        return call_data
+    
+    async def get_turn_context(self, call_sid, max_turns):
+        """Fetch the recent turns, running summary and turn count needed to rebuild a call's prompt"""
+        call_data = await self.calls.find_one({'call_sid': call_sid}, turn_context_projection(max_turns))
+        return turn_context(call_sid, call_data or {})
+    
+    async def append_turns(self, call_sid, messages):
+        """Atomically append messages to a call's history without rewriting the array"""
+        await self.calls.update_one(
+            {'call_sid': call_sid},
+            {
+                '$push': {'conversation_history': {'$each': messages}},
+                '$inc': {'message_count': len(messages)},
+                '$set': {'updated_at': datetime.now().timestamp()}
+            },
+            upsert=True
+        )
+    
+    def close(self):
+        """Close the connection pool"""
+        self.client.close()
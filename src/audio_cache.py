@@ -0,0 +1,152 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def audio_key(voice, text, audio_format):
+    """Content address of a rendered phrase"""
+    return hashlib.sha256(f"{voice}\0{audio_format}\0{text}".encode()).hexdigest()[:32]
+
+
+class AudioCache:
+    def __init__(self, cache_dir=None, max_memory_bytes=None, max_disk_bytes=None):
+        """Two-tier cache of synthesized audio keyed by audio_key()
+
+        Recently used clips stay in an in-memory LRU bounded by max_memory_bytes; every
+        clip is also written to cache_dir, which is trimmed oldest-first past max_disk_bytes
+        so rendered phrases survive restarts and are shared by workers on the same host.
+        """
+        self.cache_dir = cache_dir or os.environ.get('TTS_CACHE_DIR', '/tmp/tts_cache')
+        self.max_memory_bytes = max_memory_bytes or int(float(os.environ.get('TTS_CACHE_MEMORY_MB', 64)) * 1024 * 1024)
+        self.max_disk_bytes = max_disk_bytes or int(float(os.environ.get('TTS_CACHE_DISK_MB', 512)) * 1024 * 1024)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+        # Synthesis time of each clip rendered by this process, to report the time hits saved
+        self._synth_seconds = {}
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'synthesized': 0,
+                      'synthesis_seconds': 0.0, 'seconds_saved': 0.0}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def get(self, key, record=True):
+        """Return the cached audio bytes, or None on a miss"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if record:
+                    self._record_hit(key, 'memory_hits')
+                return data
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            if record:
+                with self._lock:
+                    self.stats['misses'] += 1
+            return None
+
+        # Refresh the file's mtime so disk trimming evicts least recently used clips first
+        os.utime(self._path(key))
+        with self._lock:
+            if record:
+                self._record_hit(key, 'disk_hits')
+            self._remember(key, data)
+        return data
+
+    def contains(self, key, record=False):
+        """Check for a clip without reading it, optionally counting the lookup as a hit or miss"""
+        with self._lock:
+            if key in self._memory:
+                if record:
+                    self._record_hit(key, 'memory_hits')
+                return True
+        found = os.path.exists(self._path(key))
+        if record:
+            with self._lock:
+                if found:
+                    self._record_hit(key, 'disk_hits')
+                else:
+                    self.stats['misses'] += 1
+        return found
+
+    def put(self, key, data, synth_seconds=None):
+        """Store a freshly synthesized clip in both tiers"""
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        # Atomic rename so concurrent readers never see a partial file
+        replaced = os.path.exists(path)
+        old_size = os.path.getsize(path) if replaced else 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_bytes += len(data) - old_size
+            self._remember(key, data)
+            if synth_seconds is not None:
+                self._synth_seconds[key] = synth_seconds
+                self.stats['synthesized'] += 1
+                self.stats['synthesis_seconds'] += synth_seconds
+            trim = self._disk_bytes > self.max_disk_bytes
+
+        if trim:
+            self._trim_disk(keep=path)
+
+    def _record_hit(self, key, tier):
+        self.stats[tier] += 1
+        self.stats['seconds_saved'] += self._synth_seconds.get(key, self._average_synth_seconds())
+
+    def _average_synth_seconds(self):
+        if not self.stats['synthesized']:
+            return 0.0
+        return self.stats['synthesis_seconds'] / self.stats['synthesized']
+
+    def _remember(self, key, data):
+        # Caller holds the lock
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _trim_disk(self, keep=None):
+        """Delete the least recently used files until the disk tier fits its budget"""
+        entries = sorted(
+            (entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.path != keep),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries:
+            with self._lock:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    return
+            size = entry.stat().st_size
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                self._disk_bytes -= size
+
+    def snapshot(self):
+        """Tier sizes, hit ratio and synthesis time saved"""
+        with self._lock:
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            lookups = hits + self.stats['misses']
+            return {
+                'memory_items': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_bytes': self._disk_bytes,
+                'hit_ratio': round(hits / lookups, 3) if lookups else 0.0,
+                **{name: round(value, 3) if isinstance(value, float) else value for name, value in self.stats.items()}
+            }
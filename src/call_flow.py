@@ -0,0 +1,140 @@
+import os
+import json
+from urllib.parse import urlencode
+from twilio.twiml.voice_response import Connect, VoiceResponse
+
+# Shared script and TwiML helpers for the sync (Flask) and async (ASGI) webhook servers
+
+GREETING = "Hello! This is Call Worklog AI. I'm calling to introduce you to our product that automatically generates work logs based on your activities. Would you be interested in learning more about how it can save you time?"
+
+# Product information for the AI to use
+PRODUCT_INFO = {
+    "name": "Call Worklog AI",
+    "description": "An AI tool that automatically generates work logs based on your activities",
+    "benefits": [
+        "Save time by automating work log creation",
+        "Ensure accurate documentation of work activities",
+        "Improve productivity by focusing on work instead of reporting",
+        "Easy integration with existing workflow systems"
+    ],
+    "pricing": {
+        "basic": "$9.99/month",
+        "pro": "$19.99/month",
+        "enterprise": "Custom pricing"
+    }
+}
+
+# Serialized once so the prompt prefix is byte-identical on every turn of every entry point
+SYSTEM_PROMPT = (
+    "You are an AI sales agent for Call Worklog AI, a tool that automatically generates work logs based on user activities. "
+    "Your goal is to introduce the product, explain its benefits, answer any questions, and try to make a sale. "
+    "Be friendly, professional, and concise. Don't be pushy but guide the conversation towards a sale.\n"
+    f"Product information: {json.dumps(PRODUCT_INFO)}\n"
+    "If the customer shows interest, ask if they'd like to sign up for a free trial. "
+    "If the customer declines or wants to end the call, be polite and end the conversation. "
+    "If the customer asks a question you can't answer, offer to have a product specialist contact them."
+)
+
+FALLBACK_REPLY = "Sorry, I didn't catch that. Could you say that again?"
+
+# Spoken while a slow reply is still being generated, so the caller doesn't sit in silence
+FILLER_PHRASES = [
+    "One moment, let me check that for you.",
+    "Good question, give me just a second.",
+    "Let me think about that for a moment.",
+]
+
+# Fixed lines spoken on many calls, pre-rendered into the TTS audio cache at startup
+CANNED_PHRASES = [GREETING, FALLBACK_REPLY] + FILLER_PHRASES
+
+STATUS_CALLBACK_EVENTS = ['initiated', 'ringing', 'answered', 'completed']
+
+# Twilio's own endpointing for <Gather>; media streams use vad.Endpointer instead
+GATHER_SPEECH_TIMEOUT = os.environ.get('GATHER_SPEECH_TIMEOUT', 'auto')
+GATHER_TIMEOUT = int(os.environ.get('GATHER_TIMEOUT', 5))
+
+# How many recent exchanges are sent to the LLM each turn
+PROMPT_HISTORY_TURNS = int(os.environ.get('PROMPT_HISTORY_TURNS', 10))
+
+# Put the call_sid on webhook URLs so a load balancer can hash every turn of a call to one worker
+SESSION_AFFINITY = os.environ.get('SESSION_AFFINITY', 'false').lower() == 'true'
+
+
+def canned_phrases(phrases_file=None):
+    """The built-in canned phrases plus any listed one per line in TTS_WARM_PHRASES_FILE"""
+    phrases = list(CANNED_PHRASES)
+    phrases_file = phrases_file or os.environ.get('TTS_WARM_PHRASES_FILE')
+    if phrases_file:
+        with open(phrases_file) as f:
+            phrases += [line.strip() for line in f if line.strip()]
+    return phrases
+
+
+def filler_phrase(turn=None):
+    """A filler phrase, varied by turn so a slow call doesn't hear the same one twice in a row"""
+    return FILLER_PHRASES[(turn or 0) % len(FILLER_PHRASES)]
+
+
+def speak(response, text, audio_url=None):
+    """Play pre-rendered audio when there is some, otherwise let Twilio synthesize the text"""
+    if audio_url:
+        response.play(audio_url)
+    else:
+        response.say(text)
+
+
+def webhook_url(path, call_sid=None, **sequence):
+    """Path of a webhook, with the call_sid in the query string when session affinity is on
+
+    sequence (turn=, step=) numbers the request, so a retry of it can be told from the next one.
+    """
+    params = {'CallSid': call_sid} if SESSION_AFFINITY and call_sid else {}
+    params.update((name, value) for name, value in sequence.items() if value is not None)
+    if params:
+        return f"{path}?{urlencode(params)}"
+    return path
+
+
+def gather_speech(response, call_sid=None, turn=None):
+    """Listen for the customer's next utterance, which will be turn `turn` of the call"""
+    response.gather(
+        input='speech',
+        action=webhook_url('/handle-call', call_sid, turn=turn),
+        method='POST',
+        speechTimeout=GATHER_SPEECH_TIMEOUT,
+        timeout=GATHER_TIMEOUT
+    )
+
+
+def should_end_call(ai_response):
+    """Check if the AI is wrapping up the call"""
+    return "goodbye" in ai_response.lower() or "thank you for your time" in ai_response.lower()
+
+
+def greeting_twiml(audio_url=None, call_sid=None):
+    """TwiML for the first turn of a call"""
+    response = VoiceResponse()
+    speak(response, GREETING, audio_url)
+    gather_speech(response, call_sid, turn=1)
+    return str(response)
+
+
+def reply_twiml(ai_response, audio_url=None, call_sid=None, turn=None):
+    """TwiML that speaks the AI reply to turn `turn` and then listens or hangs up"""
+    response = VoiceResponse()
+    speak(response, ai_response, audio_url)
+    if should_end_call(ai_response):
+        response.hangup()
+    else:
+        gather_speech(response, call_sid, turn=turn + 1 if turn else None)
+    return str(response)
+
+
+def stream_twiml(stream_url):
+    """TwiML that greets the caller, then hands the call audio to a Media Streams websocket"""
+    response = VoiceResponse()
+    response.say(GREETING)
+    connect = Connect()
+    connect.stream(url=stream_url)
+    response.append(connect)
+    return str(response)
@@ -0,0 +1,135 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from pymongo import DESCENDING, UpdateOne
+from settings import load_env
+
+# Load environment variables
+load_env()
+
+# What a customer document keeps of each recent call; the full entry lives in call_history
+SUMMARY_FIELDS = ('call_sid', 'timestamp', 'outcome')
+
+
+def history_month(timestamp):
+    """The UTC month a call's history bucket belongs to, as 'YYYY-MM'"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m')
+
+
+class CallHistory:
+    def __init__(self, history, summary_size=None, bucket_size=None, retention_days=None):
+        """Per-customer call history in time-bucketed documents of their own
+
+        Each bucket holds up to bucket_size calls to one phone number in one month, so a customer
+        who is dialed again and again adds buckets instead of growing their customer document.
+        The customer keeps only call_count and their last summary_size outcomes. The raw calls
+        documents, with their transcripts, expire retention_days after processing (0 keeps them).
+        """
+        self.history = history
+        self.summary_size = summary_size or int(os.environ.get('CALL_HISTORY_SUMMARY_SIZE', 5))
+        self.bucket_size = bucket_size or int(os.environ.get('CALL_HISTORY_BUCKET_SIZE', 50))
+        self.retention_days = (retention_days if retention_days is not None
+                               else float(os.environ.get('CALL_TRANSCRIPT_RETENTION_DAYS', 90)))
+
+    def entry(self, call):
+        """A processed call as it is kept in history: outcome and extracted responses, no transcript"""
+        return {
+            'call_sid': call['call_sid'],
+            'timestamp': call['completed_at'],
+            'outcome': call['outcome'],
+            'responses': call.get('customer_responses') or {}
+        }
+
+    def customer_update(self, entries):
+        """$set/$push/$inc for a customer's summary: the latest outcome and the last summary_size calls"""
+        return {
+            '$set': {'last_call_outcome': entries[-1]['outcome']},
+            '$push': {'recent_calls': {'$each': [{field: entry[field] for field in SUMMARY_FIELDS} for entry in entries],
+                                       '$slice': -self.summary_size}},
+            '$inc': {'call_count': len(entries)}
+        }
+
+    def bucket_updates(self, phone_number, entries, customer_id=None):
+        """Upserts appending entries to the customer's bucket for their month, starting a new one when it is full"""
+        updates = []
+        for entry in entries:
+            month = history_month(entry['timestamp'])
+            fields = {'phone_number': phone_number, 'month': month}
+            updates.append(UpdateOne(
+                {**fields, 'count': {'$lt': self.bucket_size}},
+                {
+                    '$push': {'calls': entry},
+                    '$inc': {'count': 1},
+                    '$min': {'first_at': entry['timestamp']},
+                    '$max': {'last_at': entry['timestamp']},
+                    '$setOnInsert': {**fields, 'customer_id': customer_id}
+                },
+                upsert=True
+            ))
+        return updates
+
+    def expires_at(self, now=None):
+        """When a processed calls document is deleted by the TTL index, or None to keep it"""
+        if not self.retention_days:
+            return None
+        return (now or datetime.now(timezone.utc)) + timedelta(days=self.retention_days)
+
+    def for_customer(self, phone_number, limit=20):
+        """A customer's most recent calls, newest first"""
+        calls = []
+        month = None
+        cursor = self.history.find({'phone_number': phone_number}, {'month': 1, 'calls': 1}).sort('month', DESCENDING)
+        for bucket in cursor:
+            # A month can span several buckets, so stop only once a whole month has been read
+            if bucket['month'] != month and len(calls) >= limit:
+                break
+            month = bucket['month']
+            calls.extend(bucket['calls'])
+        return sorted(calls, key=lambda entry: entry['timestamp'], reverse=True)[:limit]
+
+    def migrate(self, customers, batch_size=200):
+        """Move call_history arrays embedded in customer documents into buckets
+
+        Run once after upgrading. Customers are read through a cursor a batch at a time; each
+        one's summary is rebuilt from its old history before the array is removed.
+        """
+        migrated = 0
+        cursor = customers.find({'call_history': {'$exists': True}},
+                                {'phone_number': 1, 'call_history': 1})
+        bucket_writes = []
+        customer_writes = []
+        for customer in cursor:
+            entries = sorted((entry for entry in customer['call_history'] if entry.get('timestamp')),
+                             key=lambda entry: entry['timestamp'])
+            if entries and customer.get('phone_number'):
+                bucket_writes += self.bucket_updates(customer['phone_number'], entries, customer['_id'])
+                update = self.customer_update(entries)
+            else:
+                update = {}
+            update['$unset'] = {'call_history': ''}
+            customer_writes.append(UpdateOne({'_id': customer['_id']}, update))
+            if len(customer_writes) >= batch_size:
+                migrated += self._write(customers, bucket_writes, customer_writes)
+                bucket_writes, customer_writes = [], []
+        if customer_writes:
+            migrated += self._write(customers, bucket_writes, customer_writes)
+        return migrated
+
+    def _write(self, customers, bucket_writes, customer_writes):
+        if bucket_writes:
+            self.history.bulk_write(bucket_writes, ordered=False)
+        customers.bulk_write(customer_writes, ordered=False)
+        return len(customer_writes)
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Maintain per-customer call history")
+    parser.add_argument('command', choices=['migrate'], help="Move call_history arrays out of customer documents")
+    parser.parse_args()
+
+    db = Database()
+    migrated = db.history.migrate(db.customers)
+    print(f"Moved the call history of {migrated} customers into buckets")
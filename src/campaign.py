@@ -0,0 +1,348 @@
+import os
+import re
+import time
+import uuid
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from settings import load_env
+
+# Load environment variables
+load_env()
+
+# Customers become eligible again this long after their last call
+RECALL_INTERVAL_SECONDS = 30 * 24 * 60 * 60
+
+# Claim order: highest priority first, then whoever has been due the longest (never-called customers first)
+QUEUE_SORT = [('priority', DESCENDING), ('next_call_at', ASCENDING)]
+
+# What a dialer needs from a claimed customer
+CLAIM_FIELDS = {'phone_number': 1, 'name': 1, 'timezone': 1, 'priority': 1, 'lease_id': 1}
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Times of day a customer might give instead of a clock time
+DAY_PARTS = [('afternoon', 14), ('morning', 10), ('noon', 12), ('lunch', 12), ('evening', 18), ('tonight', 19)]
+
+
+def parse_clock(value):
+    """'HH:MM' as minutes after midnight; '24:00' is the end of the day"""
+    hours, _, minutes = value.strip().partition(':')
+    total = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= total <= 24 * 60:
+        raise ValueError(f"Not a time of day: {value!r}")
+    return total
+
+
+def parse_callback_time(text, now):
+    """When the customer asked to be called back, e.g. "tomorrow at 10am", "in 2 hours" or "friday afternoon"
+
+    now is an aware datetime in the customer's timezone; returns None if text names no time.
+    """
+    text = text.lower()
+
+    match = re.search(r'\bin\s+(an?|\d+)\s+(minute|hour|day|week)s?\b', text)
+    if match:
+        count = 1 if match.group(1) in ('a', 'an') else int(match.group(1))
+        return now + timedelta(**{match.group(2) + 's': count})
+
+    day = None
+    if 'day after tomorrow' in text:
+        day = now.date() + timedelta(days=2)
+    elif 'tomorrow' in text:
+        day = now.date() + timedelta(days=1)
+    elif 'next week' in text:
+        day = now.date() + timedelta(days=7 - now.weekday())
+    elif 'weekend' in text:
+        day = now.date() + timedelta(days=(5 - now.weekday()) % 7 or 7)
+    else:
+        for index, name in enumerate(WEEKDAYS):
+            if re.search(rf'\b{name}\b', text):
+                day = now.date() + timedelta(days=(index - now.weekday()) % 7 or 7)
+                break
+
+    clock = None
+    match = re.search(r'\b(\d{1,2})(?::(\d{2}))?\s*([ap])\.?m\b', text)
+    if match:
+        clock = (int(match.group(1)) % 12 + (12 if match.group(3) == 'p' else 0), int(match.group(2) or 0))
+    else:
+        match = re.search(r'\b(?:at|around|after|by)\s+(\d{1,2})(?::(\d{2}))?\b', text)
+        if match:
+            hour = int(match.group(1))
+            # "at 3" during business hours means the afternoon
+            clock = (hour + 12 if 1 <= hour < 8 else hour, int(match.group(2) or 0))
+        else:
+            clock = next(((hour, 0) for part, hour in DAY_PARTS if part in text), None)
+    if clock is not None and not (clock[0] < 24 and clock[1] < 60):
+        clock = None
+
+    if day is None and clock is None:
+        if 'later' in text:
+            return now + timedelta(hours=2)
+        return None
+    if day is None:
+        day = now.date()
+        if datetime(day.year, day.month, day.day, *clock, tzinfo=now.tzinfo) <= now:
+            day += timedelta(days=1)
+    hour, minute = clock or (10, 0)
+    return datetime(day.year, day.month, day.day, hour, minute, tzinfo=now.tzinfo)
+
+
+class CallingWindow:
+    def __init__(self, start=None, end=None, days=None):
+        """Local hours and weekdays in which a customer may be called"""
+        self.start = parse_clock(start or os.environ.get('CAMPAIGN_WINDOW_START', '09:00'))
+        self.end = parse_clock(end or os.environ.get('CAMPAIGN_WINDOW_END', '20:00'))
+        days = days or os.environ.get('CAMPAIGN_CALL_DAYS', 'mon,tue,wed,thu,fri,sat,sun')
+        self.days = set()
+        for day in filter(None, (day.strip().lower() for day in days.split(','))):
+            names = [index for index, name in enumerate(WEEKDAYS) if name.startswith(day)]
+            if len(names) != 1:
+                raise ValueError(f"Not a weekday: {day!r}")
+            self.days.add(names[0])
+
+    def is_open(self, local):
+        """Whether a local time falls inside the window"""
+        minute = local.hour * 60 + local.minute
+        if self.start <= self.end:
+            return local.weekday() in self.days and self.start <= minute < self.end
+        # An overnight window such as 18:00-01:00: the early hours belong to the previous day's window
+        if minute >= self.start:
+            return local.weekday() in self.days
+        return minute < self.end and (local.weekday() - 1) % 7 in self.days
+
+
+class CampaignQueue:
+    def __init__(self, customers, window=None, default_timezone=None, lease_seconds=None, batch_size=None,
+                 retry_delay=None, owner=None):
+        """Customers due a call, claimed atomically so concurrent dialer jobs and workers never share one
+
+        A claim leases a customer by moving next_call_at past the lease, so customers claimed by a
+        worker that dies come due again by themselves. Customers are only claimed while their own
+        timezone (the timezone field, or the default) is inside the calling window.
+        """
+        self.customers = customers
+        self.window = window or CallingWindow()
+        self.default_timezone = default_timezone or os.environ.get('CAMPAIGN_DEFAULT_TIMEZONE', 'UTC')
+        self.lease_seconds = lease_seconds or float(os.environ.get('CAMPAIGN_LEASE_SECONDS', 600))
+        self.batch_size = batch_size or int(os.environ.get('CAMPAIGN_CLAIM_BATCH', 10))
+        # A customer whose call couldn't be placed is tried again after this long
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.environ.get('CAMPAIGN_RETRY_DELAY', 3600))
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        # How long the list of timezones in use is cached
+        self.timezone_refresh = 60
+
+        self.stats = {'claimed': 0, 'conflicts': 0, 'completed': 0, 'released': 0, 'callbacks': 0}
+        # How many times more candidates than needed a claim reads, widened while claims collide
+        self._spread = 1
+        self._zones = {}
+        self._timezones = None
+        self._timezones_at = 0
+        self._lock = threading.Lock()
+        self.zone(self.default_timezone)
+
+    def zone(self, name):
+        """ZoneInfo for a customer's timezone field; missing or unknown names fall back to the default"""
+        zone = self._zones.get(name)
+        if zone is None:
+            try:
+                zone = ZoneInfo(name or self.default_timezone)
+            except (ZoneInfoNotFoundError, ValueError):
+                if name == self.default_timezone:
+                    raise
+                print(f"Unknown customer timezone {name!r}, using {self.default_timezone}")
+                zone = self.zone(self.default_timezone)
+            self._zones[name] = zone
+        return zone
+
+    def open_timezones(self, now):
+        """Timezone values whose calling window is open at now; None stands for customers without one"""
+        with self._lock:
+            if self._timezones is None or now - self._timezones_at > self.timezone_refresh:
+                # Served from the campaign index, so this stays cheap with millions of customers
+                self._timezones = [name for name in self.customers.distinct('timezone') if name is not None]
+                self._timezones_at = now
+            timezones = self._timezones
+        moment = datetime.fromtimestamp(now, self.zone(None))
+        return [name for name in [None] + timezones if self.window.is_open(moment.astimezone(self.zone(name)))]
+
+    def due_filter(self, now):
+        """Customers whose call is due and whose window is open; a missing next_call_at means never called"""
+        return {'timezone': {'$in': self.open_timezones(now)}, 'next_call_at': {'$not': {'$gt': now}}}
+
+    def _candidates(self, due, now, limit):
+        # Callbacks someone asked for come before the priority order, at the time they gave
+        window = limit * self._spread
+        ids = [doc['_id'] for doc in self.customers.find({**due, 'callback_at': {'$lte': now}}, {'_id': 1})
+               .sort('callback_at', ASCENDING).limit(window)]
+        if len(ids) < window:
+            seen = set(ids)
+            ids += [doc['_id'] for doc in self.customers.find(due, {'_id': 1}).sort(QUEUE_SORT).limit(window - len(ids))
+                    if doc['_id'] not in seen]
+        if len(ids) > limit:
+            # Workers racing for the head of the queue each try a different random pick from near it
+            ids = [ids[index] for index in sorted(random.sample(range(len(ids)), limit))]
+        return ids
+
+    def _lease(self, now, lease_id):
+        return {'next_call_at': now + self.lease_seconds, 'lease_id': lease_id, 'lease_owner': self.owner,
+                'claimed_at': now}
+
+    def claim(self, limit=None):
+        """Lease up to limit due customers: read candidate ids, lease them with one update_many, fetch the ones won
+
+        Candidates another worker leased first are skipped by the update's filter, and a short
+        batch is topped up from the next candidates; every lost race means another worker won, so
+        this only returns empty-handed when nobody is due.
+        """
+        limit = limit or self.batch_size
+        claimed = []
+        while len(claimed) < limit:
+            now = time.time()
+            due = self.due_filter(now)
+            if not due['timezone']['$in']:
+                break
+            ids = self._candidates(due, now, limit - len(claimed))
+            if not ids:
+                break
+            lease_id = uuid.uuid4().hex
+            self.customers.update_many({'_id': {'$in': ids}, 'next_call_at': {'$not': {'$gt': now}}},
+                                       {'$set': self._lease(now, lease_id)})
+            won = {doc['_id']: doc for doc in self.customers.find({'_id': {'$in': ids}, 'lease_id': lease_id},
+                                                                  CLAIM_FIELDS)}
+            claimed += [won[customer_id] for customer_id in ids if customer_id in won]
+            with self._lock:
+                self.stats['claimed'] += len(won)
+                self.stats['conflicts'] += len(ids) - len(won)
+                self._spread = max(1, self._spread - 1) if len(won) == len(ids) else min(16, self._spread * 2)
+            if len(won) == len(ids):
+                break
+        return claimed
+
+    def claim_one(self):
+        """Lease the next due customer with a single find_one_and_update, or return None"""
+        now = time.time()
+        due = self.due_filter(now)
+        if not due['timezone']['$in']:
+            return None
+        lease = {'$set': self._lease(now, uuid.uuid4().hex)}
+        customer = (self.customers.find_one_and_update({**due, 'callback_at': {'$lte': now}}, lease,
+                                                       sort=[('callback_at', ASCENDING)], projection=CLAIM_FIELDS)
+                    or self.customers.find_one_and_update(due, lease, sort=QUEUE_SORT, projection=CLAIM_FIELDS))
+        if customer is not None:
+            with self._lock:
+                self.stats['claimed'] += 1
+        return customer
+
+    def stream(self, limit):
+        """Claim and yield up to limit customers a batch at a time, until nobody is due
+
+        Nothing is read ahead of the consumer, so a campaign over millions of customers holds one
+        batch in memory and a batch's leases start just before it is dialed.
+        """
+        remaining = limit
+        while remaining > 0:
+            batch = self.claim(min(self.batch_size, remaining))
+            if not batch:
+                return
+            yield from batch
+            remaining -= len(batch)
+
+    def complete(self, customer, call_sid=None):
+        """Record that a claimed customer was dialed; they come due again after the recall interval"""
+        now = time.time()
+        result = self.customers.update_one(
+            {'_id': customer['_id'], 'lease_id': customer.get('lease_id')},
+            {
+                '$set': {'last_called': now, 'last_call_sid': call_sid, 'next_call_at': now + RECALL_INTERVAL_SECONDS},
+                '$unset': {'lease_id': '', 'lease_owner': '', 'claimed_at': '', 'callback_at': ''}
+            }
+        )
+        if result.matched_count == 0:
+            print(f"Lease on customer {customer['_id']} expired before the call was recorded")
+        with self._lock:
+            self.stats['completed'] += 1
+
+    def release(self, customer):
+        """Give back a claimed customer whose call couldn't be placed, to be retried after retry_delay"""
+        self.customers.update_one(
+            {'_id': customer['_id'], 'lease_id': customer.get('lease_id')},
+            {
+                '$set': {'next_call_at': time.time() + self.retry_delay},
+                '$unset': {'lease_id': '', 'lease_owner': '', 'claimed_at': ''},
+                '$inc': {'dial_failures': 1}
+            }
+        )
+        with self._lock:
+            self.stats['released'] += 1
+
+    def schedule_callback(self, customer_id, when):
+        """Queue a customer for the time they asked to be called back, ahead of the priority order"""
+        timestamp = when.timestamp()
+        self.customers.update_one({'_id': customer_id},
+                                  {'$set': {'next_call_at': timestamp, 'callback_at': timestamp}})
+        with self._lock:
+            self.stats['callbacks'] += 1
+
+    def call_ended(self, call_data):
+        """Schedule the callback a finished call's extracted responses asked for, if any"""
+        customer_id = call_data.get('customer_id')
+        callback_time = (call_data.get('customer_responses') or {}).get('callback_time')
+        if not customer_id or not isinstance(callback_time, str):
+            return None
+
+        customer = self.customers.find_one({'_id': customer_id}, {'timezone': 1})
+        if customer is None:
+            return None
+        now = datetime.now(self.zone(customer.get('timezone')))
+        when = parse_callback_time(callback_time, now)
+        if when is None:
+            print(f"Couldn't read a time from callback request {callback_time!r} for customer {customer_id}")
+            return None
+
+        self.schedule_callback(customer_id, when)
+        print(f"Callback for customer {customer_id} scheduled at {when.isoformat()}")
+        return when
+
+    def backfill(self, batch_size=1000):
+        """Give customers called before the queue existed a next_call_at from their last_called
+
+        Run once after upgrading: without it they count as never called and are dialed straight away.
+        Streams the customers through a cursor and writes in bulk batches.
+        """
+        updated = 0
+        batch = []
+        cursor = self.customers.find({'next_call_at': {'$exists': False}, 'last_called': {'$exists': True}},
+                                     {'last_called': 1})
+        for customer in cursor:
+            batch.append(UpdateOne({'_id': customer['_id'], 'next_call_at': {'$exists': False}},
+                                   {'$set': {'next_call_at': customer['last_called'] + RECALL_INTERVAL_SECONDS}}))
+            if len(batch) >= batch_size:
+                updated += self.customers.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += self.customers.bulk_write(batch, ordered=False).modified_count
+        return updated
+
+    def snapshot(self):
+        """Claim counters and the timezones open right now"""
+        with self._lock:
+            stats = dict(self.stats)
+        return {**stats, 'open_timezones': self.open_timezones(time.time()), 'lease_seconds': self.lease_seconds,
+                'batch_size': self.batch_size}
+
+
+if __name__ == "__main__":
+    import argparse
+    from database import Database
+
+    parser = argparse.ArgumentParser(description="Maintain the campaign call queue")
+    parser.add_argument('command', choices=['backfill'], help="Schedule customers called before the queue existed")
+    parser.parse_args()
+
+    updated = CampaignQueue(Database().customers).backfill()
+    print(f"Scheduled {updated} previously called customers")
@@ -0,0 +1,135 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# tiktoken is optional; without it token counts fall back to a characters-per-token estimate
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except ImportError:
+    _encoding = None
+
+# Every chat message costs a few tokens of framing on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text):
+    """Count tokens locally, exactly with tiktoken or approximately without it"""
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return max(1, len(text) // 4)
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(m['content'] or '') + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class ContextBuilder:
+    def __init__(self, system_prompt, token_budget=None, max_turns=None, summarizer=None):
+        """Build token-budgeted prompts: static system prompt, running summary, recent turns
+
+        The system message is created once and reused, so the prompt prefix stays
+        byte-identical across turns and calls and can hit provider prompt caching.
+        """
+        self.system_message = {"role": "system", "content": system_prompt}
+        self.token_budget = token_budget or int(os.environ.get('PROMPT_TOKEN_BUDGET', 1500))
+        self.max_messages = 2 * (max_turns or int(os.environ.get('PROMPT_HISTORY_TURNS', 10)))
+        self.summarizer = summarizer
+
+    def build(self, session, new_messages=()):
+        """Return (messages, prompt_tokens) for a session's history plus this turn's new messages"""
+        history = session['history']
+        new_messages = list(new_messages)
+
+        prefix = [self.system_message]
+        if session.get('summary'):
+            prefix.append({"role": "system", "content": f"Summary of the conversation so far: {session['summary']}"})
+
+        used = count_message_tokens(prefix) + count_message_tokens(new_messages)
+
+        # Walk back from the newest turn and keep as many as fit in the budget
+        start = len(history)
+        while start > 0 and len(history) - start + len(new_messages) < self.max_messages:
+            cost = count_message_tokens([history[start - 1]])
+            if used + cost > self.token_budget:
+                break
+            used += cost
+            start -= 1
+
+        if start > 0:
+            # Fold whole exchanges, so a reply is never summarized apart from the question it answers
+            while start < len(history) and history[start]['role'] != 'user':
+                used -= count_message_tokens([history[start]])
+                start += 1
+
+        # Taken before folding, which may trim the history (in the summarizer's thread, too)
+        window = history[start:]
+        if start > 0:
+            self._fold(session, history[:start])
+
+        return prefix + window + new_messages, used
+
+    def _fold(self, session, overflow):
+        """Move turns that no longer fit out of the live history"""
+        if self.summarizer is None:
+            del session['history'][:len(overflow)]
+            session['summarized'] = session.get('summarized', 0) + len(overflow)
+            return
+        self.summarizer.submit(session, overflow)
+
+
+class ConversationSummarizer:
+    def __init__(self, llm, model=None, on_summary=None, workers=None):
+        """Fold turns that fall out of the prompt window into a running summary, in the background
+
+        on_summary(call_sid, summary, summarized) stores the summary along with how many of the
+        call's messages it covers, so a session reloaded from MongoDB resumes after them.
+        """
+        self.llm = llm
+        self.model = model or os.environ.get('SUMMARY_MODEL', 'gpt-3.5-turbo')
+        self.on_summary = on_summary
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.environ.get('SUMMARY_WORKERS', 2)),
+            thread_name_prefix='summarizer'
+        )
+        self._lock = threading.Lock()
+
+    def submit(self, session, overflow):
+        """Queue a summary update unless one is already running for this session"""
+        with self._lock:
+            if session.get('summarizing'):
+                return
+            session['summarizing'] = True
+        # session['summarized'] counts the call's messages before the first one in history
+        summarized = session.get('summarized', 0) + len(overflow)
+        self.executor.submit(self._summarize, session, list(overflow), summarized)
+
+    def _summarize(self, session, overflow, summarized):
+        try:
+            transcript = '\n'.join(f"{m['role']}: {m['content']}" for m in overflow)
+            previous = session.get('summary') or 'None yet.'
+            completion = self.llm.chat(
+                model=self.model,
+                call_sid=session.get('call_sid'),
+                messages=[
+                    {"role": "system", "content": "You maintain a running summary of a sales call. Merge the previous summary with the new transcript into at most five short sentences. Keep the customer's interest level, objections, questions, contact details and any commitments."},
+                    {"role": "user", "content": f"Previous summary: {previous}\n\nNew transcript:\n{transcript}"}
+                ],
+                max_tokens=200
+            )
+            summary = completion.choices[0].message.content
+            session['summary'] = summary
+
+            if self.on_summary:
+                self.on_summary(session.get('call_sid'), summary, summarized)
+        except Exception as e:
+            print(f"Error summarizing conversation {session.get('call_sid')}: {e}")
+        finally:
+            # Drop the folded turns even if summarizing failed so the session stays bounded;
+            # newer turns may have been appended in the meantime
+            with self._lock:
+                history = session['history']
+                if history[:len(overflow)] == overflow:
+                    del history[:len(overflow)]
+                    session['summarized'] = summarized
+                session['summarizing'] = False
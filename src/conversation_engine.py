@@ -0,0 +1,439 @@
+import time
+import asyncio
+from twilio.twiml.voice_response import VoiceResponse
+
+from call_flow import (FALLBACK_REPLY, GREETING, STATUS_CALLBACK_EVENTS, filler_phrase, gather_speech,
+                       greeting_twiml, reply_twiml, should_end_call, speak, webhook_url)
+from metrics import get_metrics
+from response_cache import conversation_stage
+from settings import get_settings
+from streaming import StreamingReplies
+
+# One turn of a call, the same whichever entry point receives it: the Flask webhooks, the async
+# webhooks, AIAgent and make_call.py all place calls and answer turns through this module
+
+# One-second pauses to wait for a reply another worker is still generating, before listening again
+CONTINUE_WAIT_STEPS = 10
+
+
+def dial_params(phone_number, settings=None):
+    """Arguments for Twilio's calls.create: dial phone_number and run the /handle-call conversation"""
+    settings = settings or get_settings()
+    return {
+        'url': f"{settings.base_url}/handle-call",
+        'to': phone_number,
+        'from_': settings.twilio_phone_number,
+        'status_callback': f"{settings.base_url}/call-status",
+        'status_callback_event': STATUS_CALLBACK_EVENTS
+    }
+
+
+def place_call(twilio_client, phone_number, settings=None):
+    """Place an outbound call and return its call_sid"""
+    return twilio_client.calls.create(**dial_params(phone_number, settings)).sid
+
+
+def new_session(call_sid):
+    return {'call_sid': call_sid, 'history': [], 'summary': None, 'turns': 0}
+
+
+class SessionStore:
+    def __init__(self, sessions, append=None, create=new_session):
+        """Conversation state kept in a SessionCache and written through with append(call_sid, messages)
+
+        A call the cache's loader doesn't know starts from create(call_sid). Without append the
+        state lives in this process only.
+        """
+        self.sessions = sessions
+        self.append = append
+        self.create = create
+
+    def load(self, call_sid):
+        session = self.sessions.get(call_sid)
+        if session is None:
+            session = self.create(call_sid)
+            self.sessions.put(call_sid, session)
+        return session
+
+    def record(self, session, messages):
+        """Write messages through, then add them to the cached session"""
+        if self.append is not None:
+            self.append(session['call_sid'], messages)
+        # The context builder folds older turns out of the session as the window moves on
+        session['history'].extend(messages)
+        session['turns'] += sum(1 for message in messages if message['role'] == 'user')
+
+    def reload(self, call_sid):
+        """The session as last written through, rather than this worker's cached copy, or None"""
+        if self.sessions.loader is not None:
+            self.sessions.evict(call_sid)
+        return self.sessions.get(call_sid)
+
+    def evict(self, call_sid):
+        self.sessions.evict(call_sid)
+
+
+class AsyncTurnStore:
+    def __init__(self, db, max_turns):
+        """Conversation state read from and appended to MongoDB on every turn, for the async server"""
+        self.db = db
+        self.max_turns = max_turns
+
+    async def load(self, call_sid):
+        # Turns are counted from the call's message_count, not the window of history read back
+        return await self.db.get_turn_context(call_sid, self.max_turns)
+
+    async def reload(self, call_sid):
+        # Every load already reads MongoDB
+        return await self.load(call_sid)
+
+    async def record(self, session, messages):
+        await self.db.append_turns(session['call_sid'], messages)
+        session['history'].extend(messages)
+        session['turns'] += sum(1 for message in messages if message['role'] == 'user')
+
+
+class _Conversation:
+    def __init__(self, store, llm, context, tts=None, response_cache=None, settings=None, metrics=None,
+                 max_tokens=150):
+        """The steps of a turn that don't wait on the network, shared by the sync and async engines"""
+        self.store = store
+        self.llm = llm
+        self.context = context
+        self.tts = tts
+        self.response_cache = response_cache
+        self.settings = settings or get_settings()
+        self.metrics = metrics or get_metrics()
+        self.max_tokens = max_tokens
+
+    def audio_url(self, text):
+        """URL of the pre-rendered audio for text, or None if it isn't cached"""
+        if self.tts is None:
+            return None
+        key = self.tts.cache_key(text)
+        if not self.tts.cache.contains(key, record=True):
+            return None
+        return f"{self.settings.base_url or ''}/audio/{key}"
+
+    def greeting(self, call_sid):
+        """TwiML for the first turn of a call"""
+        timer = self.metrics.turn(call_sid, 0)
+        with timer.stage('tts'):
+            audio_url = self.audio_url(GREETING)
+        with timer.stage('twiml_render'):
+            twiml = greeting_twiml(audio_url, call_sid)
+        timer.finish()
+        return twiml
+
+    def repeated(self, session, turn):
+        """The reply already given to turn, when this request is a retry of it, else None"""
+        if turn is not None and turn <= session['turns'] and session['history'] \
+                and session['history'][-1]['role'] == 'assistant':
+            return session['history'][-1]['content']
+        return None
+
+    def lookup(self, session, customer_input, timer):
+        """An approved answer for the utterance from the response cache, or None"""
+        if self.response_cache is None or not customer_input:
+            return None
+        with timer.stage('response_cache'):
+            cached, similarity = self.response_cache.lookup(customer_input, conversation_stage(session))
+        if cached is not None:
+            print(f"Response cache hit: {session['call_sid']} - {cached['id']} ({similarity:.2f})")
+        return cached
+
+    def prompt(self, session, new_messages, timer, context=None):
+        """The messages to send for this turn, and their token count"""
+        with timer.stage('prompt_build'):
+            messages, prompt_tokens = (context or self.context).build(session, new_messages)
+        print(f"Prompt tokens: {session['call_sid']} - {prompt_tokens}")
+        return messages, prompt_tokens
+
+    def record_llm_call(self, seconds):
+        if self.response_cache is not None:
+            self.response_cache.record_llm_call(seconds)
+
+    def filler(self, call_sid, turn):
+        """TwiML for a slow turn: a filler phrase, then <Redirect> to pick the reply up"""
+        response = VoiceResponse()
+        phrase = filler_phrase(turn)
+        speak(response, phrase, self.audio_url(phrase))
+        response.redirect(webhook_url('/handle-call-continue', call_sid, turn=turn, step=1), method='POST')
+        return str(response)
+
+    def stored_reply(self, session, call_sid, turn, step):
+        """TwiML for a continue webhook whose reply isn't in flight here: speak it once it is stored
+
+        Another worker started the reply, or it expired here. Until the reply shows up in the
+        session, pause and redirect again, then give up and listen for the caller to repeat it.
+        """
+        ai_response = self.repeated(session, turn) if session is not None else None
+        if ai_response is not None:
+            print(f"Stored reply: {call_sid} - turn {turn}")
+            return reply_twiml(ai_response, self.audio_url(ai_response), call_sid, turn)
+        response = VoiceResponse()
+        step = step or 0
+        if turn and step < CONTINUE_WAIT_STEPS:
+            response.pause(length=1)
+            response.redirect(webhook_url('/handle-call-continue', call_sid, turn=turn, step=step + 1), method='POST')
+        else:
+            # Nothing was stored in time, so the turn isn't recorded and the caller can just repeat it
+            gather_speech(response, call_sid, turn + 1 if turn else None)
+        return str(response)
+
+    def render_reply(self, call_sid, ai_response, timer, turn):
+        """Speak the reply to turn, then hang up or listen for the next one"""
+        with timer.stage('tts'):
+            audio_url = self.audio_url(ai_response)
+        with timer.stage('twiml_render'):
+            return reply_twiml(ai_response, audio_url, call_sid, turn)
+
+
+class ConversationEngine(_Conversation):
+    def __init__(self, store, llm, context, tts=None, response_cache=None, settings=None, metrics=None,
+                 max_tokens=150):
+        """Answers the turns of calls through a state store, an LLM backend and a TTS cache
+
+        store is a SessionStore, llm a ModelRouter (or anything with its generate() and chat()),
+        and tts a TextToSpeech with an audio cache, or None to let Twilio <Say> every reply.
+        Replies are generated in the background: spoken sentence by sentence with LLM_STREAMING,
+        and with a filler phrase first when they take longer than LLM_FILLER_AFTER.
+        """
+        super().__init__(store, llm, context, tts, response_cache, settings, metrics, max_tokens)
+        self.streaming = self.settings.llm_streaming
+        self.first_sentence_timeout = self.settings.stream_first_sentence_timeout
+        self.next_sentence_timeout = self.settings.stream_next_sentence_timeout
+        self.filler_after = self.settings.llm_filler_after
+        self.replies = StreamingReplies()
+
+    def load(self, call_sid, timer):
+        with timer.stage('mongo_read'):
+            return self.store.load(call_sid)
+
+    def record(self, session, messages, timer):
+        with timer.stage('mongo_write'):
+            self.store.record(session, messages)
+
+    def generate(self, session, new_messages, timer, context=None, max_tokens=None):
+        """The whole reply to new_messages as text, for callers that don't speak it through TwiML
+
+        context replaces the engine's prompt, e.g. for a reply in a JSON envelope.
+        """
+        messages, prompt_tokens = self.prompt(session, new_messages, timer, context)
+        with timer.stage('llm_total'):
+            return self.llm.chat(messages, session['call_sid'], max_tokens=max_tokens or self.max_tokens)
+
+    def handle_turn(self, call_sid, customer_input, turn=None):
+        """TwiML answering what the caller said; an empty utterance is the start of the call"""
+        if not customer_input:
+            return self.greeting(call_sid)
+
+        timer = self.metrics.turn(call_sid)
+        # Only the recent conversation context needed for the prompt
+        session = self.load(call_sid, timer)
+        # Numbered from the request, so a turn that isn't recorded (a fallback reply) still moves the next
+        # <Gather> on to a number the webhook deduplicator hasn't seen; kept out of the timer, which is
+        # one shared object for every call when metrics are off
+        turn_number = turn or session['turns'] + 1
+        user_message = {"role": "user", "content": customer_input}
+
+        ai_response = self.repeated(session, turn)
+        if ai_response is not None:
+            # A retry of a turn answered by another worker, or one whose TwiML has expired: repeat the reply
+            print(f"Repeated turn: {call_sid} - turn {turn}")
+            return reply_twiml(ai_response, self.audio_url(ai_response), call_sid, turn)
+
+        cached = self.lookup(session, customer_input, timer)
+        if cached is not None:
+            # An approved answer, usually with its audio already rendered
+            self.record(session, [user_message, {"role": "assistant", "content": cached['answer']}], timer)
+            twiml = self.render_reply(call_sid, cached['answer'], timer, turn_number)
+            timer.finish(turn=turn_number, response_cache=cached['id'])
+            return twiml
+
+        messages, prompt_tokens = self.prompt(session, [user_message], timer)
+
+        def save_reply(ai_response):
+            # A streamed reply finishes after the webhook has returned, so this is recorded on its own
+            self.record(session, [user_message, {"role": "assistant", "content": ai_response}], timer)
+            self.record_llm_call(time.perf_counter() - generation_start)
+
+        # Complete replies come back in one piece, still in the background so a filler can be spoken meanwhile
+        generation_start = time.perf_counter()
+        tokens = self.llm.generate(messages, call_sid, stream=self.streaming, max_tokens=self.max_tokens)
+        reply = self.replies.start(call_sid, timer.stream('llm', tokens), on_complete=save_reply, turn=turn_number)
+
+        if self.streaming:
+            # Speak the first sentence as soon as it is ready and fetch the rest via <Redirect>
+            response = VoiceResponse()
+            with timer.stage('first_sentence'):
+                self.continue_reply(response, reply, min(self.first_sentence_timeout, self.filler_after), filler=True)
+            with timer.stage('twiml_render'):
+                twiml = str(response)
+            timer.finish(turn=turn_number, prompt_tokens=prompt_tokens, streaming=True)
+            return twiml
+
+        # Wait for the whole reply, but not so long that the caller hears only silence
+        with timer.stage('llm_wait'):
+            finished = reply.done.wait(self.filler_after)
+        if not finished:
+            # Say a filler phrase and pick the reply up via <Redirect> once it is ready
+            response = VoiceResponse()
+            self.continue_reply(response, reply, 0, filler=True)
+            with timer.stage('twiml_render'):
+                twiml = str(response)
+            timer.finish(turn=turn_number, prompt_tokens=prompt_tokens, filler=True)
+            return twiml
+
+        self.replies.finish(call_sid)
+        if reply.error is not None and not reply.parts:
+            # Neither model answered in time; the turn isn't recorded, so the caller can just repeat it
+            ai_response = FALLBACK_REPLY
+        else:
+            ai_response = reply.text
+
+        # Speak the AI response, then hang up or continue listening for customer input
+        twiml = self.render_reply(call_sid, ai_response, timer, turn_number)
+        timer.finish(turn=turn_number, prompt_tokens=prompt_tokens)
+        return twiml
+
+    def handle_continue(self, call_sid, turn=None, step=None):
+        """TwiML for the next sentences of a reply still being generated"""
+        reply = self.replies.get(call_sid)
+        if reply is None:
+            return self.stored_reply(self.store.reload(call_sid), call_sid, turn, step)
+        response = VoiceResponse()
+        self.continue_reply(response, reply, self.next_sentence_timeout)
+        return str(response)
+
+    def continue_reply(self, response, reply, timeout, filler=False):
+        """Add the ready sentences of a reply, then redirect, listen or hang up"""
+        sentences = reply.next_sentences(timeout)
+        for sentence in sentences:
+            speak(response, sentence, self.audio_url(sentence))
+
+        if not reply.finished:
+            if not sentences and filler:
+                # The first webhook of a slow turn: let the caller know an answer is coming
+                phrase = filler_phrase(reply.turn)
+                speak(response, phrase, self.audio_url(phrase))
+            elif not sentences:
+                # Nothing ready yet: keep the line alive briefly instead of spinning on redirects
+                response.pause(length=1)
+            reply.steps += 1
+            response.redirect(webhook_url('/handle-call-continue', reply.call_sid, turn=reply.turn, step=reply.steps),
+                              method='POST')
+            return
+
+        self.replies.finish(reply.call_sid)
+        next_turn = reply.turn + 1 if reply.turn else None
+        if reply.error is not None and not reply.parts:
+            speak(response, FALLBACK_REPLY, self.audio_url(FALLBACK_REPLY))
+            gather_speech(response, reply.call_sid, next_turn)
+        elif should_end_call(reply.text):
+            response.hangup()
+        else:
+            gather_speech(response, reply.call_sid, next_turn)
+
+    def end_call(self, call_sid):
+        """Drop the call's cached state once it is over"""
+        self.store.evict(call_sid)
+        self.replies.finish(call_sid)
+
+
+class AsyncConversationEngine(_Conversation):
+    def __init__(self, store, llm, context, **kwargs):
+        """ConversationEngine for the async server: an AsyncTurnStore and an AsyncModelRouter on its event loop
+
+        Replies are complete and awaited in the handler, since a waiting turn costs no worker there.
+        One that takes longer than LLM_FILLER_AFTER gets a filler phrase and is picked up via <Redirect>.
+        """
+        super().__init__(store, llm, context, **kwargs)
+        self.filler_after = self.settings.llm_filler_after
+        self.next_sentence_timeout = self.settings.stream_next_sentence_timeout
+        # call_sid -> (turn, task) of replies still being generated after their filler phrase
+        self.replies = {}
+
+    async def handle_turn(self, call_sid, customer_input, turn=None):
+        """TwiML answering what the caller said; an empty utterance is the start of the call"""
+        if not customer_input:
+            return self.greeting(call_sid)
+
+        timer = self.metrics.turn(call_sid)
+        with timer.stage('mongo_read'):
+            session = await self.store.load(call_sid)
+        # Numbered from the request, so a turn that isn't recorded (a fallback reply) still moves the next
+        # <Gather> on to a number the webhook deduplicator hasn't seen; kept out of the timer, which is
+        # one shared object for every call when metrics are off
+        turn_number = turn or session['turns'] + 1
+        user_message = {"role": "user", "content": customer_input}
+
+        ai_response = self.repeated(session, turn)
+        if ai_response is not None:
+            print(f"Repeated turn: {call_sid} - turn {turn}")
+            return reply_twiml(ai_response, self.audio_url(ai_response), call_sid, turn)
+
+        cached = self.lookup(session, customer_input, timer)
+        if cached is not None:
+            # Append this turn to the conversation history in one atomic write
+            with timer.stage('mongo_write'):
+                await self.store.record(session, [user_message, {"role": "assistant", "content": cached['answer']}])
+            twiml = self.render_reply(call_sid, cached['answer'], timer, turn_number)
+            timer.finish(turn=turn_number, response_cache=cached['id'])
+            return twiml
+
+        messages, prompt_tokens = self.prompt(session, [user_message], timer)
+        reply = asyncio.ensure_future(self._reply(session, user_message, messages, timer))
+        # Wait for the whole reply, but not so long that the caller hears only silence
+        with timer.stage('llm_wait'):
+            done, _ = await asyncio.wait({reply}, timeout=self.filler_after)
+        if not done:
+            self.replies[call_sid] = (turn_number, reply)
+            twiml = self.filler(call_sid, turn_number)
+            timer.finish(turn=turn_number, prompt_tokens=prompt_tokens, filler=True)
+            return twiml
+
+        twiml = self.render_reply(call_sid, reply.result(), timer, turn_number)
+        timer.finish(turn=turn_number, prompt_tokens=prompt_tokens)
+        return twiml
+
+    async def handle_continue(self, call_sid, turn=None, step=None):
+        """TwiML for a reply that was still being generated when its filler phrase was spoken"""
+        turn_and_reply = self.replies.get(call_sid)
+        if turn_and_reply is None or turn_and_reply[0] != turn:
+            return self.stored_reply(await self.store.reload(call_sid), call_sid, turn, step)
+        reply = turn_and_reply[1]
+        done, _ = await asyncio.wait({reply}, timeout=self.next_sentence_timeout)
+        if not done:
+            response = VoiceResponse()
+            response.pause(length=1)
+            response.redirect(webhook_url('/handle-call-continue', call_sid, turn=turn, step=(step or 0) + 1),
+                              method='POST')
+            return str(response)
+        self.replies.pop(call_sid, None)
+        ai_response = reply.result()
+        return reply_twiml(ai_response, self.audio_url(ai_response), call_sid, turn)
+
+    async def _reply(self, session, user_message, messages, timer):
+        """Generate and record the reply; FALLBACK_REPLY, unrecorded, when no model answers in time"""
+        call_sid = session['call_sid']
+        generation_start = time.perf_counter()
+        try:
+            with timer.stage('llm_total'):
+                ai_response = await self.llm.chat(messages, call_sid, max_tokens=self.max_tokens)
+        except Exception as e:
+            # The turn isn't recorded, so the caller can just repeat it
+            print(f"Error generating reply: {call_sid} - {e}")
+            return FALLBACK_REPLY
+        self.record_llm_call(time.perf_counter() - generation_start)
+
+        # Append this turn to the conversation history in one atomic write
+        with timer.stage('mongo_write'):
+            await self.store.record(session, [user_message, {"role": "assistant", "content": ai_response}])
+        return ai_response
+
+    def end_call(self, call_sid):
+        """Drop a reply still in flight once the call is over"""
+        turn_and_reply = self.replies.pop(call_sid, None)
+        if turn_and_reply is not None:
+            turn_and_reply[1].cancel()
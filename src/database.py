@@ -1,123 +1,458 @@
 import os
-from pymongo import MongoClient
+import atexit
+import uuid
+import threading
+from pymongo import ASCENDING, DESCENDING, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime
-from dotenv import load_dotenv
+from settings import load_env
+from campaign import QUEUE_SORT, CampaignQueue
+from call_history import CallHistory
 
 # Load environment variables
-load_dotenv()
+load_env()
+
+# How far along a call each Twilio status is; a status never replaces a later one
+STATUS_RANKS = {
+    'queued': 0, 'initiated': 0,
+    'ringing': 1,
+    'in-progress': 2, 'answered': 2,
+    'completed': 3, 'busy': 3, 'failed': 3, 'no-answer': 3, 'canceled': 3
+}
+
+# Post-call batches each analytics counter remembers, so a batch retried after a partial write isn't counted twice
+ANALYTICS_BATCH_LOG = 1000
+
+def status_advances(current, status):
+    """True if status moves a call on from current; callbacks can arrive out of order, or twice"""
+    return current is None or STATUS_RANKS.get(status, 0) > STATUS_RANKS.get(current, 0)
+
+def call_update(fields):
+    """An update that $sets fields on a call, keeping its status if the stored one is as far along
+    
+    A status is guarded on the server with an update pipeline, so concurrent or buffered writes
+    can't move a completed call back to ringing.
+    """
+    if 'status' not in fields:
+        return {'$set': fields}
+    rank = STATUS_RANKS.get(fields['status'], 0)
+    stored_rank = {'$ifNull': ['$status_rank', -1]}
+    stage = {name: {'$literal': value} for name, value in fields.items() if name != 'status'}
+    stage['status'] = {'$cond': [{'$lt': [stored_rank, rank]}, {'$literal': fields['status']}, '$status']}
+    stage['status_rank'] = {'$max': [stored_rank, rank]}
+    return [{'$set': stage}]
+
+def turn_context_projection(max_turns):
+    """Projection of a call that reads only what rebuilding its prompt needs"""
+    return {'_id': 0, 'conversation_history': {'$slice': -2 * max_turns}, 'summary': 1, 'message_count': 1,
+            'summarized_count': 1}
+
+def turn_context(call_sid, call_data):
+    """A call's session from a turn_context_projection read: unsummarized recent turns, summary, turn count"""
+    history = call_data.get('conversation_history', [])
+    summarized = call_data.get('summarized_count', 0)
+    # Position of the window's first message in the whole call
+    first = call_data.get('message_count', len(history)) - len(history)
+    if first < summarized:
+        # Only the messages the summary doesn't cover yet
+        history = history[summarized - first:]
+        first = summarized
+    else:
+        # The window starts mid-call: begin at a whole exchange
+        while history and history[0]['role'] != 'user':
+            history = history[1:]
+            first += 1
+    return {
+        'call_sid': call_sid,
+        'history': history,
+        'summary': call_data.get('summary'),
+        'summarized': first,
+        # Turns answered so far (a user message and a reply each), to recognize a retried turn;
+        # counted over the whole call, since the history is cut down to the window
+        'turns': call_data.get('message_count', 0) // 2
+    }
+
+def _merge_fields(fields, newer):
+    """Coalesce newer fields into fields; an older status arriving late doesn't replace the queued one"""
+    if 'status' in newer and not status_advances(fields.get('status'), newer['status']):
+        newer = {name: value for name, value in newer.items() if name != 'status'}
+    fields.update(newer)
+
+class WriteBehindBuffer:
+    def __init__(self, collection, key='call_sid', max_ops=None, flush_interval=None):
+        """Coalesce upserts per key and flush them to MongoDB with bulk_write"""
+        self.collection = collection
+        self.key = key
+        self.max_ops = max_ops or int(os.environ.get('MONGO_WRITE_BEHIND_MAX_OPS', 500))
+        self.flush_interval = flush_interval or float(os.environ.get('MONGO_WRITE_BEHIND_INTERVAL', 1.0))
+        
+        self.pending = {}
+        self.stats = {'buffered': 0, 'coalesced': 0, 'flushes': 0, 'written': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        
+        self._thread = threading.Thread(target=self._run, daemon=True, name='write-behind')
+        self._thread.start()
+    
+    def update(self, key_value, set_fields):
+        """Queue an upsert; later fields for the same key overwrite earlier ones"""
+        with self._lock:
+            update = self.pending.get(key_value)
+            if update is None:
+                update = self.pending[key_value] = {'$set': {}}
+            else:
+                self.stats['coalesced'] += 1
+            _merge_fields(update['$set'], set_fields)
+            self.stats['buffered'] += 1
+            full = len(self.pending) >= self.max_ops
+        
+        if full:
+            self._wake.set()
+    
+    def pending_fields(self, key_value):
+        """Fields queued for a key but not yet written, for read-your-writes"""
+        with self._lock:
+            update = self.pending.get(key_value)
+            return dict(update['$set']) if update else {}
+    
+    def flush(self):
+        """Write every pending update in one unordered bulk_write"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return 0
+            
+            try:
+                self.collection.bulk_write(
+                    [UpdateOne({self.key: key_value}, call_update(update['$set']), upsert=True)
+                     for key_value, update in batch.items()],
+                    ordered=False
+                )
+            except Exception as e:
+                print(f"Error flushing {len(batch)} buffered writes: {e}")
+                self.stats['errors'] += 1
+                self._requeue(batch)
+                return 0
+            
+            self.stats['flushes'] += 1
+            self.stats['written'] += len(batch)
+            return len(batch)
+    
+    def _requeue(self, batch):
+        # Put a failed batch back without clobbering fields queued since it was taken
+        with self._lock:
+            for key_value, update in batch.items():
+                newer = self.pending.get(key_value)
+                if newer is not None:
+                    _merge_fields(update['$set'], newer['$set'])
+                self.pending[key_value] = update
+    
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(timeout=self.flush_interval)
+            self._wake.clear()
+            self.flush()
+    
+    def close(self):
+        """Stop the flusher and write out anything still pending"""
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
 
 class Database:
-    def __init__(self):
+    # Indexes every hot query relies on, per collection: (name, keys, options)
+    INDEXES = {
+        'calls': [
+            ('call_sid_unique', [('call_sid', ASCENDING)], {'unique': True}),
+            # Processed calls, transcript and all, are deleted once their expires_at passes
+            ('transcript_expiry', [('expires_at', ASCENDING)], {'expireAfterSeconds': 0}),
+        ],
+        'call_history': [
+            # A customer's buckets newest first, and the open bucket for a new call
+            ('customer_buckets', [('phone_number', ASCENDING), ('month', ASCENDING), ('count', ASCENDING)], {}),
+        ],
+        'customers': [
+            ('phone_number_unique', [('phone_number', ASCENDING)],
+             {'unique': True, 'partialFilterExpression': {'phone_number': {'$exists': True}}}),
+            # The campaign claim: open timezones ($in), then priority and due time in claim order
+            ('campaign_queue', [('timezone', ASCENDING), ('priority', DESCENDING), ('next_call_at', ASCENDING)], {}),
+            # Only customers waiting on a callback carry callback_at
+            ('campaign_callbacks', [('callback_at', ASCENDING)], {'sparse': True}),
+        ],
+    }
+    
+    def __init__(self, mongo_uri=None, db_name=None, client=None, write_behind=None):
         """Initialize database connection"""
-        mongo_uri = os.environ.get('MONGO_URI')
-        if not mongo_uri:
-            raise ValueError("MongoDB URI not found in environment variables")
+        if client is None:
+            mongo_uri = mongo_uri or os.environ.get('MONGO_URI')
+            if not mongo_uri:
+                raise ValueError("MongoDB URI not found in environment variables")
             
-        print(f"Connecting to MongoDB at: {mongo_uri[:10]}...")
-        self.client = MongoClient(mongo_uri)
-        self.db = self.client['calling_agent_db']
+            print(f"Connecting to MongoDB at: {mongo_uri[:10]}...")
+            # A minimum pool is opened in the background, so the first turns don't pay for connecting
+            client = MongoClient(mongo_uri, minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)))
+        self.client = client
+        self.db = self.client[db_name or os.environ.get('MONGO_DB_NAME', 'calling_agent_db')]
         self.customers = self.db['customers']
         self.calls = self.db['calls']
-    
-    def get_customers_to_call(self, limit=10):
-        """Get a list of customers to call"""
-        # Get customers who haven't been called in the last 30 days or never called
-        customers = list(self.customers.find({
-            '$or': [
-                {'last_called': {'$exists': False}},
-                {'last_called': {'$lt': datetime.now().timestamp() - (30 * 24 * 60 * 60)}}
-            ]
-        }).limit(limit))
+        self.analytics = self.db['analytics']
+        self.history = CallHistory(self.db['call_history'])
         
-        return customers
+        # Status callbacks and call records can be coalesced and written in bulk
+        if write_behind is None:
+            write_behind = os.environ.get('MONGO_WRITE_BEHIND', 'false').lower() == 'true'
+        self.call_writes = WriteBehindBuffer(self.calls) if write_behind else None
+        if self.call_writes:
+            # Flush on interpreter shutdown so buffered status updates are not lost
+            atexit.register(self.close)
+    
+    def close(self):
+        """Flush buffered writes"""
+        if self.call_writes:
+            self.call_writes.close()
+    
+    def ping(self):
+        """Select a server and open a pooled connection, e.g. while warming up"""
+        self.client.admin.command('ping')
+    
+    def _upsert_call(self, call_sid, fields):
+        """Upsert call fields, through the write-behind buffer when enabled"""
+        if self.call_writes:
+            self.call_writes.update(call_sid, fields)
+        else:
+            self.calls.update_one({'call_sid': call_sid}, call_update(fields), upsert=True)
+    
+    def ensure_indexes(self):
+        """Create any declared index that is missing; returns the names created"""
+        created = []
+        for collection_name, indexes in self.INDEXES.items():
+            collection = self.db[collection_name]
+            existing = collection.index_information()
+            for name, keys, options in indexes:
+                if name in existing:
+                    continue
+                try:
+                    collection.create_index(keys, name=name, **options)
+                    created.append(f"{collection_name}.{name}")
+                except OperationFailure as e:
+                    # Typically duplicate phone numbers or call sids that must be cleaned up first
+                    print(f"Error creating index {collection_name}.{name}: {e}")
+        if created:
+            print(f"Created indexes: {', '.join(created)}")
+        return created
+    
+    def missing_indexes(self):
+        """Declared indexes that don't exist yet, as collection.name strings"""
+        missing = []
+        for collection_name, indexes in self.INDEXES.items():
+            existing = self.db[collection_name].index_information()
+            missing.extend(f"{collection_name}.{name}" for name, _, _ in indexes if name not in existing)
+        return missing
+    
+    def hot_queries(self):
+        """The queries that run on every turn, campaign claim or processed call, as (name, cursor) pairs"""
+        now = datetime.now().timestamp()
+        due = CampaignQueue(self.customers).due_filter(now)
+        return [
+            ('calls.find_one(call_sid)', self.calls.find({'call_sid': 'CA_explain'}).limit(1)),
+            ('customers.find_one(phone_number)', self.customers.find({'phone_number': '+10000000000'}).limit(1)),
+            ('customers.campaign_claim', self.customers.find(due, {'_id': 1}).sort(QUEUE_SORT).limit(10)),
+            ('customers.campaign_callbacks',
+             self.customers.find({**due, 'callback_at': {'$lte': now}}, {'_id': 1}).sort('callback_at', ASCENDING).limit(10)),
+            ('call_history.open_bucket',
+             self.history.history.find({'phone_number': '+10000000000', 'month': '2000-01', 'count': {'$lt': 1}}).limit(1)),
+        ]
+    
+    def record_call_initiated(self, call_sid, customer_id, phone_number):
+        """Store a newly dialed call"""
+        self._upsert_call(call_sid, {
+            'customer_id': customer_id,
+            'phone_number': phone_number,
+            'status': 'initiated',
+            'created_at': datetime.now().timestamp()
+        })
+    
+    def save_customer_responses(self, call_sid, customer_responses):
+        """Store the structured fields extracted from the customer so far"""
+        self._upsert_call(call_sid, {'customer_responses': customer_responses})
     
     def update_call_status(self, call_sid, status):
-        """Update call status in the database"""
-        self.calls.update_one(
-            {'call_sid': call_sid},
-            {
-                '$set': {
-                    'status': status,
-                    'updated_at': datetime.now().timestamp()
-                }
-            },
-            upsert=True
+        """Update call status in the database; a status never replaces a later one"""
+        self._upsert_call(call_sid, {
+            'status': status,
+            'updated_at': datetime.now().timestamp()
+        })
+    
+    def get_calls_for_post_call(self, call_sids):
+        """The finished calls among call_sids that haven't been post-processed, without their history"""
+        if self.call_writes:
+            # Extracted responses and the call record itself may still be sitting in the buffer
+            self.call_writes.flush()
+        calls = self.calls.find(
+            {'call_sid': {'$in': call_sids}, 'post_call_at': {'$exists': False}},
+            {'_id': 0, 'call_sid': 1, 'customer_id': 1, 'phone_number': 1, 'customer_responses': 1, 'created_at': 1,
+             'post_call_batch': 1}
         )
+        return {call['call_sid']: call for call in calls}
     
-    def update_customer_details(self, call_data):
-        """Update customer details based on call outcome"""
-        customer_id = call_data.get('customer_id')
-        phone_number = call_data.get('phone_number')
+    def save_post_call(self, results, increments):
+        """Write a batch of call outcomes: history, customer summaries, analytics, then the calls themselves
         
-        # If we don't have a customer ID but have a phone number, try to find the customer
-        if not customer_id and phone_number:
-            customer = self.customers.find_one({'phone_number': phone_number})
-            if customer:
-                customer_id = customer['_id']
+        The calls are marked last, so a batch interrupted part way is processed again rather than lost.
+        A retry skips what the interrupted attempt already wrote: history and customer summaries are
+        checked for the call_sids they hold, and each analytics counter records the post-call batch
+        its increments came from. A call keeps the batch it was first claimed for across retries, and
+        only calls claimed by an earlier attempt are checked.
+        """
+        now = datetime.now().timestamp()
+        claims, retried = self._claim_post_call(results)
+        entries = {}
+        for call in results:
+            if call.get('phone_number'):
+                entries.setdefault(call['phone_number'], []).append(call)
         
-        # If we still don't have a customer ID, create a new customer
-        if not customer_id:
-            result = self.customers.insert_one({
-                'phone_number': phone_number,
-                'created_at': datetime.now().timestamp()
-            })
-            customer_id = result.inserted_id
+        history_updates = []
+        customer_updates = []
+        in_history, in_summary = self._post_call_written(retried)
+        for phone_number, calls in entries.items():
+            calls.sort(key=lambda call: call['completed_at'])
+            customer_id = calls[-1].get('customer_id')
+            history = [self.history.entry(call) for call in calls if call['call_sid'] not in in_history]
+            if history:
+                history_updates += self.history.bucket_updates(phone_number, history, customer_id)
+            summary = [self.history.entry(call) for call in calls if call['call_sid'] not in in_summary]
+            if not summary:
+                continue
+            update = self.history.customer_update(summary)
+            update['$set']['updated_at'] = now
+            if customer_id:
+                customer_updates.append(UpdateOne({'_id': customer_id}, update))
+            else:
+                # Calls placed to a number we don't know yet create the customer
+                update['$setOnInsert'] = {'created_at': now}
+                customer_updates.append(UpdateOne({'phone_number': phone_number}, update, upsert=True))
+        if history_updates:
+            self.history.history.bulk_write(history_updates, ordered=False)
+        if customer_updates:
+            self.customers.bulk_write(customer_updates, ordered=False)
         
-        # Update customer with call information
-        self.customers.update_one(
-            {'_id': customer_id},
-            {
-                '$set': {
-                    'last_called': datetime.now().timestamp(),
-                    'last_call_outcome': call_data.get('call_outcome'),
-                    'updated_at': datetime.now().timestamp()
-                },
-                '$push': {
-                    'call_history': {
-                        'call_sid': call_data.get('call_sid', ''),
-                        'timestamp': datetime.now().timestamp(),
-                        'outcome': call_data.get('call_outcome'),
-                        'responses': call_data.get('customer_responses', {})
-                    }
-                }
-            }
-        )
+        counters = {}
+        for call_sid, buckets in increments.items():
+            for bucket, fields in buckets.items():
+                counter = counters.setdefault((bucket, claims[call_sid]), {})
+                for field, count in fields.items():
+                    counter[field] = counter.get(field, 0) + count
+        if counters:
+            try:
+                self.analytics.bulk_write(
+                    [UpdateOne({'_id': bucket, 'batches': {'$ne': batch}},
+                               {'$inc': fields, '$set': {'updated_at': now},
+                                '$push': {'batches': {'$each': [batch], '$slice': -ANALYTICS_BATCH_LOG}}},
+                               upsert=True)
+                     for (bucket, batch), fields in counters.items()],
+                    ordered=False
+                )
+            except BulkWriteError as e:
+                # A counter that already holds the batch doesn't match, and its upsert collides on _id
+                if e.details.get('writeConcernErrors') or any(error['code'] != 11000 for error in e.details['writeErrors']):
+                    raise
         
-        # Store complete call data
-        self.calls.update_one(
-            {'call_sid': call_data.get('call_sid', '')},
-            {
-                '$set': {
-                    'customer_id': customer_id,
-                    'phone_number': phone_number,
-                    'outcome': call_data.get('call_outcome'),
-                    'customer_responses': call_data.get('customer_responses', {}),
-                    'conversation_history': call_data.get('history', []),
-                    'completed_at': datetime.now().timestamp()
-                }
-            },
-            upsert=True
+        processed = {'post_call_at': now}
+        expires_at = self.history.expires_at()
+        if expires_at:
+            # The outcome and responses are kept in call_history; the raw call and transcript are archived by TTL
+            processed['expires_at'] = expires_at
+        self.calls.bulk_write(
+            [UpdateOne({'call_sid': call['call_sid']},
+                       {'$set': {'outcome': call['outcome'], 'completed_at': call['completed_at'], **processed}})
+             for call in results],
+            ordered=False
+        )
+    
+    def _claim_post_call(self, results):
+        """{call_sid: post-call batch}, claiming calls no earlier attempt has, and the calls an earlier attempt had"""
+        claims = {call['call_sid']: call.get('post_call_batch') for call in results}
+        retried = [call for call in results if call.get('post_call_batch')]
+        unclaimed = [call_sid for call_sid, batch in claims.items() if not batch]
+        if unclaimed:
+            batch = uuid.uuid4().hex
+            claimed = self.calls.update_many({'call_sid': {'$in': unclaimed}, 'post_call_batch': {'$exists': False}},
+                                             {'$set': {'post_call_batch': batch}})
+            if claimed.matched_count == len(unclaimed):
+                claims.update(dict.fromkeys(unclaimed, batch))
+            else:
+                # Another worker claimed some of them first, so its writes may have landed too
+                claimed_by = {call['call_sid']: call['post_call_batch'] for call in
+                              self.calls.find({'call_sid': {'$in': unclaimed}}, {'_id': 0, 'call_sid': 1, 'post_call_batch': 1})}
+                claims.update(claimed_by)
+                retried += [call for call in results if claimed_by.get(call['call_sid'], batch) != batch]
+        return claims, retried
+    
+    def _post_call_written(self, calls):
+        """The call_sids among calls already in call_history, and already in a customer's recent_calls"""
+        if not calls:
+            return set(), set()
+        call_sids = [call['call_sid'] for call in calls]
+        phone_numbers = list({call['phone_number'] for call in calls if call.get('phone_number')})
+        customer_ids = [call['customer_id'] for call in calls if call.get('customer_id')]
+        buckets = self.history.history.find({'phone_number': {'$in': phone_numbers}, 'calls.call_sid': {'$in': call_sids}},
+                                            {'_id': 0, 'calls.call_sid': 1})
+        customers = self.customers.find(
+            {'$or': [{'_id': {'$in': customer_ids}}, {'phone_number': {'$in': phone_numbers}}],
+             'recent_calls.call_sid': {'$in': call_sids}},
+            {'_id': 0, 'recent_calls.call_sid': 1}
         )
+        return ({entry['call_sid'] for bucket in buckets for entry in bucket['calls']},
+                {entry['call_sid'] for customer in customers for entry in customer['recent_calls']})
+    
+    def get_analytics(self, bucket='all'):
+        """Counters kept by the post-call pipeline for one bucket ('all' or 'day:YYYY-MM-DD')"""
+        return self.analytics.find_one({'_id': bucket}, {'_id': 0, 'batches': 0}) or {}
     
     def get_call_data(self, call_sid):
         """Get call data from the database"""
         call_data = self.calls.find_one({'call_sid': call_sid})
         if not call_data:
-            return {
+            call_data = {
                 'call_sid': call_sid,
                 'conversation_history': []
             }
+        if self.call_writes:
+            # Overlay writes that are still sitting in the buffer
+            pending = self.call_writes.pending_fields(call_sid)
+            if 'status' in pending and not status_advances(call_data.get('status'), pending['status']):
+                del pending['status']
+            call_data.update(pending)
         return call_data
     
-    def update_conversation_history(self, call_sid, conversation_history):
-        """Update conversation history in the database"""
+    def get_turn_context(self, call_sid, max_turns):
+        """Fetch the recent turns and running summary needed to rebuild a call's prompt"""
+        call_data = self.calls.find_one({'call_sid': call_sid}, turn_context_projection(max_turns))
+        return turn_context(call_sid, call_data or {})
+    
+    def save_conversation_summary(self, call_sid, summary, summarized):
+        """Store the running summary of the call's first `summarized` messages
+
+        A summary that covers no more than the stored one is dropped, so a slow summarizer
+        finishing late can't roll back a newer summary written by another worker.
+        """
+        self.calls.update_one(
+            {'call_sid': call_sid, 'summarized_count': {'$not': {'$gte': summarized}}},
+            {'$set': {'summary': summary, 'summarized_count': summarized, 'updated_at': datetime.now().timestamp()}}
+        )
+    
+    def append_turns(self, call_sid, messages):
+        """Atomically append messages to a call's history without rewriting the array"""
         self.calls.update_one(
             {'call_sid': call_sid},
             {
-                '$set': {
-                    'conversation_history': conversation_history,
-                    'updated_at': datetime.now().timestamp()
-                }
+                '$push': {'conversation_history': {'$each': messages}},
+                '$inc': {'message_count': len(messages)},
+                '$set': {'updated_at': datetime.now().timestamp()}
             },
             upsert=True
         )
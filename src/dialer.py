@@ -0,0 +1,248 @@
+import os
+import time
+import uuid
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from twilio.base.exceptions import TwilioRestException
+from settings import load_env
+
+# Load environment variables
+load_env()
+
+# Twilio statuses after which a call no longer occupies a line
+TERMINAL_STATUSES = {'completed', 'busy', 'failed', 'no-answer', 'canceled'}
+
+
+def is_transient(error):
+    """Check if a dial failure is worth retrying"""
+    if isinstance(error, TwilioRestException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """Allow `rate` acquisitions per second with bursts of up to `capacity`"""
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DialerJob:
+    def __init__(self, total):
+        """Progress of one batch of outbound calls"""
+        self.id = uuid.uuid4().hex
+        self.total = total
+        self.dialed = 0
+        self.failed = 0
+        self.retries = 0
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def update(self, dialed=0, failed=0, retries=0, error=None):
+        with self._lock:
+            self.dialed += dialed
+            self.failed += failed
+            self.retries += retries
+            if error:
+                # Keep the tail of the error log bounded for very large campaigns
+                self.errors = (self.errors + [error])[-20:]
+
+    def to_dict(self):
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at if self.started_at else 0
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'total': self.total,
+                'dialed': self.dialed,
+                'failed': self.failed,
+                'pending': self.total - self.dialed - self.failed,
+                'retries': self.retries,
+                'calls_per_second': round(self.dialed / elapsed, 2) if elapsed else 0,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'errors': list(self.errors)
+            }
+
+
+class Dialer:
+    def __init__(self, create_call, record_call, calls_per_second=None, max_concurrent_calls=None,
+                 workers=None, max_retries=None, retry_backoff=None, slot_timeout=None, on_failed=None,
+                 job_ttl=None, max_jobs=None):
+        """Concurrent, rate-limited outbound dialer
+
+        create_call(phone_number) places a call and returns its sid;
+        record_call(call_sid, customer) stores it once Twilio has accepted it;
+        on_failed(customer), if given, is told about customers that couldn't be dialed.
+        """
+        self.create_call = create_call
+        self.record_call = record_call
+        self.on_failed = on_failed
+
+        calls_per_second = calls_per_second or float(os.environ.get('DIALER_CALLS_PER_SECOND', 1))
+        self.max_concurrent_calls = max_concurrent_calls or int(os.environ.get('DIALER_MAX_CONCURRENT_CALLS', 50))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('DIALER_MAX_RETRIES', 3))
+        self.retry_backoff = retry_backoff or float(os.environ.get('DIALER_RETRY_BACKOFF', 1.0))
+        # A call whose completion callback never arrives gives its slot back after this long
+        self.slot_timeout = slot_timeout or float(os.environ.get('DIALER_SLOT_TIMEOUT', 900))
+        # Finished jobs stay pollable this long, and at most max_jobs of them are kept
+        self.job_ttl = job_ttl or float(os.environ.get('DIALER_JOB_TTL', 3600))
+        self.max_jobs = max_jobs or int(os.environ.get('DIALER_MAX_JOBS', 100))
+
+        self.bucket = TokenBucket(calls_per_second)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.environ.get('DIALER_WORKERS', 10)),
+            thread_name_prefix='dialer'
+        )
+
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._active_calls = {}
+        self._slots = threading.Condition()
+
+    def start(self, customers, total=None):
+        """Dial a batch of customers in the background and return the job tracking it
+
+        With total (an upper bound) given, customers can be a generator such as a stream of queue
+        claims; the next customer is only pulled once a line and a rate-limit token are free.
+        """
+        if total is None:
+            customers = list(customers)
+            total = len(customers)
+        job = DialerJob(total)
+        with self._jobs_lock:
+            self._prune_jobs()
+            self.jobs[job.id] = job
+        threading.Thread(target=self._run, args=(job, customers), daemon=True).start()
+        return job
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            self._prune_jobs()
+            return self.jobs.get(job_id)
+
+    def _prune_jobs(self):
+        """Forget finished jobs past job_ttl, then the oldest finished ones beyond max_jobs"""
+        expired = time.time() - self.job_ttl
+        finished = sorted((job for job in self.jobs.values() if job.finished_at), key=lambda job: job.finished_at)
+        for number, job in enumerate(finished):
+            if job.finished_at < expired or number < len(finished) - self.max_jobs:
+                del self.jobs[job.id]
+
+    def call_finished(self, call_sid, status='completed'):
+        """Free the line held by a call once Twilio reports a terminal status"""
+        if status not in TERMINAL_STATUSES:
+            return
+        with self._slots:
+            if self._active_calls.pop(call_sid, None) is not None:
+                self._slots.notify()
+
+    def _run(self, job, customers):
+        job.status = 'running'
+        job.started_at = time.time()
+
+        customers = iter(customers)
+        submitted = 0
+        futures = []
+        while True:
+            slot = self._acquire_slot()
+            self.bucket.acquire()
+            try:
+                customer = next(customers, None)
+            except Exception as e:
+                print(f"Error fetching customers for dialer job {job.id}: {e}")
+                job.update(error=str(e))
+                customer = None
+            if customer is None:
+                self._release_slot(slot)
+                break
+            submitted += 1
+            # Only calls still being placed are kept, so a streamed campaign doesn't pile up futures
+            futures = [future for future in futures if not future.done()]
+            futures.append(self.executor.submit(self._dial, job, customer, slot))
+
+        for future in futures:
+            future.result()
+
+        # A stream can run dry before reaching its upper bound
+        job.total = submitted
+        job.finished_at = time.time()
+        job.status = 'completed'
+        print(f"Dialer job {job.id} finished: {job.dialed} dialed, {job.failed} failed")
+
+    def _acquire_slot(self):
+        """Wait until fewer than max_concurrent_calls calls are live"""
+        with self._slots:
+            while True:
+                now = time.time()
+                for call_sid in [sid for sid, expires in self._active_calls.items() if expires < now]:
+                    del self._active_calls[call_sid]
+                if len(self._active_calls) < self.max_concurrent_calls:
+                    # Hold the slot under a placeholder key until the call sid is known
+                    slot = object()
+                    self._active_calls[slot] = now + self.slot_timeout
+                    return slot
+                self._slots.wait(timeout=1)
+
+    def _dial(self, job, customer, slot):
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                call_sid = self.create_call(customer['phone_number'])
+                break
+            except Exception as e:
+                if is_transient(e) and attempts <= self.max_retries:
+                    job.update(retries=1)
+                    time.sleep(random.uniform(0, self.retry_backoff * (2 ** (attempts - 1))))
+                    # Retries still count against the calls-per-second budget
+                    self.bucket.acquire()
+                    continue
+                print(f"Error initiating call to {customer['phone_number']}: {e}")
+                job.update(failed=1, error=f"{customer['phone_number']}: {e}")
+                self._release_slot(slot)
+                if self.on_failed:
+                    try:
+                        self.on_failed(customer)
+                    except Exception as e:
+                        print(f"Error releasing customer {customer['phone_number']}: {e}")
+                return
+
+        with self._slots:
+            if self._active_calls.pop(slot, None) is not None:
+                self._active_calls[call_sid] = time.time() + self.slot_timeout
+
+        try:
+            self.record_call(call_sid, customer)
+        except Exception as e:
+            print(f"Error recording call {call_sid}: {e}")
+        job.update(dialed=1)
+
+    def _release_slot(self, slot):
+        with self._slots:
+            if self._active_calls.pop(slot, None) is not None:
+                self._slots.notify()
@@ -0,0 +1,53 @@
+import os
+
+# Production serving for the Flask webhooks: gunicorn -c gunicorn.conf.py app:app
+#
+# Turns spend almost all their time waiting on the LLM, so each worker runs a pool of threads
+# and the worker count only needs to cover the CPU-bound part. With more than one worker,
+# SESSION_STORE defaults to shared so every turn reads the call from MongoDB. Across nodes,
+# either keep it shared or run one worker per node with SESSION_AFFINITY and hash on the
+# CallSid query parameter at the load balancer.
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# One pooled LLM connection per thread, so turns never queue for a connection
+os.environ.setdefault('OPENAI_MAX_CONNECTIONS', str(threads))
+
+# Above the LLM timeout and retries, so a slow turn fails in the app rather than being killed
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 75
+
+# Recycle workers now and then so slow leaks can't build up; jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# Each worker opens its own MongoDB and HTTP pools and background threads after the fork
+preload_app = False
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def on_starting(server):
+    # Each worker has its own session cache, and gunicorn spreads a call's turns across them;
+    # checked here rather than above so --workers on the command line and --chdir count too
+    from settings import load_env
+    load_env()
+    workers = server.cfg.workers
+    if workers > 1:
+        os.environ.setdefault('SESSION_STORE', 'shared')
+        if os.environ['SESSION_STORE'].lower() != 'shared':
+            raise RuntimeError(f"SESSION_STORE={os.environ['SESSION_STORE']} keeps a call's state in one worker, "
+                               f"but there are {workers}; set SESSION_STORE=shared or WEB_CONCURRENCY=1")
+
+
+def post_worker_init(worker):
+    # Connect MongoDB, OpenAI and Twilio before this worker accepts its first request,
+    # for at most WARMUP_TIMEOUT; anything still failing is retried and reported at /ready
+    from startup import get_readiness
+    get_readiness().warm_up()
+
@@ -0,0 +1,299 @@
+import os
+import time
+import asyncio
+import random
+import threading
+from collections import deque
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+from settings import load_env
+
+# Load environment variables
+load_env()
+
+# Errors worth retrying: the request never reached the model or the provider asked us to back off
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class LatencyMetrics:
+    def __init__(self, window=1000):
+        """Keep a rolling window of per-turn LLM latencies"""
+        self._lock = threading.Lock()
+        self.turns = deque(maxlen=window)
+        self.total_requests = 0
+        self.total_errors = 0
+        self.total_retries = 0
+
+    def record(self, call_sid, model, latency_ms, attempts, error=None, usage=None):
+        """Record a single LLM round-trip"""
+        # Provider-reported prompt size and how much of it was served from the prompt cache
+        prompt_tokens = getattr(usage, 'prompt_tokens', None)
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', None)
+        with self._lock:
+            self.total_requests += 1
+            self.total_retries += attempts - 1
+            if error:
+                self.total_errors += 1
+            self.turns.append({
+                'call_sid': call_sid,
+                'model': model,
+                'latency_ms': round(latency_ms, 1),
+                'attempts': attempts,
+                'prompt_tokens': prompt_tokens,
+                'cached_tokens': cached_tokens,
+                'error': error,
+                'timestamp': time.time()
+            })
+
+    def snapshot(self, recent=20):
+        """Summarize recent latencies as percentiles"""
+        with self._lock:
+            turns = list(self.turns)
+            summary = {
+                'total_requests': self.total_requests,
+                'total_errors': self.total_errors,
+                'total_retries': self.total_retries,
+            }
+
+        latencies = sorted(t['latency_ms'] for t in turns if not t['error'])
+        if latencies:
+            summary['p50_ms'] = latencies[int(0.50 * (len(latencies) - 1))]
+            summary['p95_ms'] = latencies[int(0.95 * (len(latencies) - 1))]
+            summary['max_ms'] = latencies[-1]
+        prompt_tokens = [t['prompt_tokens'] for t in turns if t['prompt_tokens'] is not None]
+        if prompt_tokens:
+            summary['avg_prompt_tokens'] = round(sum(prompt_tokens) / len(prompt_tokens), 1)
+            summary['avg_cached_tokens'] = round(
+                sum(t['cached_tokens'] or 0 for t in turns if t['prompt_tokens'] is not None) / len(prompt_tokens), 1)
+        summary['recent_turns'] = turns[-recent:]
+        return summary
+
+
+class LLMClient:
+    def __init__(self, api_key=None, base_url=None, max_connections=None,
+                 max_keepalive_connections=None, timeout=None, max_retries=None,
+                 retry_backoff=None):
+        """Initialize a long-lived OpenAI client with a pooled keep-alive HTTP connection"""
+        self._configure(api_key, max_retries, retry_backoff)
+
+        # One connection pool for the whole process so TLS sessions are reused across turns
+        self.http_client = httpx.Client(**self._pool_options(max_connections, max_keepalive_connections, timeout))
+
+        # Retries are handled here so backoff is configurable and counted in the metrics
+        self.client = OpenAI(
+            api_key=self.api_key,
+            base_url=base_url or os.environ.get('OPENAI_BASE_URL') or None,
+            http_client=self.http_client,
+            max_retries=0
+        )
+
+    def _configure(self, api_key, max_retries, retry_backoff):
+        """Read credentials and retry settings shared by the sync and async clients"""
+        self.api_key = api_key or os.environ.get('OPENAI_API_KEY')
+        if not self.api_key:
+            print("Warning: OpenAI API key not found in environment variables")
+
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('OPENAI_MAX_RETRIES', 2))
+        self.retry_backoff = retry_backoff or float(os.environ.get('OPENAI_RETRY_BACKOFF', 0.25))
+        self.metrics = LatencyMetrics()
+
+    def _pool_options(self, max_connections, max_keepalive_connections, timeout):
+        """Connection pool limits and timeouts for the underlying httpx client"""
+        max_connections = max_connections or int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+        max_keepalive_connections = max_keepalive_connections or int(
+            os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', max_connections))
+        timeout = timeout or float(os.environ.get('OPENAI_TIMEOUT', 10.0))
+
+        return {
+            'limits': httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', 60.0))
+            ),
+            'timeout': httpx.Timeout(timeout, connect=min(timeout, 3.0))
+        }
+
+    def _backoff(self, attempts):
+        """Full jitter keeps concurrent calls from retrying in lockstep"""
+        return random.uniform(0, self.retry_backoff * (2 ** (attempts - 1)))
+
+    def _create(self, call_sid, model, start, **kwargs):
+        """Issue a completion request, retrying transient failures with exponential backoff"""
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return self.client.chat.completions.create(model=model, **kwargs), attempts
+            except RETRYABLE_ERRORS as e:
+                if attempts > self.max_retries:
+                    self.metrics.record(call_sid, model, (time.perf_counter() - start) * 1000,
+                                        attempts, error=type(e).__name__)
+                    raise
+                time.sleep(self._backoff(attempts))
+            except Exception as e:
+                self.metrics.record(call_sid, model, (time.perf_counter() - start) * 1000,
+                                    attempts, error=type(e).__name__)
+                raise
+
+    def chat(self, messages, model, call_sid=None, **kwargs):
+        """Create a chat completion on the shared connection pool"""
+        start = time.perf_counter()
+        completion, attempts = self._create(call_sid, model, start, messages=messages, **kwargs)
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.metrics.record(call_sid, model, latency_ms, attempts, usage=completion.usage)
+        print(f"LLM turn latency: {call_sid} - {model} - {latency_ms:.0f}ms ({attempts} attempt(s))")
+
+        return completion
+
+    def stream_chat(self, messages, model, call_sid=None, **kwargs):
+        """Stream a chat completion, yielding content deltas as they arrive"""
+        start = time.perf_counter()
+
+        # Only opening the stream is retried; once tokens flow a failure is surfaced to the caller
+        stream, attempts = self._create(call_sid, model, start, messages=messages, stream=True, **kwargs)
+
+        first_token_ms = None
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    yield delta
+        except Exception as e:
+            self.metrics.record(call_sid, model, (time.perf_counter() - start) * 1000,
+                                attempts, error=type(e).__name__)
+            raise
+        finally:
+            stream.close()
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.metrics.record(call_sid, model, latency_ms, attempts)
+        print(f"LLM stream latency: {call_sid} - {model} - first token {first_token_ms or 0:.0f}ms, "
+              f"total {latency_ms:.0f}ms ({attempts} attempt(s))")
+
+    def warm_up(self):
+        """Resolve DNS, finish the TLS handshake and leave a keep-alive connection in the pool"""
+        # Loads the chat completion resource, so the first turn doesn't have to
+        self.client.chat.completions
+        try:
+            self.client.models.list()
+        except openai.APIStatusError:
+            # Any HTTP response means the connection is up, even from a gateway that doesn't serve /models
+            pass
+
+    def close(self):
+        """Close the underlying connection pool"""
+        self.http_client.close()
+
+
+class AsyncLLMClient(LLMClient):
+    def __init__(self, api_key=None, base_url=None, max_connections=None,
+                 max_keepalive_connections=None, timeout=None, max_retries=None,
+                 retry_backoff=None):
+        """Initialize an asyncio OpenAI client with a pooled keep-alive HTTP connection"""
+        self._configure(api_key, max_retries, retry_backoff)
+
+        # Async serving keeps far more turns in flight per process, so the pool defaults larger
+        max_connections = max_connections or int(os.environ.get('OPENAI_ASYNC_MAX_CONNECTIONS', 200))
+        self.http_client = httpx.AsyncClient(**self._pool_options(max_connections, max_keepalive_connections, timeout))
+
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=base_url or os.environ.get('OPENAI_BASE_URL') or None,
+            http_client=self.http_client,
+            max_retries=0
+        )
+
+    async def _create(self, call_sid, model, start, **kwargs):
+        """Issue a completion request, retrying transient failures with exponential backoff"""
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return await self.client.chat.completions.create(model=model, **kwargs), attempts
+            except RETRYABLE_ERRORS as e:
+                if attempts > self.max_retries:
+                    self.metrics.record(call_sid, model, (time.perf_counter() - start) * 1000,
+                                        attempts, error=type(e).__name__)
+                    raise
+                await asyncio.sleep(self._backoff(attempts))
+            except Exception as e:
+                self.metrics.record(call_sid, model, (time.perf_counter() - start) * 1000,
+                                    attempts, error=type(e).__name__)
+                raise
+
+    async def chat(self, messages, model, call_sid=None, **kwargs):
+        """Create a chat completion without blocking the event loop"""
+        start = time.perf_counter()
+        completion, attempts = await self._create(call_sid, model, start, messages=messages, **kwargs)
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.metrics.record(call_sid, model, latency_ms, attempts, usage=completion.usage)
+        print(f"LLM turn latency: {call_sid} - {model} - {latency_ms:.0f}ms ({attempts} attempt(s))")
+
+        return completion
+
+    async def stream_chat(self, messages, model, call_sid=None, **kwargs):
+        """Stream a chat completion, yielding content deltas as they arrive"""
+        start = time.perf_counter()
+        stream, attempts = await self._create(call_sid, model, start, messages=messages, stream=True, **kwargs)
+
+        first_token_ms = None
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    yield delta
+        except Exception as e:
+            self.metrics.record(call_sid, model, (time.perf_counter() - start) * 1000,
+                                attempts, error=type(e).__name__)
+            raise
+        finally:
+            await stream.close()
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.metrics.record(call_sid, model, latency_ms, attempts)
+        print(f"LLM stream latency: {call_sid} - {model} - first token {first_token_ms or 0:.0f}ms, "
+              f"total {latency_ms:.0f}ms ({attempts} attempt(s))")
+
+    async def warm_up(self):
+        """Resolve DNS, finish the TLS handshake and leave a keep-alive connection in the pool"""
+        self.client.chat.completions
+        try:
+            await self.client.models.list()
+        except openai.APIStatusError:
+            pass
+
+    async def close(self):
+        """Close the underlying connection pool"""
+        await self.http_client.aclose()
+
+
+_llm_client = None
+_llm_client_lock = threading.Lock()
+
+
+def get_llm_client():
+    """Return the process-wide LLM client, creating it on first use"""
+    global _llm_client
+    if _llm_client is None:
+        with _llm_client_lock:
+            if _llm_client is None:
+                _llm_client = LLMClient()
+    return _llm_client
@@ -0,0 +1,49 @@
+import sys
+import argparse
+
+from database import Database
+
+def plan_stages(plan):
+    """Flatten the stage names of an explain() winning plan"""
+    # The slot-based engine nests the classic plan tree under queryPlan
+    plan = plan.get('queryPlan', plan)
+    stages = [plan['stage']] if plan.get('stage') else []
+    if 'inputStage' in plan:
+        stages.extend(plan_stages(plan['inputStage']))
+    for child in plan.get('inputStages', []):
+        stages.extend(plan_stages(child))
+    return stages
+
+def verify(db):
+    """Exit non-zero if any declared index is missing"""
+    missing = db.missing_indexes()
+    if missing:
+        print(f"Missing indexes: {', '.join(missing)}")
+        return 1
+    print("All indexes present")
+    return 0
+
+def create(db):
+    """Create any declared index that is missing"""
+    db.ensure_indexes()
+    return verify(db)
+
+def explain(db):
+    """Exit non-zero if a hot query falls back to a collection scan"""
+    status = 0
+    for name, cursor in db.hot_queries():
+        stages = plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+        # A plan we can't read stage names from proves nothing, so it fails too
+        ok = bool(stages) and 'COLLSCAN' not in stages
+        print(f"{'OK  ' if ok else 'FAIL'} {name}: {' <- '.join(stages) or 'no stages in the plan'}")
+        if not ok:
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify, create or explain the MongoDB indexes used by the calling agent")
+    parser.add_argument('command', choices=['verify', 'create', 'explain'])
+    args = parser.parse_args()
+    
+    db = Database()
+    sys.exit({'verify': verify, 'create': create, 'explain': explain}[args.command](db))
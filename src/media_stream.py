@@ -0,0 +1,344 @@
+import os
+import io
+import json
+import time
+import wave
+import base64
+import asyncio
+from collections import deque
+
+import numpy as np
+from starlette.websockets import WebSocketDisconnect
+
+from streaming import async_split_sentences
+from vad import EARLY_END, END, FRAME_MS, RESUME, Endpointer
+
+# Twilio Media Streams carry 8kHz mono G.711 mu-law in 20ms frames, base64-encoded in JSON
+SAMPLE_RATE = 8000
+FRAME_SAMPLES = 160
+
+# Outbound audio is sent in messages of up to this many bytes (500ms) rather than frame by frame
+MAX_MEDIA_BYTES = 4000
+
+ULAW_BIAS = 0x84
+ULAW_CLIP = 32635
+ULAW_SEGMENT_ENDS = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+
+
+def _build_ulaw_tables():
+    """Lookup tables for G.711 mu-law: 256 codes to int16, and every int16 to its code"""
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    magnitude = (((codes & 0x0F) << 3) + ULAW_BIAS) << exponent
+    decode = np.where(codes & 0x80, ULAW_BIAS - magnitude, magnitude - ULAW_BIAS).astype(np.int16)
+
+    # Indexed by the int16 sample reinterpreted as uint16; follows the 14-bit G.711 reference encoder
+    pcm = np.arange(65536, dtype=np.uint32).astype(np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), ULAW_CLIP >> 2) + (ULAW_BIAS >> 2)
+    segment = np.searchsorted(ULAW_SEGMENT_ENDS, magnitude)
+    code = (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F)
+    encode = ((code ^ mask) & 0xFF).astype(np.uint8)
+    return decode, encode
+
+
+_ULAW_DECODE, _ULAW_ENCODE = _build_ulaw_tables()
+
+
+def ulaw_decode(payload):
+    """mu-law bytes (or any buffer) to int16 PCM; the input is viewed, not copied"""
+    return _ULAW_DECODE[np.frombuffer(payload, dtype=np.uint8)]
+
+
+def ulaw_encode(pcm):
+    """int16 PCM to mu-law bytes"""
+    return _ULAW_ENCODE[np.asarray(pcm, dtype=np.int16).view(np.uint16)].tobytes()
+
+
+class WhisperASR:
+    def __init__(self, llm, model=None, max_seconds=30):
+        """Transcribe each utterance with the OpenAI transcription API once it ends"""
+        self.client = llm.client
+        self.model = model or os.environ.get('ASR_MODEL', 'whisper-1')
+        self.max_samples = max_seconds * SAMPLE_RATE
+
+    def start(self, call_sid):
+        return WhisperUtterance(self, call_sid)
+
+
+class WhisperUtterance:
+    def __init__(self, asr, call_sid):
+        """Audio of one utterance, accumulated in a preallocated buffer"""
+        self.asr = asr
+        self.call_sid = call_sid
+        self.buffer = np.empty(asr.max_samples, dtype=np.int16)
+        self.samples = 0
+
+    def feed(self, pcm):
+        count = min(len(pcm), len(self.buffer) - self.samples)
+        self.buffer[self.samples:self.samples + count] = pcm[:count]
+        self.samples += count
+
+    async def finish(self):
+        """Transcript of everything fed so far"""
+        wav = io.BytesIO()
+        with wave.open(wav, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(memoryview(self.buffer[:self.samples]))
+        transcription = await self.asr.client.audio.transcriptions.create(
+            model=self.asr.model,
+            file=('utterance.wav', wav.getvalue(), 'audio/wav')
+        )
+        return transcription.text
+
+
+class LLMReplyStage:
+    def __init__(self, llm, context, model="gpt-3.5-turbo", max_tokens=150):
+        """Stream the reply to an utterance sentence by sentence"""
+        self.llm = llm
+        self.context = context
+        self.model = model
+        self.max_tokens = max_tokens
+
+    async def reply(self, state, text):
+        messages, prompt_tokens = self.context.build(state, [{"role": "user", "content": text}])
+        print(f"Prompt tokens: {state['call_sid']} - {prompt_tokens}")
+        tokens = self.llm.stream_chat(model=self.model, call_sid=state['call_sid'], messages=messages,
+                                      max_tokens=self.max_tokens)
+        async for sentence in async_split_sentences(tokens):
+            yield sentence
+
+
+class EdgeTTSStage:
+    def __init__(self, tts):
+        """Stream Edge TTS audio as 8kHz PCM, transcoding its mp3 output through ffmpeg"""
+        self.tts = tts
+
+    async def synthesize(self, text):
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-loglevel', 'error', '-f', 'mp3', '-i', 'pipe:0',
+            '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1',
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+
+        async def feed():
+            try:
+                async for chunk in self.tts.stream_audio(text):
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            finally:
+                process.stdin.close()
+
+        feeder = asyncio.create_task(feed())
+        leftover = b''
+        try:
+            while True:
+                data = await process.stdout.read(3200)
+                if not data:
+                    break
+                data = leftover + data
+                # Keep an odd trailing byte for the next read so samples stay aligned
+                usable = len(data) & ~1
+                leftover = data[usable:]
+                yield np.frombuffer(data, dtype=np.int16, count=usable // 2)
+            await feeder
+        finally:
+            feeder.cancel()
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+
+
+class MediaPipeline:
+    def __init__(self, asr, llm, tts, on_turn=None, barge_in_ms=None, **endpointer_options):
+        """Voice pipeline for Twilio Media Streams: ASR -> LLM -> TTS with barge-in
+
+        Stages are pluggable: asr.start(call_sid) returns an utterance with feed(pcm) and
+        async finish() -> text of the audio so far; llm.reply(state, text) yields sentences;
+        tts.synthesize(text) yields int16 8kHz PCM chunks. on_turn(call_sid, messages) is
+        awaited for each turn. endpointer_options are passed to each call's vad.Endpointer.
+        """
+        self.asr = asr
+        self.llm = llm
+        self.tts = tts
+        self.on_turn = on_turn
+        self.endpointer_options = endpointer_options
+
+        barge_in_ms = barge_in_ms or int(os.environ.get('MEDIA_STREAM_BARGE_IN_MS', 200))
+        self.barge_in_frames = max(1, barge_in_ms // FRAME_MS)
+
+        self.stats = {'sessions': 0, 'turns': 0, 'barge_ins': 0, 'speculations': 0, 'speculations_discarded': 0,
+                      'response_latency_ms': deque(maxlen=200)}
+
+    async def handle(self, websocket):
+        """Run one call's media stream until Twilio stops it or the socket closes"""
+        await websocket.accept()
+        self.stats['sessions'] += 1
+        await MediaStreamSession(self, websocket).run()
+
+    def snapshot(self):
+        latencies = sorted(self.stats['response_latency_ms'])
+        return {
+            **{name: value for name, value in self.stats.items() if name != 'response_latency_ms'},
+            'p50_response_latency_ms': round(latencies[len(latencies) // 2], 1) if latencies else 0.0
+        }
+
+
+class MediaStreamSession:
+    def __init__(self, pipeline, websocket):
+        """State of one call's media stream"""
+        self.pipeline = pipeline
+        self.websocket = websocket
+        self.stream_sid = None
+        self.state = {'call_sid': None, 'history': []}
+
+        self.endpointer = Endpointer(**pipeline.endpointer_options)
+        # Recent frames, so an utterance includes the speech that triggered it
+        self.preroll = deque(maxlen=max(pipeline.barge_in_frames, self.endpointer.min_speech_frames))
+        self.utterance = None
+        self.speech_ended_at = None
+
+        self.response = None
+        # Set once the endpoint is final; a reply started on an early endpoint holds its audio until then
+        self.confirmed = None
+        self.pending_marks = set()
+        self.mark_count = 0
+
+    async def run(self):
+        try:
+            while True:
+                message = json.loads(await self.websocket.receive_text())
+                event = message.get('event')
+                if event == 'start':
+                    self.stream_sid = message['start']['streamSid']
+                    self.state['call_sid'] = message['start'].get('callSid')
+                    print(f"Media stream started: {self.state['call_sid']}")
+                elif event == 'media':
+                    await self._on_audio(ulaw_decode(base64.b64decode(message['media']['payload'])))
+                elif event == 'mark':
+                    self.pending_marks.discard(message['mark']['name'])
+                elif event == 'stop':
+                    break
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if self.response is not None:
+                self.response.cancel()
+            print(f"Media stream ended: {self.state['call_sid']}")
+
+    def speaking(self):
+        """Whether a reply is being generated or is still queued for playback at Twilio"""
+        return (self.response is not None and not self.response.done()) or bool(self.pending_marks)
+
+    async def _on_audio(self, pcm):
+        pipeline = self.pipeline
+        event = self.endpointer.process(pcm)
+
+        if self.utterance is None:
+            self.preroll.append(pcm)
+            if not self.endpointer.in_speech:
+                return
+            if self.speaking():
+                # The caller has to keep talking for a moment before playback is interrupted
+                if self.endpointer.speech_run < pipeline.barge_in_frames:
+                    return
+                await self._barge_in()
+            self.utterance = pipeline.asr.start(self.state['call_sid'])
+            self.confirmed = None
+            for frame in self.preroll:
+                self.utterance.feed(frame)
+            self.preroll.clear()
+            return
+
+        self.utterance.feed(pcm)
+        if event == EARLY_END:
+            # Start transcribing and generating now; the audio waits for the final endpoint
+            self.speech_ended_at = time.perf_counter() - self.endpointer.silence_run * FRAME_MS / 1000
+            self.confirmed = asyncio.Event()
+            self.response = asyncio.create_task(self._respond(self.utterance, self.confirmed))
+            pipeline.stats['speculations'] += 1
+        elif event == RESUME and self.confirmed is not None:
+            # The caller kept talking: throw the speculative reply away
+            self.response.cancel()
+            self.response = self.confirmed = None
+            pipeline.stats['speculations_discarded'] += 1
+        elif event == END:
+            if self.confirmed is None:
+                self.speech_ended_at = time.perf_counter() - self.endpointer.silence_run * FRAME_MS / 1000
+                self.confirmed = asyncio.Event()
+                self.response = asyncio.create_task(self._respond(self.utterance, self.confirmed))
+            self.confirmed.set()
+            self.utterance = None
+
+    async def _barge_in(self):
+        """Stop generating and tell Twilio to drop the audio it has buffered"""
+        if self.response is not None:
+            self.response.cancel()
+        self.pending_marks.clear()
+        await self.websocket.send_text(json.dumps({'event': 'clear', 'streamSid': self.stream_sid}))
+        self.pipeline.stats['barge_ins'] += 1
+        print(f"Barge-in: {self.state['call_sid']}")
+
+    async def _respond(self, utterance, confirmed):
+        pipeline = self.pipeline
+        try:
+            text = (await utterance.finish()).strip()
+        except Exception as e:
+            print(f"Error transcribing utterance for {self.state['call_sid']}: {e}")
+            return
+        if not text:
+            return
+
+        spoken = []
+        held = []
+        try:
+            async for sentence in pipeline.llm.reply(self.state, text):
+                spoken.append(sentence)
+                async for pcm in pipeline.tts.synthesize(sentence):
+                    held.append(pcm)
+                    if confirmed.is_set():
+                        await self._play(held)
+                await confirmed.wait()
+                await self._play(held)
+                await self._send_mark()
+        except Exception as e:
+            print(f"Error responding on media stream {self.state['call_sid']}: {e}")
+        finally:
+            # A discarded speculative reply was never heard, so it isn't part of the conversation;
+            # a reply the caller cut short is recorded as far as it got
+            if confirmed.is_set():
+                print(f"Customer input: {text}")
+                turn = [{"role": "user", "content": text}]
+                if spoken:
+                    turn.append({"role": "assistant", "content": ' '.join(spoken)})
+                self.state['history'].extend(turn)
+                pipeline.stats['turns'] += 1
+                if pipeline.on_turn:
+                    asyncio.ensure_future(pipeline.on_turn(self.state['call_sid'], turn))
+
+    async def _play(self, held):
+        """Send the audio held so far and empty the list"""
+        for pcm in held:
+            if self.speech_ended_at is not None:
+                self.pipeline.stats['response_latency_ms'].append((time.perf_counter() - self.speech_ended_at) * 1000)
+                self.speech_ended_at = None
+            await self._send_audio(pcm)
+        held.clear()
+
+    async def _send_audio(self, pcm):
+        audio = memoryview(ulaw_encode(pcm))
+        for start in range(0, len(audio), MAX_MEDIA_BYTES):
+            await self.websocket.send_text(json.dumps({
+                'event': 'media',
+                'streamSid': self.stream_sid,
+                'media': {'payload': base64.b64encode(audio[start:start + MAX_MEDIA_BYTES]).decode()}
+            }))
+
+    async def _send_mark(self):
+        """Ask Twilio to report back when playback reaches this point"""
+        self.mark_count += 1
+        name = f"reply-{self.mark_count}"
+        self.pending_marks.add(name)
+        await self.websocket.send_text(json.dumps({'event': 'mark', 'streamSid': self.stream_sid, 'mark': {'name': name}}))
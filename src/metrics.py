@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from settings import load_env
+
+# Load environment variables
+load_env()
+
+# Bucket upper bounds in seconds, fine enough for sub-millisecond bookkeeping and multi-second LLM calls
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+# Twilio's callback Timestamp has one-second resolution
+CALLBACK_LAG_BUCKETS = (0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0)
+# From a call's completed callback to its outcome being written
+POST_CALL_LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Fixed-bucket histogram; observing is one bisect and two additions"""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class TurnTimer:
+    __slots__ = ('metrics', 'call_sid', 'turn', 'started', 'stages', 'finished')
+
+    def __init__(self, metrics, call_sid, turn=None):
+        """Stage timings for one conversational turn"""
+        self.metrics = metrics
+        self.call_sid = call_sid
+        self.turn = turn
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.finished = False
+
+    def stage(self, name):
+        """Context manager that times one stage of the turn"""
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        if self.finished:
+            # Work that outlives the webhook, e.g. the rest of a streamed reply
+            self.metrics.observe_stage(name, seconds)
+            return
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def stream(self, name, tokens):
+        """Pass a token stream through, timing the first token and the whole stream"""
+        start = time.perf_counter()
+        first = True
+        for token in tokens:
+            if first:
+                self.add(f"{name}_ttft", time.perf_counter() - start)
+                first = False
+            yield token
+        self.add(f"{name}_total", time.perf_counter() - start)
+
+    def finish(self, **fields):
+        """Record the turn; fields (turn index, model, cache hit, ...) go into the turn log only"""
+        if not self.finished:
+            self.finished = True
+            self.metrics.record_turn(self, time.perf_counter() - self.started, fields)
+
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTurnTimer:
+    """Stands in for TurnTimer when metrics are off; one instance is shared by every call"""
+    __slots__ = ()
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def add(self, name, seconds):
+        pass
+
+    def stream(self, name, tokens):
+        return tokens
+
+    def finish(self, **fields):
+        pass
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+_NULL_TIMER = _NullTurnTimer()
+
+
+class Metrics:
+    def __init__(self, enabled=None, turn_log=None, recent=200):
+        """Per-stage turn latency histograms and Twilio callback lag, exported for Prometheus
+
+        Histograms are labelled by stage only; call_sid and turn index go into the recent-turns
+        buffer and, with turn_log (METRICS_TURN_LOG), one JSON line per turn.
+        """
+        self.enabled = enabled if enabled is not None else os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+        self.turn_log = turn_log if turn_log is not None else os.environ.get('METRICS_TURN_LOG', 'false').lower() == 'true'
+
+        self._lock = threading.Lock()
+        self.turn_seconds = Histogram()
+        self.stage_seconds = {}
+        self.callback_lag = {}
+        self.post_call_lag = Histogram(POST_CALL_LAG_BUCKETS)
+        self.gauges = {}
+        self.turns_total = 0
+        self.recent_turns = deque(maxlen=recent)
+
+    def turn(self, call_sid, turn=None):
+        """Start timing a turn"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return TurnTimer(self, call_sid, turn)
+
+    def observe_stage(self, name, seconds):
+        with self._lock:
+            histogram = self.stage_seconds.get(name)
+            if histogram is None:
+                histogram = self.stage_seconds[name] = Histogram()
+            histogram.observe(seconds)
+
+    def record_turn(self, timer, seconds, fields):
+        with self._lock:
+            self.turns_total += 1
+            self.turn_seconds.observe(seconds)
+            # A streamed reply's thread may still be adding stages
+            stages = dict(timer.stages)
+            for name, value in stages.items():
+                histogram = self.stage_seconds.get(name)
+                if histogram is None:
+                    histogram = self.stage_seconds[name] = Histogram()
+                histogram.observe(value)
+            record = {
+                'call_sid': timer.call_sid,
+                # The turn index is often only known once the session is loaded, so it comes with finish()
+                'turn': fields.pop('turn', timer.turn),
+                'total_ms': round(seconds * 1000, 2),
+                'stages_ms': {name: round(value * 1000, 2) for name, value in stages.items()},
+                **fields
+            }
+            self.recent_turns.append(record)
+        if self.turn_log:
+            print(json.dumps({'event': 'turn', **record}))
+
+    def record_callback(self, status, timestamp):
+        """Lag between Twilio's callback Timestamp (RFC 2822) and its arrival here"""
+        if not self.enabled or not timestamp:
+            return None
+        try:
+            sent_at = parsedate_to_datetime(timestamp).timestamp()
+        except (TypeError, ValueError):
+            return None
+        lag = max(0.0, time.time() - sent_at)
+        with self._lock:
+            histogram = self.callback_lag.get(status)
+            if histogram is None:
+                histogram = self.callback_lag[status] = Histogram(CALLBACK_LAG_BUCKETS)
+            histogram.observe(lag)
+        return lag
+
+    def observe_post_call_lag(self, seconds):
+        if self.enabled:
+            with self._lock:
+                self.post_call_lag.observe(seconds)
+
+    def gauge(self, name, help_text, read):
+        """Export read() at every scrape, e.g. a queue depth"""
+        with self._lock:
+            self.gauges[name] = (help_text, read)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += ['# HELP call_turns_total Conversational turns handled',
+                      '# TYPE call_turns_total counter',
+                      f"call_turns_total {self.turns_total}"]
+            lines += _render_histogram('call_turn_seconds', 'Webhook time per conversational turn',
+                                       {'': self.turn_seconds})
+            lines += _render_histogram('call_turn_stage_seconds', 'Time per stage of a turn',
+                                       self.stage_seconds, 'stage')
+            lines += _render_histogram('twilio_callback_lag_seconds', 'Delay between a Twilio status callback and its arrival',
+                                       self.callback_lag, 'status')
+            lines += _render_histogram('post_call_lag_seconds', 'Delay between a completed call and its processed outcome',
+                                       {'': self.post_call_lag})
+            gauges = dict(self.gauges)
+        # Gauges may read a database, so not under the lock
+        for name, (help_text, read) in sorted(gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """p50/p95 per stage and the most recent turns"""
+        with self._lock:
+            stages = {name: {'count': h.count, 'p50_ms': _ms(h.quantile(0.5)), 'p95_ms': _ms(h.quantile(0.95)),
+                             'avg_ms': round(h.sum / h.count * 1000, 2)}
+                      for name, h in self.stage_seconds.items() if h.count}
+            return {
+                'turns': self.turns_total,
+                'turn_p50_ms': _ms(self.turn_seconds.quantile(0.5)),
+                'turn_p95_ms': _ms(self.turn_seconds.quantile(0.95)),
+                'stages': stages,
+                'recent_turns': list(self.recent_turns)[-20:]
+            }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def _render_histogram(name, help_text, histograms, label=None):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for label_value, histogram in sorted(histograms.items()):
+        labels = f'{label}="{label_value}",' if label else ''
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+        suffix = f"{{{labels.rstrip(',')}}}" if label else ''
+        lines.append(f"{name}_sum{suffix} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Process-wide metrics registry shared by the webhooks and AIAgent"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,331 @@
+import os
+import time
+import queue
+import asyncio
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import load_env
+
+# Load environment variables
+load_env()
+
+
+class DeadlineExceeded(TimeoutError):
+    """No model started answering before the turn's deadline"""
+
+
+class ModelStats:
+    def __init__(self, window=200):
+        """Rolling time-to-first-token per model, and how often each was asked, hedged and won"""
+        self.window = window
+        self._lock = threading.Lock()
+        self._first_token = {}
+        self.counts = {}
+
+    def observe(self, model, seconds):
+        with self._lock:
+            samples = self._first_token.get(model)
+            if samples is None:
+                samples = self._first_token[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def count(self, model, name):
+        with self._lock:
+            counts = self.counts.setdefault(model, {})
+            counts[name] = counts.get(name, 0) + 1
+
+    def quantile(self, model, q, min_samples=20):
+        """The q-quantile of a model's recent time to first token, or None with too few samples"""
+        with self._lock:
+            samples = sorted(self._first_token.get(model, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self):
+        with self._lock:
+            models = set(self._first_token) | set(self.counts)
+            counts = {model: dict(self.counts.get(model, {})) for model in models}
+        return {model: {**counts[model],
+                        'first_token_p50_ms': _ms(self.quantile(model, 0.5, 1)),
+                        'first_token_p95_ms': _ms(self.quantile(model, 0.95, 1))}
+                for model in sorted(models)}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class _Attempt:
+    def __init__(self, model):
+        self.model = model
+        self.cancelled = threading.Event()
+        self.started = time.perf_counter()
+
+
+class ModelRouter:
+    def __init__(self, llm, primary=None, fallback=None, deadline=None, hedge_quantile=None,
+                 hedge_delay=None, min_hedge_delay=None, hedge_budget=None, probe_rate=None, workers=None):
+        """Streams a reply from the primary model, hedged with a faster fallback when the primary is slow
+
+        If the primary hasn't produced a token by its recent p95 time to first token (or by
+        hedge_delay, whichever is sooner), the same request goes to the fallback; whichever
+        model answers first is used and the other's stream is closed. At most hedge_budget of
+        recent turns are hedged, so an overloaded provider isn't sent even more. A primary whose p95 is
+        past the deadline while the fallback's isn't is asked second instead of first, except on
+        probe_rate of turns that keep its stats fresh. An empty fallback turns hedging off.
+        """
+        self.llm = llm
+        self.primary = primary or os.environ.get('LLM_PRIMARY_MODEL', 'gpt-3.5-turbo')
+        self.fallback = fallback if fallback is not None else os.environ.get('LLM_FALLBACK_MODEL', 'gpt-4o-mini')
+        # No model to answer by then fails the turn with DeadlineExceeded
+        self.deadline = deadline or float(os.environ.get('LLM_TURN_DEADLINE', 6.0))
+        self.hedge_quantile = hedge_quantile or float(os.environ.get('LLM_HEDGE_QUANTILE', 0.95))
+        # The longest wait before hedging: a p95 inside a fat tail would leave the caller in silence
+        self.hedge_delay = hedge_delay or float(os.environ.get('LLM_HEDGE_DELAY', 1.5))
+        self.min_hedge_delay = min_hedge_delay or float(os.environ.get('LLM_MIN_HEDGE_DELAY', 0.2))
+        self.hedge_budget = hedge_budget if hedge_budget is not None else float(os.environ.get('LLM_HEDGE_BUDGET', 0.05))
+        self.probe_rate = probe_rate if probe_rate is not None else float(os.environ.get('LLM_PROBE_RATE', 0.05))
+        # Each turn in flight holds one or two threads: the request and, past the p95, its hedge
+        self.executor = ThreadPoolExecutor(max_workers=workers or int(os.environ.get('LLM_ROUTER_WORKERS', 64)),
+                                           thread_name_prefix='llm-router')
+        self.stats = ModelStats()
+        # Whether each recent turn was hedged, for the hedge budget
+        self._hedged = deque(maxlen=200)
+
+    def route(self):
+        """The model to ask first and the one to hedge with (None without a fallback)"""
+        if not self.fallback:
+            return self.primary, None
+        primary_p95 = self.stats.quantile(self.primary, self.hedge_quantile)
+        fallback_p95 = self.stats.quantile(self.fallback, self.hedge_quantile)
+        if (primary_p95 is not None and fallback_p95 is not None and primary_p95 > self.deadline
+                and fallback_p95 < primary_p95 and random.random() >= self.probe_rate):
+            return self.fallback, self.primary
+        return self.primary, self.fallback
+
+    def hedge_after(self, model):
+        """Seconds to wait for a model's first token before hedging: its recent p95, at most hedge_delay"""
+        p95 = self.stats.quantile(model, self.hedge_quantile)
+        if p95 is None:
+            return self.hedge_delay
+        return min(max(p95, self.min_hedge_delay), self.hedge_delay)
+
+    def can_hedge(self):
+        """True while hedged turns are within the budget"""
+        recent = list(self._hedged)
+        return sum(recent) < self.hedge_budget * max(len(recent), 20)
+
+    def stream_chat(self, messages, call_sid=None, **kwargs):
+        """Yield the reply's tokens from whichever model starts answering first"""
+        return self.generate(messages, call_sid, stream=True, **kwargs)
+
+    def chat(self, messages, call_sid=None, **kwargs):
+        """The whole reply as text, from whichever model answers first"""
+        return ''.join(self.generate(messages, call_sid, stream=False, **kwargs))
+
+    def generate(self, messages, call_sid=None, stream=True, **kwargs):
+        """Yield the reply from whichever model answers first
+
+        With stream=False each model is asked for a plain completion, which costs less to
+        receive than a stream of chunks; the whole reply then counts as its first token and
+        is yielded at once. A losing completion can't be interrupted, so it is discarded
+        when it arrives.
+        """
+        start = time.perf_counter()
+        first, second = self.route()
+        events = queue.Queue()
+        request = (events, messages, call_sid, stream, kwargs)
+        attempts = [self._start(first, *request)]
+        hedge_at = start + self.hedge_after(first)
+        deadline_at = start + self.deadline
+        over_budget = False
+        failed = 0
+        error = None
+
+        winner = None
+        token = None
+        try:
+            while winner is None:
+                now = time.perf_counter()
+                if now >= deadline_at:
+                    self.stats.count(first, 'deadline_missed')
+                    raise DeadlineExceeded(f"No reply from {', '.join(a.model for a in attempts)} "
+                                           f"within {self.deadline:.1f}s")
+                hedge = second is not None and len(attempts) == 1 and not over_budget
+                wait = min(deadline_at, hedge_at) - now if hedge else deadline_at - now
+                try:
+                    attempt, kind, value = events.get(timeout=max(wait, 0.001))
+                except queue.Empty:
+                    if hedge and time.perf_counter() >= hedge_at:
+                        if self.can_hedge():
+                            self.stats.count(first, 'hedged')
+                            attempts.append(self._start(second, *request))
+                        else:
+                            self.stats.count(first, 'over_budget')
+                            over_budget = True
+                    continue
+                if kind == 'token':
+                    winner, token = attempt, value
+                elif kind == 'error':
+                    failed += 1
+                    error = value
+                    if failed == len(attempts):
+                        if second is None or len(attempts) == 2:
+                            raise error
+                        # The first model failed outright: go to the fallback without waiting
+                        self.stats.count(first, 'failed_over')
+                        attempts.append(self._start(second, *request))
+                elif kind == 'done':
+                    # Finished without a single token; an empty reply is still an answer
+                    winner = attempt
+        finally:
+            self._hedged.append(len(attempts) > 1)
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancelled.set()
+
+        self.stats.count(winner.model, 'won')
+        if token is None:
+            return
+        try:
+            yield token
+            while True:
+                attempt, kind, value = events.get()
+                if attempt is not winner:
+                    continue
+                if kind == 'token':
+                    yield value
+                elif kind == 'error':
+                    raise value
+                else:
+                    return
+        finally:
+            # Set when the caller stops reading early too, which closes the winner's stream
+            winner.cancelled.set()
+
+    def _start(self, model, events, messages, call_sid, stream, kwargs):
+        attempt = _Attempt(model)
+        self.stats.count(model, 'requests')
+        self.executor.submit(self._run, attempt, events, messages, call_sid, stream, kwargs)
+        return attempt
+
+    def _complete(self, model, messages, call_sid, kwargs):
+        completion = self.llm.chat(model=model, call_sid=call_sid, messages=messages, **kwargs)
+        yield completion.choices[0].message.content or ''
+
+    def _run(self, attempt, events, messages, call_sid, stream, kwargs):
+        if stream:
+            tokens = self.llm.stream_chat(model=attempt.model, call_sid=call_sid, messages=messages, **kwargs)
+        else:
+            tokens = self._complete(attempt.model, messages, call_sid, kwargs)
+        first = True
+        try:
+            for token in tokens:
+                if first:
+                    # Losers are timed too: a request can't be interrupted before its first chunk arrives
+                    self.stats.observe(attempt.model, time.perf_counter() - attempt.started)
+                    first = False
+                if attempt.cancelled.is_set():
+                    self.stats.count(attempt.model, 'cancelled')
+                    return
+                events.put((attempt, 'token', token))
+            events.put((attempt, 'done', None))
+        except Exception as e:
+            self.stats.count(attempt.model, 'errors')
+            events.put((attempt, 'error', e))
+        finally:
+            # Closes the HTTP stream, so a cancelled model stops generating
+            tokens.close()
+
+    def snapshot(self):
+        """Per-model time to first token, requests, hedges, wins, cancellations and errors"""
+        first, second = self.route()
+        return {
+            'primary': self.primary,
+            'fallback': self.fallback or None,
+            'routing': [model for model in (first, second) if model],
+            'deadline_seconds': self.deadline,
+            'hedge_after_ms': _ms(self.hedge_after(first)),
+            'models': self.stats.snapshot()
+        }
+
+
+class AsyncModelRouter(ModelRouter):
+    def __init__(self, llm, **kwargs):
+        """ModelRouter for the async server: an AsyncLLMClient raced with tasks instead of threads
+
+        Routing, hedging, the hedge budget and the deadline are the same. Replies are
+        complete, and a losing request is cancelled outright rather than discarded on arrival.
+        """
+        super().__init__(llm, **kwargs)
+
+    async def chat(self, messages, call_sid=None, **kwargs):
+        """The whole reply as text, from whichever model answers first"""
+        start = time.perf_counter()
+        first, second = self.route()
+        attempts = {self._start_task(first, messages, call_sid, kwargs): first}
+        hedge_at = start + self.hedge_after(first)
+        deadline_at = start + self.deadline
+        tried = 1
+        over_budget = False
+
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= deadline_at:
+                    self.stats.count(first, 'deadline_missed')
+                    raise DeadlineExceeded(f"No reply from {', '.join(attempts.values())} "
+                                           f"within {self.deadline:.1f}s")
+                hedge = second is not None and tried == 1 and not over_budget
+                wait = min(deadline_at, hedge_at) - now if hedge else deadline_at - now
+                done, _ = await asyncio.wait(attempts, timeout=max(wait, 0.001),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge and time.perf_counter() >= hedge_at:
+                        if self.can_hedge():
+                            self.stats.count(first, 'hedged')
+                            attempts[self._start_task(second, messages, call_sid, kwargs)] = second
+                            tried += 1
+                        else:
+                            self.stats.count(first, 'over_budget')
+                            over_budget = True
+                    continue
+                for task in done:
+                    model = attempts.pop(task)
+                    if task.exception() is None:
+                        self.stats.count(model, 'won')
+                        return task.result()
+                    error = task.exception()
+                if not attempts:
+                    if second is None or tried == 2:
+                        raise error
+                    # The first model failed outright: go to the fallback without waiting
+                    self.stats.count(first, 'failed_over')
+                    attempts[self._start_task(second, messages, call_sid, kwargs)] = second
+                    tried += 1
+        finally:
+            self._hedged.append(tried > 1)
+            # Cancelling the loser closes its HTTP request, so it stops generating
+            for task in attempts:
+                task.cancel()
+
+    def _start_task(self, model, messages, call_sid, kwargs):
+        self.stats.count(model, 'requests')
+        return asyncio.ensure_future(self._complete_async(model, messages, call_sid, kwargs))
+
+    async def _complete_async(self, model, messages, call_sid, kwargs):
+        started = time.perf_counter()
+        try:
+            completion = await self.llm.chat(model=model, call_sid=call_sid, messages=messages, **kwargs)
+        except asyncio.CancelledError:
+            self.stats.count(model, 'cancelled')
+            raise
+        except Exception:
+            self.stats.count(model, 'errors')
+            raise
+        self.stats.observe(model, time.perf_counter() - started)
+        return completion.choices[0].message.content or ''
@@ -0,0 +1,259 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from metrics import get_metrics
+from settings import load_env
+from startup import Lazy
+
+# Load environment variables
+load_env()
+
+# Answers the extraction gives when there is nothing to record
+EMPTY_ANSWERS = {'', 'none', 'no', 'n/a', 'na', 'null', 'unknown'}
+
+
+def call_outcome(customer_responses):
+    """Outcome of a call from the interest level extracted during it"""
+    interest = (customer_responses or {}).get('interest_level')
+    if interest is None:
+        return 'unknown'
+    if interest == 'high':
+        return 'potential_sale'
+    if interest == 'medium':
+        return 'follow_up'
+    return 'not_interested'
+
+
+def _key(value):
+    """A free-text answer as a MongoDB field name: lowercase words joined by underscores"""
+    return re.sub(r'[^a-z0-9]+', '_', str(value).lower()).strip('_')[:60] or 'other'
+
+
+def _answers(value):
+    """A field the extraction returned as a string or a list, as a list of non-empty answers"""
+    values = value if isinstance(value, list) else re.split(r'[;,]', value) if isinstance(value, str) else []
+    return [value for value in values if str(value).strip().lower() not in EMPTY_ANSWERS]
+
+
+def count_call(increments, outcome, customer_responses):
+    """Add one call to increments ({field: n}), so analytics are kept up to date without rescanning calls"""
+    def add(field):
+        increments[field] = increments.get(field, 0) + 1
+
+    add('calls')
+    add(f"outcome.{outcome}")
+    add(f"interest.{_key(customer_responses.get('interest_level') or 'unknown')}")
+    for objection in _answers(customer_responses.get('objections')):
+        add(f"objections.{_key(objection)}")
+    for preference in _answers(customer_responses.get('contact_preference')):
+        add(f"contact_preference.{_key(preference)}")
+    if _answers(customer_responses.get('callback_time')):
+        add('callbacks_requested')
+
+
+def analytics_buckets(completed_at):
+    """Counter documents a call adds to: all time, and the UTC day it completed"""
+    return ['all', 'day:' + datetime.fromtimestamp(completed_at, timezone.utc).strftime('%Y-%m-%d')]
+
+
+class JobQueue:
+    def __init__(self, path=None, lease_seconds=None):
+        """Durable local queue of finished calls waiting for post-call processing, in SQLite
+
+        Jobs survive restarts, and gunicorn workers on the same host share the file. Taking a job
+        leases it by moving available_at past the lease, so jobs held by a process that dies are
+        taken again once the lease runs out.
+        """
+        self.path = path or os.environ.get('POST_CALL_QUEUE_PATH', 'post_call_queue.db')
+        self.lease_seconds = lease_seconds or float(os.environ.get('POST_CALL_LEASE_SECONDS', 60))
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        # WAL keeps enqueues from waiting on workers; NORMAL survives a process crash, not a power cut
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                call_sid TEXT NOT NULL UNIQUE,
+                enqueued_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS jobs_due ON jobs (failed, available_at)')
+
+    def put(self, call_sid, enqueued_at=None):
+        """Queue a call; a call that is already queued (e.g. a retried callback) is not added twice"""
+        enqueued_at = enqueued_at or time.time()
+        with self._lock:
+            self._connection.execute('INSERT OR IGNORE INTO jobs (call_sid, enqueued_at, available_at) VALUES (?, ?, ?)',
+                                     (call_sid, enqueued_at, enqueued_at))
+
+    def take(self, limit):
+        """Lease up to limit due jobs, oldest first, as dicts"""
+        now = time.time()
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._connection.execute(
+                    'SELECT id, call_sid, enqueued_at, attempts FROM jobs WHERE failed = 0 AND available_at <= ? '
+                    'ORDER BY available_at LIMIT ?', (now, limit)).fetchall()
+                self._connection.executemany('UPDATE jobs SET available_at = ? WHERE id = ?',
+                                             [(now + self.lease_seconds, row[0]) for row in rows])
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+        return [{'id': row[0], 'call_sid': row[1], 'enqueued_at': row[2], 'attempts': row[3]} for row in rows]
+
+    def ack(self, jobs):
+        """Drop jobs that have been processed"""
+        with self._lock:
+            self._connection.executemany('DELETE FROM jobs WHERE id = ?', [(job['id'],) for job in jobs])
+
+    def retry(self, jobs, error, max_attempts):
+        """Put jobs back with exponential backoff; a job out of attempts is kept, marked failed"""
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                'UPDATE jobs SET attempts = ?, available_at = ?, failed = ?, error = ? WHERE id = ?',
+                [(job['attempts'] + 1, now + min(300, 2 ** job['attempts']), int(job['attempts'] + 1 >= max_attempts),
+                  error[:500], job['id']) for job in jobs])
+
+    def depth(self):
+        """Jobs waiting or in progress, jobs that ran out of attempts, and the oldest job's enqueue time"""
+        with self._lock:
+            waiting, oldest = self._connection.execute(
+                'SELECT COUNT(*), MIN(enqueued_at) FROM jobs WHERE failed = 0').fetchone()
+            failed = self._connection.execute('SELECT COUNT(*) FROM jobs WHERE failed = 1').fetchone()[0]
+        return waiting, failed, oldest
+
+
+class PostCallPipeline:
+    def __init__(self, load_calls, save, on_processed=None, queue=None, workers=None, batch_size=None,
+                 batch_wait=None, max_attempts=None):
+        """Background workers that turn finished calls into outcomes, customer updates and analytics
+
+        load_calls(call_sids) returns {call_sid: call} for the calls not processed yet;
+        save(results, increments) writes a batch's outcomes and customer updates, and adds
+        increments ({call_sid: {bucket: {field: n}}}) to the analytics counters;
+        on_processed(call), if given, runs for each call afterwards (e.g. scheduling a callback).
+        """
+        self.load_calls = load_calls
+        self.save = save
+        self.on_processed = on_processed
+        # The SQLite file is opened on first use, not at import
+        self.queue = queue or Lazy(JobQueue)
+        self.workers = workers or int(os.environ.get('POST_CALL_WORKERS', 2))
+        self.batch_size = batch_size or int(os.environ.get('POST_CALL_BATCH_SIZE', 50))
+        # Waiting a moment after a wake-up lets a burst of completed calls share one batch of writes
+        self.batch_wait = batch_wait if batch_wait is not None else float(os.environ.get('POST_CALL_BATCH_WAIT', 0.5))
+        self.max_attempts = max_attempts or int(os.environ.get('POST_CALL_MAX_ATTEMPTS', 8))
+        self.poll_interval = 5.0
+
+        self.metrics = get_metrics()
+        self.stats = {'enqueued': 0, 'processed': 0, 'skipped': 0, 'batches': 0, 'retries': 0}
+        self.recent_lag = deque(maxlen=500)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Start the workers, if they aren't running; jobs left from a previous run are picked up"""
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [threading.Thread(target=self._run, name=f"post-call-{number}", daemon=True)
+                             for number in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def enqueue(self, call_sid):
+        """Queue a completed call; returns as soon as the job is stored"""
+        self.queue.put(call_sid)
+        with self._lock:
+            self.stats['enqueued'] += 1
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                jobs = self.queue.take(self.batch_size)
+            except sqlite3.Error as e:
+                print(f"Error reading the post-call queue: {e}")
+                jobs = []
+            if not jobs:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                time.sleep(self.batch_wait)
+                continue
+            self.process(jobs)
+
+    def process(self, jobs):
+        """Process a batch of jobs with one read and one batch of writes"""
+        try:
+            calls = self.load_calls([job['call_sid'] for job in jobs])
+            results = []
+            increments = {}
+            for job in jobs:
+                call = calls.get(job['call_sid'])
+                if call is None:
+                    # Already processed (a job taken again after a crash), or a call we never saw
+                    continue
+                responses = call.get('customer_responses') or {}
+                outcome = call_outcome(responses)
+                results.append({**call, 'outcome': outcome, 'completed_at': job['enqueued_at']})
+                for bucket in analytics_buckets(job['enqueued_at']):
+                    count_call(increments.setdefault(call['call_sid'], {}).setdefault(bucket, {}), outcome, responses)
+            if results:
+                self.save(results, increments)
+        except Exception as e:
+            print(f"Error processing {len(jobs)} finished calls, will retry: {e}")
+            self.queue.retry(jobs, f"{type(e).__name__}: {e}", self.max_attempts)
+            with self._lock:
+                self.stats['retries'] += len(jobs)
+            return
+
+        if self.on_processed:
+            for call in results:
+                try:
+                    self.on_processed(call)
+                except Exception as e:
+                    print(f"Error after processing call {call['call_sid']}: {e}")
+        self.queue.ack(jobs)
+
+        now = time.time()
+        with self._lock:
+            self.stats['processed'] += len(results)
+            self.stats['skipped'] += len(jobs) - len(results)
+            self.stats['batches'] += 1
+            for job in jobs:
+                lag = now - job['enqueued_at']
+                self.recent_lag.append(lag)
+                self.metrics.observe_post_call_lag(lag)
+
+    def snapshot(self):
+        """Queue depth, processing lag and batch sizes"""
+        waiting, failed, oldest = self.queue.depth()
+        with self._lock:
+            stats = dict(self.stats)
+            lags = sorted(self.recent_lag)
+        return {
+            **stats,
+            'queue_depth': waiting,
+            'failed_jobs': failed,
+            'oldest_job_age_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'lag_p50_seconds': round(lags[len(lags) // 2], 3) if lags else None,
+            'lag_p95_seconds': round(lags[int(len(lags) * 0.95)], 3) if lags else None,
+            'avg_batch_size': round((stats['processed'] + stats['skipped']) / stats['batches'], 2) if stats['batches'] else 0,
+            'workers': self.workers
+        }
+
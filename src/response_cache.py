@@ -0,0 +1,163 @@
+import os
+import re
+import json
+import time
+import zlib
+import threading
+
+import numpy as np
+
+EMBEDDING_DIM = 1024
+
+# Words that carry little meaning on their own in short caller utterances
+STOPWORDS = {'a', 'an', 'the', 'is', 'are', 'am', 'to', 'of', 'and', 'or', 'it', 'this', 'that', 'i', 'you',
+             'me', 'my', 'your', 'we', 'do', 'does', 'can', 'could', 'would', 'will', 'just', 'so', 'um', 'uh',
+             'well', 'oh', 'be', 'for', 'on', 'in', 'at', 'please', 'sorry', 'hi', 'hello', 'hey', 'ok', 'okay',
+             'yeah', 'like'}
+
+WORD = re.compile(r"[a-z0-9']+")
+
+# Words after one of these (to the end of the clause) are marked negated, so "not interested"
+# and "interested" don't embed alike
+NEGATIONS = {'not', 'no', 'never', 'nothing', "don't", 'dont', "can't", 'cant', "won't", "isn't", "wasn't",
+             "aren't", "doesn't", "didn't", "haven't"}
+CLAUSE = re.compile(r"[^,.;!?]+")
+
+# Conversation stages an answer can apply to
+STAGES = ('opening', 'conversation')
+
+
+def _words(text):
+    """Content words of text, with "!" prepended to the ones in a negated clause"""
+    words = []
+    for clause in CLAUSE.findall(text.lower()):
+        negated = False
+        for w in WORD.findall(clause):
+            if w in NEGATIONS:
+                negated = True
+                words.append('!')
+            elif w not in STOPWORDS:
+                words.append(f"!{w}" if negated else w)
+    return words
+
+
+def _features(text):
+    """Word unigrams and bigrams plus character trigrams, so paraphrases and typos still overlap"""
+    words = _words(text)
+    features = [f"w:{w}" for w in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    for w in words:
+        # Negated words keep the marker on their trigrams too
+        marker, padded = ('!', f"<{w[1:]}>") if w.startswith('!') else ('', f"<{w}>")
+        features += [f"c{marker}:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    return features
+
+
+def embed(text, dim=EMBEDDING_DIM):
+    """Local hashed n-gram embedding, L2-normalized; no model or network call"""
+    features = _features(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    if not features:
+        return vector
+    hashes = np.array([zlib.crc32(f.encode()) for f in features], dtype=np.uint32)
+    signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, hashes % dim, signs)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def conversation_stage(conversation):
+    """Stage of a call before the caller's next utterance is added: replying to the greeting, or later"""
+    if conversation.get('summary') or any(m['role'] == 'user' for m in conversation.get('history', [])):
+        return 'conversation'
+    return 'opening'
+
+
+class ResponseCache:
+    def __init__(self, bank_path=None, threshold=None, margin=None, dim=EMBEDDING_DIM):
+        """Semantic cache of approved answers, looked up by similarity to example utterances
+
+        The answer bank is a JSON file of {"answers": [{"id", "answer", "examples", "stages",
+        "fields"}]}. Each stage gets its own matrix of normalized example
+        embeddings, so a lookup is one matrix-vector product. A hit needs a cosine similarity of
+        at least threshold and must beat the best example of any other answer by margin.
+        """
+        self.bank_path = (bank_path or os.environ.get('RESPONSE_CACHE_BANK')
+                          or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'answer_bank.json'))
+        self.threshold = threshold if threshold is not None else float(os.environ.get('RESPONSE_CACHE_THRESHOLD', 0.65))
+        self.margin = margin if margin is not None else float(os.environ.get('RESPONSE_CACHE_MARGIN', 0.05))
+        self.dim = dim
+
+        with open(self.bank_path) as f:
+            self.answers = json.load(f)['answers']
+
+        # Per stage: example embeddings and the index of the answer each example belongs to
+        self.index = {}
+        for stage in STAGES:
+            rows, owners = [], []
+            for position, answer in enumerate(self.answers):
+                if stage in answer.get('stages', STAGES):
+                    rows += [embed(example, dim) for example in answer['examples']]
+                    owners += [position] * len(answer['examples'])
+            self.index[stage] = (np.array(rows, dtype=np.float32).reshape(-1, dim), np.array(owners, dtype=np.int32))
+
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'hits': 0, 'ambiguous': 0, 'llm_calls': 0, 'llm_seconds': 0.0,
+                      'lookup_seconds': 0.0, 'hits_by_answer': {}}
+
+    def lookup(self, text, stage):
+        """Return (answer, similarity) for a confident match, or (None, best similarity)"""
+        start = time.perf_counter()
+        matrix, owners = self.index.get(stage, self.index[STAGES[-1]])
+        answer, similarity, ambiguous = None, 0.0, False
+        if len(owners):
+            scores = matrix @ embed(text, self.dim)
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            others = scores[owners != owners[best]]
+            runner_up = float(others.max()) if len(others) else 0.0
+            if similarity >= self.threshold:
+                if similarity - runner_up >= self.margin:
+                    answer = self.answers[owners[best]]
+                else:
+                    ambiguous = True
+
+        with self._lock:
+            self.stats['lookups'] += 1
+            self.stats['lookup_seconds'] += time.perf_counter() - start
+            if answer is not None:
+                self.stats['hits'] += 1
+                self.stats['hits_by_answer'][answer['id']] = self.stats['hits_by_answer'].get(answer['id'], 0) + 1
+            elif ambiguous:
+                self.stats['ambiguous'] += 1
+        return answer, similarity
+
+    def record_llm_call(self, seconds):
+        """Time a miss spent on the LLM, used to estimate what hits saved"""
+        with self._lock:
+            self.stats['llm_calls'] += 1
+            self.stats['llm_seconds'] += seconds
+
+    def phrases(self):
+        """Every cached answer, for pre-rendering TTS audio"""
+        return [answer['answer'] for answer in self.answers]
+
+    def snapshot(self):
+        """Hit rate, thresholds and estimated latency saved"""
+        with self._lock:
+            stats = dict(self.stats, hits_by_answer=dict(self.stats['hits_by_answer']))
+        average_llm = stats['llm_seconds'] / stats['llm_calls'] if stats['llm_calls'] else 0.0
+        average_lookup = stats['lookup_seconds'] / stats['lookups'] if stats['lookups'] else 0.0
+        return {
+            'threshold': self.threshold,
+            'margin': self.margin,
+            'answers': len(self.answers),
+            'lookups': stats['lookups'],
+            'hits': stats['hits'],
+            'ambiguous': stats['ambiguous'],
+            'hit_rate': round(stats['hits'] / stats['lookups'], 3) if stats['lookups'] else 0.0,
+            'avg_lookup_ms': round(average_lookup * 1000, 3),
+            'avg_llm_ms': round(average_llm * 1000, 1),
+            'seconds_saved': round(stats['hits'] * max(0.0, average_llm - average_lookup), 2),
+            'hits_by_answer': stats['hits_by_answer']
+        }
@@ -0,0 +1,111 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class SessionCache:
+    def __init__(self, loader=None, max_sessions=None, ttl=None, shared=None):
+        """Bounded in-process cache of live call sessions keyed by call_sid
+
+        Entries are evicted least-recently-used once max_sessions is reached, after
+        ttl seconds without access, or explicitly when the call completes. On a miss
+        the optional loader(call_sid) rebuilds the session from MongoDB.
+
+        With shared=True (SESSION_STORE=shared) and a loader, MongoDB is the source of
+        truth: every get() reloads the session and nothing is kept in-process, so any
+        worker process can serve any turn of a call.
+        """
+        self.loader = loader
+        self.max_sessions = max_sessions or int(os.environ.get('SESSION_CACHE_MAX_SESSIONS', 5000))
+        self.ttl = ttl or float(os.environ.get('SESSION_CACHE_TTL', 1800))
+        if shared is None:
+            shared = os.environ.get('SESSION_STORE', 'local').lower() == 'shared'
+        self.shared = shared and loader is not None
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, call_sid, default=None):
+        """Return the cached session, loading it on a miss when a loader is configured"""
+        if self.shared:
+            with self._lock:
+                self.stats['misses'] += 1
+            session = self.loader(call_sid)
+            return default if session is None else session
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(call_sid)
+            if entry is not None and entry[0] >= now:
+                self._sessions.move_to_end(call_sid)
+                self._sessions[call_sid] = (now + self.ttl, entry[1])
+                self.stats['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self._sessions[call_sid]
+                self.stats['expirations'] += 1
+            self.stats['misses'] += 1
+
+        if self.loader is None:
+            return default
+
+        # Load outside the lock so a slow Mongo read doesn't stall other calls
+        session = self.loader(call_sid)
+        if session is None:
+            return default
+        self.put(call_sid, session)
+        return session
+
+    def put(self, call_sid, session):
+        """Insert or replace a session, evicting the least recently used if full"""
+        if self.shared:
+            # The caller writes the session through to MongoDB; another worker may serve the next turn
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[call_sid] = (now + self.ttl, session)
+            self._sessions.move_to_end(call_sid)
+            self._expire(now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def evict(self, call_sid):
+        """Drop a session, e.g. once Twilio reports the call completed"""
+        with self._lock:
+            entry = self._sessions.pop(call_sid, None)
+        return entry[1] if entry else None
+
+    def _expire(self, now):
+        # The least recently used entries sit at the front, so stop at the first live one
+        while self._sessions:
+            call_sid, (expires, _) = next(iter(self._sessions.items()))
+            if expires >= now:
+                break
+            del self._sessions[call_sid]
+            self.stats['expirations'] += 1
+
+    # Dict-style access so the cache can stand in for a plain conversations dict
+    def __contains__(self, call_sid):
+        return self.get(call_sid) is not None
+
+    def __getitem__(self, call_sid):
+        session = self.get(call_sid)
+        if session is None:
+            raise KeyError(call_sid)
+        return session
+
+    def __setitem__(self, call_sid, session):
+        self.put(call_sid, session)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def snapshot(self):
+        """Cache size and hit/miss counters"""
+        with self._lock:
+            return {'size': len(self._sessions), 'max_sessions': self.max_sessions,
+                    'store': 'shared' if self.shared else 'local', **self.stats}
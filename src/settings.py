@@ -0,0 +1,92 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def load_env():
+    """Load .env into os.environ once per process, however many modules ask for it"""
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            load_dotenv()
+            _env_loaded = True
+
+
+def _bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    if value.lower() in ('true', '1', 'yes', 'on'):
+        return True
+    if value.lower() in ('false', '0', 'no', 'off'):
+        return False
+    raise ValueError(f"{name} must be true or false, got {value!r}")
+
+
+def _number(cast, name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a {cast.__name__}, got {value!r}") from None
+
+
+def _mask(value):
+    return '*' * 5 + value[-5:] if value else 'Not found'
+
+
+class Settings:
+    def __init__(self):
+        """App-level configuration, read from the environment once and converted to its types
+
+        A malformed value raises ValueError at startup instead of on the first call that reads it.
+        Components (dialer, caches, LLM pool, ...) still read their own tuning knobs in their
+        constructors, so they can be built with explicit arguments in scripts and benchmarks.
+        """
+        self.twilio_account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
+        self.twilio_auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
+        self.twilio_phone_number = os.environ.get('TWILIO_PHONE_NUMBER')
+        self.openai_api_key = os.environ.get('OPENAI_API_KEY')
+        self.mongo_uri = os.environ.get('MONGO_URI')
+        self.base_url = os.environ.get('BASE_URL')
+        self.port = _number(int, 'PORT', 5000)
+
+        self.mongo_ensure_indexes = _bool('MONGO_ENSURE_INDEXES', True)
+        self.llm_streaming = _bool('LLM_STREAMING', False)
+        self.stream_first_sentence_timeout = _number(float, 'STREAM_FIRST_SENTENCE_TIMEOUT', 8.0)
+        self.stream_next_sentence_timeout = _number(float, 'STREAM_NEXT_SENTENCE_TIMEOUT', 3.0)
+        # Seconds without a reply to speak before a filler phrase is played instead
+        self.llm_filler_after = _number(float, 'LLM_FILLER_AFTER', 2.0)
+        self.response_cache = _bool('RESPONSE_CACHE', False)
+        self.tts_audio_cache = _bool('TTS_AUDIO_CACHE', False)
+        self.conversation_summaries = _bool('CONVERSATION_SUMMARIES', True)
+        self.media_streams = _bool('MEDIA_STREAMS', False)
+
+        # How long a blocking warm-up waits before letting traffic in anyway, and how often failed checks are retried
+        self.warmup_timeout = _number(float, 'WARMUP_TIMEOUT', 10.0)
+        self.warmup_retry_interval = _number(float, 'WARMUP_RETRY_INTERVAL', 5.0)
+
+    def summary(self):
+        """One line for the startup log, with credentials masked"""
+        return (f"TWILIO_ACCOUNT_SID: {_mask(self.twilio_account_sid)}, OPENAI_API_KEY: {_mask(self.openai_api_key)}, "
+                f"MONGO_URI: {_mask(self.mongo_uri)}, BASE_URL: {self.base_url or 'Not found'}")
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    """Process-wide settings, loaded on first use"""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            load_env()
+            _settings = Settings()
+        return _settings
@@ -0,0 +1,150 @@
+import time
+import threading
+
+from settings import get_settings
+
+
+class Lazy:
+    def __init__(self, factory):
+        """Stands in for a client that is only built on first use
+
+        Attribute reads and writes go to the client, so code written against the client itself
+        (db.calls, twilio_client.calls.create, ...) works unchanged.
+        """
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_instance', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = self._factory()
+                    object.__setattr__(self, '_instance', instance)
+        return instance
+
+    @property
+    def created(self):
+        return self._instance is not None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get(), name, value)
+
+
+class Readiness:
+    def __init__(self, timeout=None, retry_interval=None):
+        """Warm-up checks that connect the external clients before a worker takes traffic
+
+        Checks run concurrently, so DNS lookups and TLS handshakes overlap. The worker is ready
+        once every required check has passed; failed checks are retried in the background.
+        """
+        settings = get_settings()
+        self.timeout = timeout if timeout is not None else settings.warmup_timeout
+        self.retry_interval = retry_interval if retry_interval is not None else settings.warmup_retry_interval
+
+        self._lock = threading.Lock()
+        self._checks = []
+        self._tasks = []
+        self._results = {}
+        self._round_done = threading.Event()
+        self._thread = None
+        self.started_at = None
+        self.ready_at = None
+
+    def add_check(self, name, check, required=True):
+        """Register a warm-up step; an optional one is reported but never holds readiness back"""
+        with self._lock:
+            self._checks.append((name, check, required))
+            self._results[name] = {'ok': False, 'required': required, 'attempts': 0, 'seconds': None, 'error': None}
+
+    def on_start(self, task):
+        """Run task in its own thread when warm-up starts, e.g. pre-rendering audio, without waiting for it"""
+        with self._lock:
+            self._tasks.append(task)
+
+    def start(self):
+        """Start warming up in the background, if it hasn't started already"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name='warm-up', daemon=True)
+            self._thread.start()
+            for task in self._tasks:
+                threading.Thread(target=task, daemon=True).start()
+
+    def warm_up(self, timeout=None):
+        """Start warming up and block until the first round is done or the timeout passes"""
+        self.start()
+        self._round_done.wait(self.timeout if timeout is None else timeout)
+        return self.ready
+
+    def _run(self):
+        while True:
+            with self._lock:
+                pending = [(name, check) for name, check, _ in self._checks if not self._results[name]['ok']]
+            threads = [threading.Thread(target=self._attempt, args=(name, check), daemon=True)
+                       for name, check in pending]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self._round_done.set()
+            if self.ready and self.ready_at is None:
+                self.ready_at = time.monotonic()
+                print(f"Ready after {self.ready_at - self.started_at:.2f}s of warm-up")
+            if all(result['ok'] for result in self._results.values()):
+                return
+            time.sleep(self.retry_interval)
+
+    def _attempt(self, name, check):
+        start = time.perf_counter()
+        error = None
+        try:
+            check()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:300]
+        with self._lock:
+            result = self._results[name]
+            if error and error != result['error']:
+                # Retries that keep failing the same way aren't logged again
+                print(f"Warm-up check {name} failed: {error}")
+            result['attempts'] += 1
+            result['seconds'] = round(time.perf_counter() - start, 3)
+            result['ok'] = error is None
+            result['error'] = error
+
+    @property
+    def ready(self):
+        with self._lock:
+            return self._round_done.is_set() and all(result['ok'] for result in self._results.values()
+                                                     if result['required'])
+
+    def snapshot(self):
+        """Readiness and each check's outcome, for the /ready probe"""
+        ready = self.ready
+        with self._lock:
+            return {
+                'ready': ready,
+                'started': self.started_at is not None,
+                'warmup_seconds': round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+                'checks': {name: dict(result) for name, result in self._results.items()}
+            }
+
+
+_readiness = None
+_readiness_lock = threading.Lock()
+
+
+def get_readiness():
+    """Process-wide warm-up checks, shared by the app and the server hooks"""
+    global _readiness
+    with _readiness_lock:
+        if _readiness is None:
+            _readiness = Readiness()
+        return _readiness
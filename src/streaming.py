@@ -0,0 +1,136 @@
+import re
+import time
+import queue
+import threading
+
+# A sentence ends at terminal punctuation followed by whitespace
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+
+# Fragments shorter than this are held back so we don't speak "Sure." and "Mr." as separate turns
+MIN_SENTENCE_CHARS = 12
+
+
+def _cut_sentence(buffer, min_chars):
+    """Index just past the first complete sentence in buffer, or None"""
+    for match in SENTENCE_END.finditer(buffer):
+        if match.end() >= min_chars:
+            return match.end()
+    return None
+
+
+def split_sentences(tokens, min_chars=MIN_SENTENCE_CHARS):
+    """Group a stream of text deltas into complete sentences"""
+    buffer = ''
+    for token in tokens:
+        buffer += token
+        while (cut := _cut_sentence(buffer, min_chars)) is not None:
+            yield buffer[:cut].strip()
+            buffer = buffer[cut:]
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def async_split_sentences(tokens, min_chars=MIN_SENTENCE_CHARS):
+    """split_sentences for an async stream of text deltas"""
+    buffer = ''
+    async for token in tokens:
+        buffer += token
+        while (cut := _cut_sentence(buffer, min_chars)) is not None:
+            yield buffer[:cut].strip()
+            buffer = buffer[cut:]
+
+    if buffer.strip():
+        yield buffer.strip()
+
+
+class StreamingReply:
+    def __init__(self, call_sid, turn=None):
+        """A reply being generated in the background, consumed one sentence at a time"""
+        self.call_sid = call_sid
+        self.turn = turn
+        # Continuation requests handed out so far, numbering each <Redirect>
+        self.steps = 0
+        self.sentences = queue.Queue()
+        self.parts = []
+        self.done = threading.Event()
+        self.error = None
+        self.started_at = time.time()
+
+    def run(self, tokens, on_complete=None):
+        """Consume the token stream, publishing sentences as they complete"""
+        try:
+            for sentence in split_sentences(tokens):
+                self.parts.append(sentence)
+                self.sentences.put(sentence)
+        except Exception as e:
+            print(f"Error streaming reply for {self.call_sid}: {e}")
+            self.error = e
+        finally:
+            try:
+                if on_complete and self.error is None:
+                    on_complete(self.text)
+            finally:
+                self.done.set()
+
+    @property
+    def text(self):
+        return ' '.join(self.parts)
+
+    def next_sentences(self, timeout):
+        """Wait for at least one sentence, then drain whatever else is ready"""
+        sentences = []
+        deadline = time.time() + timeout
+        while not sentences:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            if self.done.is_set() and self.sentences.empty():
+                break
+            try:
+                sentences.append(self.sentences.get(timeout=min(remaining, 0.05)))
+            except queue.Empty:
+                continue
+
+        while True:
+            try:
+                sentences.append(self.sentences.get_nowait())
+            except queue.Empty:
+                break
+        return sentences
+
+    @property
+    def finished(self):
+        """True once generation is over and every sentence has been handed out"""
+        return self.done.is_set() and self.sentences.empty()
+
+
+class StreamingReplies:
+    def __init__(self, max_age=120):
+        """Registry of in-flight streaming replies keyed by call_sid"""
+        self._lock = threading.Lock()
+        self._replies = {}
+        self.max_age = max_age
+
+    def start(self, call_sid, tokens, on_complete=None, turn=None):
+        """Start generating a reply in a background thread"""
+        reply = StreamingReply(call_sid, turn)
+        with self._lock:
+            self._expire()
+            self._replies[call_sid] = reply
+        threading.Thread(target=reply.run, args=(tokens, on_complete), daemon=True).start()
+        return reply
+
+    def get(self, call_sid):
+        with self._lock:
+            return self._replies.get(call_sid)
+
+    def finish(self, call_sid):
+        with self._lock:
+            self._replies.pop(call_sid, None)
+
+    def _expire(self):
+        # Drop replies for calls that hung up mid-stream
+        cutoff = time.time() - self.max_age
+        for call_sid in [sid for sid, r in self._replies.items() if r.started_at < cutoff]:
+            del self._replies[call_sid]
@@ -1,15 +1,57 @@
 import os
+import time
 import asyncio
+import argparse
+import threading
 import edge_tts
 import tempfile
-from dotenv import load_dotenv
+from audio_cache import AudioCache, audio_key
+from settings import load_env
 
 # Load environment variables
-load_dotenv()
+load_env()
 
-class TextToSpeech:
+# Edge TTS renders 24kHz mono mp3 by default
+AUDIO_FORMAT = 'mp3'
+
+class EventLoopThread:
     def __init__(self):
-        """Initialize TTS service"""
+        """A long-lived event loop in a daemon thread that synchronous callers submit coroutines to"""
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True, name='tts-loop')
+        self.thread.start()
+    
+    def run(self, coro):
+        """Run a coroutine on the loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def iterate(self, agen):
+        """Drive an async generator from synchronous code, one item at a time"""
+        try:
+            while True:
+                try:
+                    yield self.run(agen.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Runs when the consumer stops early too, so the synthesis request is cancelled
+            self.run(agen.aclose())
+
+_event_loop_thread = None
+_event_loop_lock = threading.Lock()
+
+def get_event_loop_thread():
+    """Return the process-wide TTS event loop, starting it on first use"""
+    global _event_loop_thread
+    if _event_loop_thread is None:
+        with _event_loop_lock:
+            if _event_loop_thread is None:
+                _event_loop_thread = EventLoopThread()
+    return _event_loop_thread
+
+class TextToSpeech:
+    def __init__(self, cache=None):
+        """Initialize TTS service, optionally backed by an AudioCache of rendered phrases"""
         self.voice = os.environ.get('TTS_VOICE')
         if not self.voice:
             print("TTS_VOICE not found in environment variables, using default")
@@ -21,6 +63,76 @@ class TextToSpeech:
             
         # Create output directory if it doesn't exist
         os.makedirs(self.output_dir, exist_ok=True)
+        
+        self.cache = cache
+    
+    def cache_key(self, text):
+        """Key of the rendered audio for text in this voice"""
+        return audio_key(self.voice, text, AUDIO_FORMAT)
+    
+    def synthesize(self, text):
+        """Return the audio for text, from the cache when it has already been rendered"""
+        key = self.cache_key(text)
+        if self.cache:
+            audio_data = self.cache.get(key)
+            if audio_data is not None:
+                return audio_data
+        
+        start = time.perf_counter()
+        audio_data = self._render(text)
+        if self.cache:
+            self.cache.put(key, audio_data, synth_seconds=time.perf_counter() - start)
+        return audio_data
+    
+    def warm(self, phrases):
+        """Pre-render phrases that aren't cached yet; returns how many were synthesized"""
+        rendered = 0
+        for text in phrases:
+            if self.cache and self.cache.contains(self.cache_key(text)):
+                continue
+            self.synthesize(text)
+            rendered += 1
+        return rendered
+    
+    def _communicate(self, text):
+        """The Edge TTS request for text"""
+        return edge_tts.Communicate(text, self.voice)
+    
+    async def _stream_chunks(self, text):
+        """Yield audio chunks as Edge TTS produces them"""
+        async for chunk in self._communicate(text).stream():
+            if chunk['type'] == 'audio':
+                yield chunk['data']
+    
+    async def stream_audio(self, text):
+        """Async generator of audio chunks for text, served from the cache when rendered before"""
+        key = self.cache_key(text)
+        if self.cache:
+            audio_data = self.cache.get(key)
+            if audio_data is not None:
+                yield audio_data
+                return
+        
+        start = time.perf_counter()
+        chunks = []
+        async for chunk in self._stream_chunks(text):
+            if self.cache:
+                chunks.append(chunk)
+            yield chunk
+        
+        if self.cache:
+            self.cache.put(key, b''.join(chunks), synth_seconds=time.perf_counter() - start)
+    
+    def iter_audio(self, text):
+        """Synchronous iterator of audio chunks for text, driven by the shared event loop"""
+        return get_event_loop_thread().iterate(self.stream_audio(text))
+    
+    def _render(self, text):
+        """Synthesize text into memory"""
+        return get_event_loop_thread().run(self._async_render(text))
+    
+    async def _async_render(self, text):
+        return b''.join([chunk async for chunk in self._stream_chunks(text)])
     
     def text_to_speech(self, text, output_file=None):
         """Convert text to speech and save to file"""
@@ -30,26 +142,34 @@ class TextToSpeech:
             output_file = temp_file.name
             temp_file.close()
         
-        # Run the async TTS function
-        asyncio.run(self._async_tts(text, output_file))
+        # Run the async TTS function on the shared event loop
+        get_event_loop_thread().run(self._async_tts(text, output_file))
         
         return output_file
     
     async def _async_tts(self, text, output_file):
         """Async function to generate speech"""
-        communicate = edge_tts.Communicate(text, self.voice)
-        await communicate.save(output_file)
+        with open(output_file, 'wb') as f:
+            async for chunk in self._stream_chunks(text):
+                f.write(chunk)
     
     def text_to_speech_stream(self, text):
-        """Convert text to speech and return as stream"""
-        # For streaming, we'll first save to a file and then read it
-        output_file = self.text_to_speech(text)
-        
-        # Read the file and return its contents
-        with open(output_file, 'rb') as f:
-            audio_data = f.read()
-        
-        # Clean up the temporary file
-        os.unlink(output_file)
-        
-        return audio_data
+        """Convert text to speech and yield audio chunks as they are synthesized"""
+        return self.iter_audio(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the cache of pre-rendered TTS audio")
+    parser.add_argument('command', choices=['warm', 'stats'])
+    parser.add_argument('--phrases-file', help="Extra phrases to pre-render, one per line")
+    args = parser.parse_args()
+    
+    from call_flow import canned_phrases
+    
+    cache = AudioCache()
+    if args.command == 'warm':
+        phrases = canned_phrases(args.phrases_file)
+        start = time.perf_counter()
+        rendered = TextToSpeech(cache=cache).warm(phrases)
+        print(f"Rendered {rendered} of {len(phrases)} phrases in {time.perf_counter() - start:.1f}s into {cache.cache_dir}")
+    else:
+        print(cache.snapshot())
@@ -0,0 +1,101 @@
+import os
+
+import numpy as np
+
+# Endpointer events
+SPEECH_START = 'speech_start'
+EARLY_END = 'early_end'
+RESUME = 'resume'
+END = 'end'
+
+FRAME_MS = 20
+
+
+def frame_energies_db(pcm, frame_samples=160):
+    """Energy in dBFS of every whole frame of int16 PCM, computed in one pass"""
+    frames = len(pcm) // frame_samples
+    blocks = np.asarray(pcm[:frames * frame_samples], dtype=np.float32).reshape(frames, frame_samples)
+    power = np.mean(np.square(blocks), axis=1) / (32768.0 ** 2)
+    return 10 * np.log10(np.maximum(power, 1e-10))
+
+
+class Endpointer:
+    def __init__(self, threshold_db=None, noise_margin_db=None, hangover_ms=None, early_ms=None,
+                 min_speech_ms=None, resume_ms=None):
+        """Energy VAD with an adaptive noise floor, hangover and an early (speculative) endpoint
+
+        A frame is speech when it is louder than threshold_db and noise_margin_db above the
+        running noise floor. After speech, EARLY_END fires once early_ms of silence has passed
+        and END once hangover_ms has; speech of at least resume_ms in between emits RESUME.
+        """
+        self.threshold_db = threshold_db if threshold_db is not None else float(os.environ.get('VAD_THRESHOLD_DB', -40))
+        self.noise_margin_db = noise_margin_db if noise_margin_db is not None else float(os.environ.get('VAD_NOISE_MARGIN_DB', 12))
+        hangover_ms = hangover_ms or int(os.environ.get('VAD_HANGOVER_MS', 600))
+        early_ms = early_ms or int(os.environ.get('VAD_EARLY_ENDPOINT_MS', 250))
+        min_speech_ms = min_speech_ms or int(os.environ.get('VAD_MIN_SPEECH_MS', 100))
+        resume_ms = resume_ms or int(os.environ.get('VAD_RESUME_MS', 60))
+
+        self.hangover_frames = max(1, hangover_ms // FRAME_MS)
+        # An early endpoint at or past the hangover would never be speculative
+        self.early_frames = min(max(1, early_ms // FRAME_MS), self.hangover_frames - 1)
+        self.min_speech_frames = max(1, min_speech_ms // FRAME_MS)
+        self.resume_frames = max(1, resume_ms // FRAME_MS)
+
+        self.noise_db = self.threshold_db - self.noise_margin_db
+        self.reset()
+
+    def reset(self):
+        """Forget the current utterance but keep the noise floor"""
+        self.in_speech = False
+        self.early = False
+        self.speech_run = 0
+        self.silence_run = 0
+
+    def is_speech(self, energy_db):
+        speech = energy_db > max(self.threshold_db, self.noise_db + self.noise_margin_db)
+        if not speech:
+            # Track the background level slowly so line noise doesn't read as speech
+            self.noise_db += 0.05 * (energy_db - self.noise_db)
+        return speech
+
+    def update(self, energy_db):
+        """Advance by one frame; returns an event name or None"""
+        if self.is_speech(energy_db):
+            self.speech_run += 1
+            self.silence_run = 0
+        else:
+            self.silence_run += 1
+            self.speech_run = 0
+
+        if not self.in_speech:
+            if self.speech_run >= self.min_speech_frames:
+                self.in_speech = True
+                return SPEECH_START
+            return None
+
+        if self.early:
+            if self.speech_run >= self.resume_frames:
+                self.early = False
+                return RESUME
+            if self.silence_run >= self.hangover_frames:
+                self.reset()
+                return END
+            return None
+
+        if self.silence_run >= self.early_frames:
+            self.early = True
+            return EARLY_END
+        return None
+
+    def process(self, pcm):
+        """Advance by one 20ms frame of int16 PCM"""
+        return self.update(frame_energies_db(pcm, len(pcm))[0])
+
+    def run(self, pcm):
+        """Events for a whole recording as (frame_index, event) pairs"""
+        events = []
+        for index, energy_db in enumerate(frame_energies_db(pcm)):
+            event = self.update(energy_db)
+            if event:
+                events.append((index, event))
+        return events
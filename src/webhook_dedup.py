@@ -0,0 +1,118 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class WebhookDeduplicator:
+    def __init__(self, ttl=None, wait_timeout=None, max_entries=None):
+        """TwiML already rendered for a webhook request, keyed by call_sid and turn sequence
+
+        Twilio retries a webhook that times out. A retry of a request that has been answered
+        gets the same TwiML back; a retry that arrives while the original is still running
+        waits for it instead of running the turn (and the LLM call) a second time. Entries are
+        kept for ttl seconds from the first request, oldest first out once max_entries is reached;
+        a replay doesn't extend an entry, since Twilio's retries all come soon after the original.
+        """
+        self.ttl = ttl or float(os.environ.get('WEBHOOK_DEDUP_TTL', 300))
+        # Longer than Twilio's 15 second webhook timeout, so a retry outlasts the original
+        self.wait_timeout = wait_timeout or float(os.environ.get('WEBHOOK_DEDUP_WAIT', 20))
+        self.max_entries = max_entries or int(os.environ.get('WEBHOOK_DEDUP_MAX_ENTRIES', 20000))
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'replayed': 0, 'waited': 0, 'failed': 0}
+
+    def run(self, key, render):
+        """The TwiML for key: cached, the in-flight original's, or render()'s when this is the first request"""
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                self.stats['requests'] += 1
+                entry = self._entries.get(key)
+                if entry is not None and entry['expires'] < now:
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    entry = {'expires': now + self.ttl, 'done': threading.Event(), 'twiml': None}
+                    self._entries[key] = entry
+                    self._expire(now)
+                    break
+                self.stats['replayed' if entry['done'].is_set() else 'waited'] += 1
+            if entry['done'].wait(self.wait_timeout) and entry['twiml'] is not None:
+                return entry['twiml']
+            with self._lock:
+                # The original failed or is stuck; this request runs the turn itself
+                self.stats['requests'] -= 1
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+
+        try:
+            entry['twiml'] = render()
+        except BaseException:
+            with self._lock:
+                self.stats['failed'] += 1
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            raise
+        finally:
+            entry['done'].set()
+        return entry['twiml']
+
+    def _expire(self, now):
+        # Oldest entries sit at the front, so stop at the first live one
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry['expires'] >= now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def snapshot(self):
+        """Requests seen, retries answered from the cache or by waiting, and cache size"""
+        with self._lock:
+            return {**self.stats, 'size': len(self._entries), 'ttl': self.ttl}
+
+
+class AsyncWebhookDeduplicator(WebhookDeduplicator):
+    """WebhookDeduplicator for the async server, where a retry awaits the original instead of blocking"""
+
+    async def run(self, key, render):
+        """The TwiML for key: cached, the in-flight original's, or that of awaiting render() when first"""
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                self.stats['requests'] += 1
+                entry = self._entries.get(key)
+                if entry is not None and entry['expires'] < now:
+                    del self._entries[key]
+                    entry = None
+                if entry is None:
+                    entry = {'expires': now + self.ttl, 'done': asyncio.Event(), 'twiml': None}
+                    self._entries[key] = entry
+                    self._expire(now)
+                    break
+                self.stats['replayed' if entry['done'].is_set() else 'waited'] += 1
+            try:
+                await asyncio.wait_for(entry['done'].wait(), self.wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+            if entry['done'].is_set() and entry['twiml'] is not None:
+                return entry['twiml']
+            with self._lock:
+                # The original failed or is stuck; this request runs the turn itself
+                self.stats['requests'] -= 1
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+
+        try:
+            entry['twiml'] = await render()
+        except BaseException:
+            with self._lock:
+                self.stats['failed'] += 1
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            raise
+        finally:
+            entry['done'].set()
+        return entry['twiml']
@@ -0,0 +1,28 @@
+import time
+from unittest import mock
+
+import mongomock
+
+import asgi_app
+from database import Database
+from post_call import JobQueue
+
+
+def test_finished_call_schedules_the_callback_it_asked_for(monkeypatch):
+    monkeypatch.setenv('MONGO_URI', 'mongodb://localhost:27017')
+    with mock.patch('database.MongoClient', mongomock.MongoClient):
+        db = Database(write_behind=False)
+    monkeypatch.setattr(asgi_app, 'blocking_db', db)
+    monkeypatch.setattr(asgi_app.post_call, 'queue', JobQueue(':memory:'))
+
+    db.customers.insert_one({'_id': 'customer-1', 'phone_number': '+15550100', 'timezone': 'UTC'})
+    db.calls.insert_one({'call_sid': 'CAcallback', 'customer_id': 'customer-1', 'phone_number': '+15550100',
+                         'status': 'completed',
+                         'customer_responses': {'interest_level': 'high', 'callback_time': 'tomorrow at 10am'}})
+
+    asgi_app.post_call.process([{'id': 1, 'call_sid': 'CAcallback', 'enqueued_at': time.time(), 'attempts': 0}])
+
+    customer = db.customers.find_one({'_id': 'customer-1'})
+    assert customer['callback_at'] > time.time()
+    assert customer['next_call_at'] == customer['callback_at']
+    assert db.calls.find_one({'call_sid': 'CAcallback'})['post_call_at']
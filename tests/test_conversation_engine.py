@@ -0,0 +1,139 @@
+import re
+import asyncio
+
+from call_flow import SYSTEM_PROMPT
+from context_builder import ContextBuilder
+from conversation_engine import (CONTINUE_WAIT_STEPS, AsyncConversationEngine, AsyncTurnStore, ConversationEngine,
+                                 SessionStore)
+from session_cache import SessionCache
+from settings import Settings
+from webhook_dedup import AsyncWebhookDeduplicator, WebhookDeduplicator
+
+CALL_SID = 'CAtest'
+FALLBACK = "Could you say that again?"
+
+
+class FlakyLLM:
+    """Stands in for ModelRouter: the first `failures` replies raise, the rest are numbered answers"""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.answered = 0
+
+    def generate(self, messages, call_sid=None, stream=True, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            return self._fail()
+        self.answered += 1
+        return iter([f"Answer {self.answered}. ", "Anything else?"])
+
+    def _fail(self):
+        raise TimeoutError("no model answered in time")
+        yield
+
+    async def chat(self, messages, call_sid=None, **kwargs):
+        """AsyncModelRouter.chat: the whole reply, or the error it gave up with"""
+        return ' '.join(self.generate(messages, call_sid, stream=False))
+
+
+class TurnDatabase:
+    """Stands in for AsyncDatabase: the history and message count get_turn_context reads back"""
+
+    def __init__(self):
+        self.history = []
+
+    async def get_turn_context(self, call_sid, max_turns):
+        return {'call_sid': call_sid, 'history': self.history[-2 * max_turns:], 'summary': None,
+                'turns': len(self.history) // 2}
+
+    async def append_turns(self, call_sid, messages):
+        self.history.extend(messages)
+
+
+def engine_settings(streaming=False):
+    settings = Settings()
+    settings.llm_streaming = streaming
+    settings.llm_filler_after = 5
+    return settings
+
+
+def new_engine(llm, streaming=False):
+    return ConversationEngine(store=SessionStore(SessionCache()), llm=llm, context=ContextBuilder(SYSTEM_PROMPT),
+                              settings=engine_settings(streaming))
+
+
+def next_turn(twiml):
+    """The turn number the TwiML's <Gather> posts the caller's next utterance with"""
+    return int(re.search(r'/handle-call\?[^"]*turn=(\d+)', twiml).group(1))
+
+
+def post_turn(engine, webhooks, utterance, turn):
+    """/handle-call as the Flask app serves it, through the webhook deduplicator"""
+    key = ('/handle-call', CALL_SID, str(turn), None)
+    return webhooks.run(key, lambda: engine.handle_turn(CALL_SID, utterance, turn))
+
+def play_turns(engine, webhooks, turn, utterances):
+    """Post each utterance with the turn the previous <Gather> asked for; each must get a fresh answer"""
+    for number, utterance in enumerate(utterances, 1):
+        twiml = post_turn(engine, webhooks, utterance, turn)
+        assert f"Answer {number}." in twiml
+        assert next_turn(twiml) == turn + 1
+        turn += 1
+
+
+def test_turns_after_a_fallback_get_fresh_replies():
+    llm = FlakyLLM(failures=1)
+    engine, webhooks = new_engine(llm), WebhookDeduplicator()
+
+    twiml = post_turn(engine, webhooks, "Hi, who is this?", 1)
+    assert FALLBACK in twiml
+    assert next_turn(twiml) == 2
+    play_turns(engine, webhooks, 2, ["What does it cost?", "Is there a free trial?"])
+    assert llm.calls == 3
+
+
+def test_streamed_fallback_moves_the_turn_on():
+    llm = FlakyLLM(failures=1)
+    engine, webhooks = new_engine(llm, streaming=True), WebhookDeduplicator()
+
+    twiml = post_turn(engine, webhooks, "Hi, who is this?", 1)
+    assert FALLBACK in twiml
+    assert next_turn(twiml) == 2
+    play_turns(engine, webhooks, 2, ["What does it cost?", "Is there a free trial?"])
+
+
+def test_continue_that_gives_up_moves_the_turn_on():
+    # The reply to turn 1 was started on another worker and never stored
+    llm = FlakyLLM()
+    engine, webhooks = new_engine(llm), WebhookDeduplicator()
+
+    twiml = engine.handle_continue(CALL_SID, turn=1, step=CONTINUE_WAIT_STEPS)
+    assert '<Redirect' not in twiml
+    assert next_turn(twiml) == 2
+    play_turns(engine, webhooks, 2, ["What does it cost?", "Is there a free trial?"])
+
+
+def test_async_fallback_moves_the_turn_on():
+    llm = FlakyLLM(failures=1)
+    engine = AsyncConversationEngine(AsyncTurnStore(TurnDatabase(), 4), llm, ContextBuilder(SYSTEM_PROMPT),
+                                     settings=engine_settings())
+    webhooks = AsyncWebhookDeduplicator()
+
+    async def post(utterance, turn):
+        key = ('/handle-call', CALL_SID, str(turn), None)
+        return await webhooks.run(key, lambda: engine.handle_turn(CALL_SID, utterance, turn))
+
+    async def play():
+        twiml = await post("Hi, who is this?", 1)
+        assert FALLBACK in twiml
+        turn = next_turn(twiml)
+        assert turn == 2
+        for number, utterance in enumerate(["What does it cost?", "Is there a free trial?"], 1):
+            twiml = await post(utterance, turn)
+            assert f"Answer {number}." in twiml
+            assert next_turn(twiml) == turn + 1
+            turn += 1
+
+    asyncio.run(play())
+    assert llm.calls == 3
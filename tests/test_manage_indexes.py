@@ -0,0 +1,45 @@
+from manage_indexes import explain, plan_stages
+
+IXSCAN_PLAN = {'stage': 'LIMIT', 'inputStage': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN'}}}
+
+
+class Cursor:
+    def __init__(self, winning_plan):
+        self.winning_plan = winning_plan
+
+    def explain(self):
+        return {'queryPlanner': {'winningPlan': self.winning_plan}}
+
+
+class Database:
+    def __init__(self, *winning_plans):
+        self.winning_plans = winning_plans
+
+    def hot_queries(self):
+        return [(f"query {number}", Cursor(plan)) for number, plan in enumerate(self.winning_plans)]
+
+
+def test_plan_stages_classic_engine():
+    assert plan_stages(IXSCAN_PLAN) == ['LIMIT', 'FETCH', 'IXSCAN']
+
+
+def test_plan_stages_slot_based_engine():
+    plan = {'queryPlan': IXSCAN_PLAN, 'slotBasedPlan': {'slots': '...', 'stages': '...'}}
+    assert plan_stages(plan) == ['LIMIT', 'FETCH', 'IXSCAN']
+
+
+def test_plan_stages_branches():
+    plan = {'stage': 'OR', 'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'COLLSCAN'}]}
+    assert plan_stages(plan) == ['OR', 'IXSCAN', 'COLLSCAN']
+
+
+def test_explain_passes_index_scans():
+    assert explain(Database(IXSCAN_PLAN, {'queryPlan': IXSCAN_PLAN})) == 0
+
+
+def test_explain_fails_collection_scan():
+    assert explain(Database(IXSCAN_PLAN, {'stage': 'COLLSCAN'})) == 1
+
+
+def test_explain_fails_plan_without_stages():
+    assert explain(Database({'slotBasedPlan': {}})) == 1